@@ -0,0 +1,356 @@
+"""
+Load test: runs the real bot (bot.build_application, with every handler) against a stand-in for the
+Telegram Bot API and an in-memory fake of Google Sheets (see budgeter/fakesheets.py),
+and has many simulated users go through /start, /spend and /stats at the same time.
+
+Reports throughput, latency percentiles for each step, and peak memory. For example:
+
+    python benchmarks/loadtest.py --users 1000 --sheets-latency 0.3 --telegram-latency 0.05
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import resource
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from telegram import Update
+from telegram.ext import Application, PersistenceInput, TypeHandler
+from telegram.request import BaseRequest, RequestData
+from budgeter.fakesheets import FakeClient
+from budgeter.quota import (
+    QuotaManager,
+    DEFAULT_READS_PER_MINUTE,
+    DEFAULT_WRITES_PER_MINUTE,
+)
+from budgeter.outbox import SpendOutbox
+from budgeter.mirror import SpendingMirror
+from budgeter.persistence import SQLitePersistence
+from budgeter.bothandlers.start import USE_EXISTING_SHEET_OPTION
+from synthetic import make_sheet
+from bot import build_application
+
+TOKEN = "123456:loadtest"
+# where the error handler sends errors
+ADMIN_USER_ID = 1
+FIRST_USER_ID = 1_000_000
+
+# what each user does, in order: (step name, message text)
+STEPS = [
+    ("start", "/start"),
+    ("use_existing_spreadsheet", USE_EXISTING_SHEET_OPTION),
+    ("give_spreadsheet_id", None),  # the user's spreadsheet url
+    ("spend", "/spend"),
+    ("give_data", "12.50"),
+    ("stats", "/stats"),
+]
+
+
+def spreadsheet_url(user_id: int):
+    return f"https://docs.google.com/spreadsheets/d/loadtest{user_id}/edit"
+
+
+class FakeTelegramRequest(BaseRequest):
+    """
+    Stands in for the Telegram Bot API: answers every method the bot uses with a plausible result,
+    after `latency` seconds, and counts the calls.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = {}
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, chat_id, **fields):
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            **fields,
+        }
+
+    def _photo(self):
+        self._message_id += 1
+        return [
+            {
+                "file_id": f"photo{self._message_id}",
+                "file_unique_id": f"photo{self._message_id}",
+                "width": 640,
+                "height": 480,
+            }
+        ]
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        parameters = request_data.parameters if request_data is not None else {}
+        chat_id = parameters.get("chat_id", 0)
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if api_method == "getMe":
+            result = {
+                "id": int(TOKEN.split(":")[0]),
+                "is_bot": True,
+                "first_name": "Budgeter",
+                "username": "loadtest_bot",
+            }
+        elif api_method in ("sendMessage", "editMessageText"):
+            result = self._message(chat_id, text=parameters.get("text", ""))
+        elif api_method == "sendPhoto":
+            result = self._message(chat_id, photo=self._photo())
+        elif api_method == "sendMediaGroup":
+            media = parameters.get("media", [])
+            if isinstance(media, str):
+                media = json.loads(media)
+            result = [self._message(chat_id, photo=self._photo()) for _ in media]
+        else:
+            # sendChatAction and the like
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class SimulatedUsers:
+    """
+    Sends the simulated users' messages to the bot, and times how long the bot takes to handle each one.
+    """
+
+    def __init__(self, application: Application):
+        self.application = application
+        self.latencies = {name: [] for name, _ in STEPS}
+        self._update_id = 0
+        self._handled = {}
+        # runs after whichever handler (in group 0) handled the update
+        application.add_handler(TypeHandler(Update, self._mark_handled), group=1)
+
+    async def _mark_handled(self, update: Update, context):
+        handled = self._handled.pop(update.update_id, None)
+        if handled is not None:
+            handled.set_result(time.perf_counter())
+
+    async def send(self, user_id: int, text: str):
+        """Sends a message to the bot, as a user, and waits until it has been handled.
+
+        Returns:
+            float: How long the bot took to handle it, including waiting its turn (seconds).
+        """
+        self._update_id += 1
+        message = {
+            "message_id": self._update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [
+                {"type": "bot_command", "offset": 0, "length": len(text)}
+            ]
+        update = Update.de_json(
+            {"update_id": self._update_id, "message": message}, self.application.bot
+        )
+        handled = asyncio.get_running_loop().create_future()
+        self._handled[update.update_id] = handled
+        sent_at = time.perf_counter()
+        await self.application.update_queue.put(update)
+        return await handled - sent_at
+
+    async def run_user(self, user_id: int, start_after: float, think_time: float):
+        await asyncio.sleep(start_after)
+        for name, text in STEPS:
+            latency = await self.send(
+                user_id, spreadsheet_url(user_id) if text is None else text
+            )
+            self.latencies[name].append(latency)
+            await asyncio.sleep(random.uniform(0, think_time))
+
+
+def percentile(values: list[float], percent: float):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(percent) - 1]
+
+
+async def run(args: argparse.Namespace):
+    random.seed(args.seed)
+    spreadsheet_client = FakeClient(
+        latency=args.sheets_latency,
+        jitter=args.sheets_jitter,
+        quota_error_rate=args.sheets_quota_error_rate,
+        server_error_rate=args.sheets_server_error_rate,
+        create_missing=False,
+        seed=args.seed,
+    )
+    # every user's data stops the day before yesterday, so /spend asks them for yesterday
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    first_date = today - datetime.timedelta(days=args.days + 1)
+    user_ids = range(FIRST_USER_ID, FIRST_USER_ID + args.users)
+    for user_id in user_ids:
+        spreadsheet_client.create(
+            f"loadtest{user_id}", make_sheet(args.days, user_id, first_date)
+        )
+
+    telegram = FakeTelegramRequest(latency=args.telegram_latency)
+    with tempfile.TemporaryDirectory() as directory:
+        application = build_application(
+            TOKEN,
+            SQLitePersistence(
+                filepath=os.path.join(directory, "bot_data.sqlite3"),
+                store_data=PersistenceInput(bot_data=False),
+            ),
+            spreadsheet_client,
+            SpendOutbox(filepath=os.path.join(directory, "spend_outbox.sqlite3")),
+            SpendingMirror(filepath=os.path.join(directory, "spending_mirror.sqlite3")),
+            admin_user_id=ADMIN_USER_ID,
+            request=telegram,
+        )
+        users = SimulatedUsers(application)
+        # what run_polling does, without polling
+        await application.initialize()
+        await application.post_init(application)
+        application.bot_data["spreadsheet_quota"] = QuotaManager(
+            reads_per_minute=args.sheets_reads_per_minute,
+            writes_per_minute=args.sheets_writes_per_minute,
+        )
+        await application.start()
+        try:
+            started_at = time.perf_counter()
+            await asyncio.gather(
+                *(
+                    users.run_user(
+                        user_id, random.uniform(0, args.ramp_up), args.think_time
+                    )
+                    for user_id in user_ids
+                )
+            )
+            elapsed = time.perf_counter() - started_at
+        finally:
+            await application.stop()
+            await application.shutdown()
+            await application.post_shutdown(application)
+
+    report(args, users, elapsed, spreadsheet_client, telegram)
+
+
+def report(
+    args: argparse.Namespace,
+    users: SimulatedUsers,
+    elapsed: float,
+    spreadsheet_client: FakeClient,
+    telegram: FakeTelegramRequest,
+):
+    updates = sum(len(latencies) for latencies in users.latencies.values())
+    print(f"{args.users} users, {updates} updates in {elapsed:.2f}s")
+    print(f"throughput: {updates / elapsed:.1f} updates/s")
+    print()
+    print(
+        f"{'step':<26}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'max (ms)':>10}"
+    )
+    for name, latencies in users.latencies.items():
+        print(
+            f"{name:<26}"
+            + "".join(
+                f"{value * 1000:>10.1f}"
+                for value in (
+                    percentile(latencies, 50),
+                    percentile(latencies, 95),
+                    percentile(latencies, 99),
+                    max(latencies),
+                )
+            )
+        )
+    print()
+    # ru_maxrss is in kilobytes on Linux. Graphs are drawn in other processes, which are not included
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"peak memory (bot process): {peak_memory:.0f} MB")
+    print(f"Google Sheets requests: {spreadsheet_client.requests}")
+    print(f"Telegram requests: {telegram.calls}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=100, help="simulated users")
+    parser.add_argument(
+        "--days", type=int, default=365, help="days of data in each spreadsheet"
+    )
+    parser.add_argument(
+        "--ramp-up",
+        type=float,
+        default=60,
+        help="users start at random times within this many seconds",
+    )
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=1,
+        help="users wait up to this many seconds between messages",
+    )
+    parser.add_argument(
+        "--telegram-latency",
+        type=float,
+        default=0.05,
+        help="seconds each Telegram API call takes",
+    )
+    parser.add_argument(
+        "--sheets-latency",
+        type=float,
+        default=0.2,
+        help="seconds each Google Sheets request takes",
+    )
+    parser.add_argument(
+        "--sheets-jitter",
+        type=float,
+        default=0.2,
+        help="up to this many more seconds, at random",
+    )
+    parser.add_argument(
+        "--sheets-quota-error-rate",
+        type=float,
+        default=0,
+        help="fraction of Google Sheets requests that fail with 429",
+    )
+    parser.add_argument(
+        "--sheets-server-error-rate",
+        type=float,
+        default=0,
+        help="fraction of Google Sheets requests that fail with 5xx",
+    )
+    parser.add_argument(
+        "--sheets-reads-per-minute",
+        type=float,
+        default=DEFAULT_READS_PER_MINUTE,
+        help="the Google Sheets read quota",
+    )
+    parser.add_argument(
+        "--sheets-writes-per-minute",
+        type=float,
+        default=DEFAULT_WRITES_PER_MINUTE,
+        help="the Google Sheets write quota",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from budgeter.spreadsheet import Spreadsheet
+from budgeter.cache import SpreadsheetCache
+from synthetic import ROWS, make_sheet, make_client
+
+URL = "https://docs.google.com/spreadsheets/d/benchmark/edit"
+
+
+@pytest.mark.parametrize("rows", ROWS)
+def test_verify_format(benchmark, rows):
+    data = make_sheet(rows)
+    valid, message = benchmark(Spreadsheet.verify_format, data)
+    assert valid, message
+
+
+@pytest.mark.parametrize("rows", ROWS)
+def test_get_spending_dataframe(benchmark, rows):
+    # no cache, so the whole sheet is parsed every time
+    spreadsheet = Spreadsheet(make_client(make_sheet(rows)), URL)
+    dframe = benchmark(spreadsheet.get_spending_dataframe)
+    assert len(dframe) == rows
+
+
+@pytest.mark.parametrize("rows", ROWS)
+def test_get_spending_dataframe_cached(benchmark, rows):
+    spreadsheet = Spreadsheet(make_client(make_sheet(rows)), URL, SpreadsheetCache())
+    spreadsheet.get_spending_dataframe()
+    dframe = benchmark(spreadsheet.get_spending_dataframe)
+    assert len(dframe) == rows
@@ -0,0 +1,50 @@
+import os
+import sys
+import datetime
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from budgeter.spreadsheet import rows_to_dataframe
+from budgeter.aggregates import SpendingAggregates
+from budgeter.charts import CHART_KINDS, render_chart
+from synthetic import ROWS, make_sheet
+
+
+def make_dataframe(rows: int):
+    return rows_to_dataframe(make_sheet(rows)[1:])
+
+
+@pytest.mark.parametrize("rows", ROWS)
+def test_aggregates_from_dataframe(benchmark, rows):
+    # what /stats does when the statistics are not cached
+    dframe = make_dataframe(rows)
+    summary = benchmark(lambda: SpendingAggregates.from_dataframe(dframe).summary())
+    assert summary["count"] == rows
+
+
+@pytest.mark.parametrize("rows", ROWS)
+def test_aggregates_add_day(benchmark, rows):
+    # what /spend does to cached statistics
+    aggregates = SpendingAggregates.from_dataframe(make_dataframe(rows))
+    # a plain datetime, as there are more rounds than days pandas can represent
+    aggregates.last_date = aggregates.last_date.to_pydatetime()
+
+    def add_day():
+        # days are added in date order, so each round is the next day
+        aggregates.add(aggregates.last_date + datetime.timedelta(days=1), 10.0)
+        return aggregates.summary()
+
+    benchmark(add_day)
+
+
+@pytest.mark.parametrize("kind", CHART_KINDS)
+@pytest.mark.parametrize("rows", ROWS)
+def test_render_chart(benchmark, rows, kind):
+    dframe = make_dataframe(rows)
+    dates = dframe["Date"].to_numpy()
+    spends = dframe["Spend"].to_numpy()
+    # drawing is slow, so fewer rounds
+    png = benchmark.pedantic(
+        render_chart, args=(kind, dates, spends), rounds=5, warmup_rounds=1
+    )
+    assert len(png) > 0
@@ -0,0 +1,51 @@
+"""
+Deterministic synthetic spreadsheets for the benchmarks, and a mocked gspread client that serves them.
+"""
+import random
+import datetime
+from unittest.mock import MagicMock
+from gspread.client import Client
+
+# sizes of spreadsheet (rows of data) that every benchmark runs at
+ROWS = [30, 1_000, 10_000, 100_000]
+# 100,000 days after this is still within the dates pandas can represent
+FIRST_DATE = datetime.datetime(1900, 1, 1)
+
+
+def make_sheet(rows: int, seed: int = 0, first_date: datetime.datetime = FIRST_DATE):
+    """Makes the contents of a correctly formatted spreadsheet, the same every time for the same arguments.
+
+    Args:
+        rows (int): The number of days of data.
+        seed (int, optional): Seed for the random spends. Defaults to 0.
+        first_date (datetime.datetime, optional): The date of the first row. Defaults to FIRST_DATE.
+
+    Returns:
+        list[list]: The sheet as gspread returns it, including the header. [row][column]
+    """
+    rng = random.Random(seed)
+    data = [["Date", "Spend"]]
+    for day in range(rows):
+        date = first_date + datetime.timedelta(days=day)
+        # mostly small spends, with the odd big one
+        spend = round(rng.lognormvariate(2.5, 1.0), 2)
+        data.append([date.strftime("%d/%m/%Y"), spend])
+    return data
+
+
+def make_client(data: list[list]):
+    """Makes a gspread client whose spreadsheets all contain `data`, without any network requests.
+
+    Args:
+        data (list[list]): The contents of the spreadsheet (see make_sheet).
+
+    Returns:
+        gspread.client.Client: The mocked client.
+    """
+    worksheet = MagicMock()
+    worksheet.get_values = MagicMock(return_value=data)
+    spreadsheet = MagicMock()
+    spreadsheet.sheet1 = worksheet
+    client = MagicMock(spec=Client)
+    client.open_by_url = MagicMock(return_value=spreadsheet)
+    return client
@@ -2,10 +2,10 @@
 import os
 from dotenv import load_dotenv
 import logging
-import pandas
+import threading
 from telegram.ext import *
-import telegram.ext.filters as filters
 from telegram import *
+from telegram.request import BaseRequest, HTTPXRequest
 from budgeter.bothandlers.help import help_handler
 from budgeter.bothandlers.start import start_handler
 from budgeter.bothandlers.stats import stats_handler
@@ -15,17 +15,64 @@ from budgeter.bothandlers.spreadsheet import spreadsheet_handler
 from budgeter.bothandlers.errorHandler import error_handler
 from budgeter.bothandlers.remind import remind_handler
 from budgeter.bothandlers.unknown import unknown_command_handler
-import asyncio
-from budgeter.remind import queue_reminder
+import concurrent.futures
+from budgeter.remind import ReminderSchedule
+from budgeter.cache import SpreadsheetCache
+from budgeter.quota import (
+    QuotaManager,
+    DEFAULT_READS_PER_MINUTE,
+    DEFAULT_WRITES_PER_MINUTE,
+)
+from budgeter.persistence import SQLitePersistence
+from budgeter.outbox import SpendOutbox, flush_outbox, DEFAULT_FLUSH_INTERVAL
+from budgeter.mirror import SpendingMirror, sync_mirrors, SYNC_JOB_INTERVAL
+from budgeter.charts import make_chart_executor, warm_up_chart_executor, ChartCache
+from budgeter.fakesheets import FakeClient
+from budgeter.errordigest import (
+    ErrorDigest,
+    send_error_digest,
+    DEFAULT_DIGEST_INTERVAL,
+)
+from budgeter.tracing import TRACER, DEFAULT_SLOW_THRESHOLD
+from budgeter.application import BudgeterApplication, MAX_PENDING_UPDATES
+from budgeter.metrics import (
+    InstrumentedRequest,
+    start_metrics_server,
+    OUTBOX_SPENDS,
+    UPDATE_QUEUE_UPDATES,
+)
 import gspread
 
 load_dotenv()
-try:
-    API_KEY = os.environ["TELEGRAM_BOT_ACCESS_TOKEN"]
-except KeyError as e:
-    raise ValueError(
-        "Please set the TELEGRAM_BOT_ACCESS_TOKEN environment variable."
-    ) from e
+# where errors are sent (default: nowhere, they are only logged)
+ADMIN_USER_ID = int(os.environ.get("ADMIN_USER_ID", 0)) or None
+# how often the admin is sent a digest of errors (seconds)
+ERROR_DIGEST_INTERVAL = float(
+    os.environ.get("ERROR_DIGEST_INTERVAL", DEFAULT_DIGEST_INTERVAL)
+)
+# number of threads used to talk to Google Sheets at once
+SPREADSHEET_THREADS = int(os.environ.get("SPREADSHEET_THREADS", 8))
+# number of updates handled at once (each user's are still handled one at a time, in order)
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", SPREADSHEET_THREADS * 4))
+# Google Sheets requests allowed per minute, shared by all users
+SHEETS_READS_PER_MINUTE = float(
+    os.environ.get("SHEETS_READS_PER_MINUTE", DEFAULT_READS_PER_MINUTE)
+)
+SHEETS_WRITES_PER_MINUTE = float(
+    os.environ.get("SHEETS_WRITES_PER_MINUTE", DEFAULT_WRITES_PER_MINUTE)
+)
+# number of processes used to draw graphs (default: one per CPU)
+CHART_PROCESSES = int(os.environ.get("CHART_PROCESSES", 0)) or None
+# how long the daily reminders are spread over (seconds)
+REMINDER_WINDOW = float(os.environ.get("REMINDER_WINDOW", 10 * 60))
+# port to serve metrics on, at http://127.0.0.1:METRICS_PORT/metrics (0 to not serve them)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9464))
+# updates taking longer than this to handle are logged, with where the time went (seconds)
+TRACE_SLOW_SECONDS = float(os.environ.get("TRACE_SLOW_SECONDS", DEFAULT_SLOW_THRESHOLD))
+# file to write every update's trace to, as OTLP JSON (default: none)
+TRACE_EXPORT_FILE = os.environ.get("TRACE_EXPORT_FILE") or None
+# use an in-memory fake of Google Sheets instead of the real thing, e.g., to try the bot out locally
+FAKE_SHEETS = os.environ.get("FAKE_SHEETS", "0") == "1"
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
@@ -33,34 +80,120 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def main():
-    # user data
-    persistent_data = PicklePersistence(
-        filepath="bot_data.pickle",
-        store_data=PersistenceInput(
-            user_data=True,
-            bot_data=False,
-        ),
-    )
-    loop = asyncio.new_event_loop()
-    all_user_data = loop.run_until_complete(persistent_data.get_user_data())
-    loop.close()
+def warm_up_imports():
+    """Imports libraries which are only needed once users start asking for data,
+    so that they are not imported while the bot starts up, nor while a user waits."""
+    import pandas
 
+
+def make_spreadsheet_client():
+    """Creates the Google Sheets client: the real one, or an in-memory fake if FAKE_SHEETS is set.
+
+    Returns:
+        gspread.Client | FakeClient: The client.
+    """
+    if FAKE_SHEETS:
+        return FakeClient(
+            latency=float(os.environ.get("FAKE_SHEETS_LATENCY", 0)),
+            jitter=float(os.environ.get("FAKE_SHEETS_JITTER", 0)),
+            quota_error_rate=float(os.environ.get("FAKE_SHEETS_QUOTA_ERROR_RATE", 0)),
+            server_error_rate=float(os.environ.get("FAKE_SHEETS_SERVER_ERROR_RATE", 0)),
+        )
     # spreadsheet authentication
     CREDENTIALS_PATH = "google_credentials.json"
-    spreadsheet_client = gspread.service_account(filename=CREDENTIALS_PATH)
+    return gspread.service_account(filename=CREDENTIALS_PATH)
+
+
+def build_application(
+    token: str,
+    persistence: BasePersistence,
+    spreadsheet_client,
+    spend_outbox: SpendOutbox,
+    spending_mirror: SpendingMirror,
+    admin_user_id: int = None,
+    request: BaseRequest = None,
+) -> Application:
+    """Builds the bot, with all its handlers and jobs, ready to be run.
+
+    Args:
+        token (str): The Telegram bot token.
+        persistence (BasePersistence): Where user data is stored.
+        spreadsheet_client (gspread.Client): The Google Sheets client (see make_spreadsheet_client).
+        spend_outbox (SpendOutbox): Spends waiting to be written to spreadsheets.
+        spending_mirror (SpendingMirror): The local copy of everyone's spending data.
+        admin_user_id (int, optional): Where errors are sent. Defaults to None (errors are only logged).
+        request (BaseRequest, optional): How to talk to the Telegram Bot API,
+            e.g., a stand-in for load tests. Defaults to None (the real API).
+
+    Returns:
+        Application: The bot. post_init and post_shutdown are only run by run_polling,
+            so call them yourself if you start it another way.
+    """
+    # Google Sheets calls block, so they run on their own threads
+    spreadsheet_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=SPREADSHEET_THREADS, thread_name_prefix="spreadsheet"
+    )
+    chart_executor = make_chart_executor(CHART_PROCESSES)
 
     async def add_client_to_application(application: Application) -> None:
         application.bot_data["spreadsheet_client"] = spreadsheet_client
+        application.bot_data["spreadsheet_cache"] = SpreadsheetCache()
+        application.bot_data["spreadsheet_executor"] = spreadsheet_executor
+        application.bot_data["spreadsheet_quota"] = QuotaManager(
+            reads_per_minute=SHEETS_READS_PER_MINUTE,
+            writes_per_minute=SHEETS_WRITES_PER_MINUTE,
+        )
+        application.bot_data["chart_executor"] = chart_executor
+        application.bot_data["chart_cache"] = ChartCache()
+        application.bot_data["spend_outbox"] = spend_outbox
+        application.bot_data["spending_mirror"] = spending_mirror
+        application.bot_data["reminder_schedule"] = ReminderSchedule(
+            application.job_queue, window=REMINDER_WINDOW
+        )
+        application.bot_data["error_digest"] = ErrorDigest(admin_user_id)
+        OUTBOX_SPENDS.set_function(spend_outbox.__len__)
+        UPDATE_QUEUE_UPDATES.set_function(application.update_queue.qsize)
+        # the job queue starts after polling, so this does not hold up the first update
+        application.job_queue.run_once(after_start, 0)
+
+    async def after_start(context: CallbackContext) -> None:
+        threading.Thread(target=warm_up_imports, daemon=True).start()
+        warm_up_chart_executor(chart_executor, CHART_PROCESSES)
+        context.bot_data["reminder_schedule"].restore(context.application.user_data)
+        # including any spends left over from before a restart
+        context.job_queue.run_repeating(flush_outbox, DEFAULT_FLUSH_INTERVAL, first=0)
+        context.job_queue.run_repeating(
+            sync_mirrors, SYNC_JOB_INTERVAL, first=SYNC_JOB_INTERVAL
+        )
+        context.job_queue.run_repeating(
+            send_error_digest, ERROR_DIGEST_INTERVAL, first=ERROR_DIGEST_INTERVAL
+        )
+
+    async def shutdown_executors(application: Application) -> None:
+        spreadsheet_executor.shutdown(wait=False, cancel_futures=True)
+        chart_executor.shutdown(wait=False, cancel_futures=True)
+        spend_outbox.close()
+        spending_mirror.close()
 
     # application
-    application = (
+    builder = (
         Application.builder()
-        .token(API_KEY)
-        .persistence(persistent_data)
+        # handles different users' updates at once, and traces each (see budgeter/application.py)
+        .application_class(
+            BudgeterApplication, kwargs={"handled_at_once": CONCURRENT_UPDATES}
+        )
+        .concurrent_updates(MAX_PENDING_UPDATES)
+        .token(token)
+        .persistence(persistence)
         .post_init(add_client_to_application)
-        .build()
+        .post_shutdown(shutdown_executors)
     )
+    if request is None:
+        # as Application.builder() would make it
+        request = HTTPXRequest(connection_pool_size=256)
+    # count and time every call to the Telegram Bot API (other than fetching updates)
+    builder = builder.request(InstrumentedRequest(request))
+    application = builder.build()
 
     application.add_handler(help_handler)
     application.add_handler(start_handler)
@@ -73,15 +206,43 @@ def main():
     application.add_handler(unknown_command_handler)
     application.add_error_handler(error_handler)
 
-    for user_id, user_data in all_user_data.items():
-        try:
-            sheet_url = user_data["spreadsheet_url"]
-            reminders_on = user_data["reminders"]
-        except KeyError:
-            continue
-        if reminders_on:
-            queue_reminder(application.job_queue, user_id)
+    return application
 
+
+def main():
+    try:
+        API_KEY = os.environ["TELEGRAM_BOT_ACCESS_TOKEN"]
+    except KeyError as e:
+        raise ValueError(
+            "Please set the TELEGRAM_BOT_ACCESS_TOKEN environment variable."
+        ) from e
+
+    # user data
+    persistent_data = SQLitePersistence(
+        filepath="bot_data.sqlite3",
+        migrate_from="bot_data.pickle",
+        store_data=PersistenceInput(
+            user_data=True,
+            bot_data=False,
+        ),
+    )
+
+    # spends waiting to be written to spreadsheets
+    spend_outbox = SpendOutbox(filepath="spend_outbox.sqlite3")
+    # local copy of everyone's spending data
+    spending_mirror = SpendingMirror(filepath="spending_mirror.sqlite3")
+
+    application = build_application(
+        API_KEY,
+        persistent_data,
+        make_spreadsheet_client(),
+        spend_outbox,
+        spending_mirror,
+        admin_user_id=ADMIN_USER_ID,
+    )
+    TRACER.configure(TRACE_SLOW_SECONDS, TRACE_EXPORT_FILE)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
     application.run_polling()
 
 
@@ -0,0 +1,207 @@
+"""
+Running statistics of a user's spending, which are updated as each day is added
+instead of being recomputed from the whole history every time /stats is used.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import heapq
+import bisect
+import datetime
+import collections
+
+if TYPE_CHECKING:
+    import pandas
+
+# windows (number of most recent days of data) to keep statistics for
+WINDOWS = (7, 30, 365)
+
+
+class SortedWindow:
+    """
+    The most recent `size` spends, kept both in order of date and sorted by value,
+    so that the sum and median are cheap to get as spends are added.
+    Adding a spend is O(size) (inserting into and removing from a sorted list), so it is for small windows:
+    use RunningMedian for all of a user's spending.
+    """
+
+    def __init__(self, size: int):
+        """Creates a SortedWindow object.
+
+        Args:
+            size (int): The number of spends to keep.
+        """
+        self.size = size
+        self.spends = collections.deque()
+        self.sorted_spends = []
+        self.total = 0.0
+
+    def __len__(self):
+        return len(self.spends)
+
+    def add(self, spend: float):
+        """Adds a spend, dropping the oldest one if the window is full.
+
+        Args:
+            spend (float): The spend to add.
+        """
+        self.spends.append(spend)
+        bisect.insort(self.sorted_spends, spend)
+        self.total += spend
+        if len(self.spends) > self.size:
+            oldest = self.spends.popleft()
+            del self.sorted_spends[bisect.bisect_left(self.sorted_spends, oldest)]
+            self.total -= oldest
+
+    def mean(self):
+        if len(self.spends) == 0:
+            return float("nan")
+        return self.total / len(self.spends)
+
+    def median(self):
+        count = len(self.sorted_spends)
+        if count == 0:
+            return float("nan")
+        middle = count // 2
+        if count % 2 == 1:
+            return self.sorted_spends[middle]
+        return (self.sorted_spends[middle - 1] + self.sorted_spends[middle]) / 2
+
+
+class RunningMedian:
+    """
+    Every spend added, split into two heaps (the smaller half and the larger half),
+    so that adding a spend is O(log n) and the median is O(1), however long the history.
+    """
+
+    def __init__(self):
+        """Creates an empty RunningMedian object."""
+        # the smaller half, negated (heapq is a min-heap). It has the extra spend when there is an odd number
+        self.lower = []
+        # the larger half
+        self.upper = []
+        self.total = 0.0
+
+    def __len__(self):
+        return len(self.lower) + len(self.upper)
+
+    def add(self, spend: float):
+        """Adds a spend.
+
+        Args:
+            spend (float): The spend to add.
+        """
+        self.total += spend
+        if len(self.lower) == 0 or spend <= -self.lower[0]:
+            heapq.heappush(self.lower, -spend)
+        else:
+            heapq.heappush(self.upper, spend)
+        # keep the halves the same size (or lower one bigger)
+        if len(self.lower) > len(self.upper) + 1:
+            heapq.heappush(self.upper, -heapq.heappop(self.lower))
+        elif len(self.upper) > len(self.lower):
+            heapq.heappush(self.lower, -heapq.heappop(self.upper))
+
+    def mean(self):
+        if len(self) == 0:
+            return float("nan")
+        return self.total / len(self)
+
+    def median(self):
+        if len(self) == 0:
+            return float("nan")
+        if len(self.lower) > len(self.upper):
+            return -self.lower[0]
+        return (-self.lower[0] + self.upper[0]) / 2
+
+
+class SpendingAggregates:
+    """
+    Statistics of all of a user's spending, and of their last 7, 30, and 365 days of data.
+    """
+
+    def __init__(self):
+        """Creates an empty SpendingAggregates object. See also SpendingAggregates.from_dataframe"""
+        self.first_date = None
+        self.last_date = None
+        self.minimum = float("nan")
+        self.maximum = float("nan")
+        self.all_time = RunningMedian()
+        self.windows = {size: SortedWindow(size) for size in WINDOWS}
+
+    @property
+    def count(self):
+        return len(self.all_time)
+
+    @classmethod
+    def from_dataframe(cls, dframe: pandas.DataFrame):
+        """Creates a SpendingAggregates object from a spending dataframe.
+
+        Args:
+            dframe (pandas.DataFrame): The data. Columns: {"Date": datetime, "Spend": float}
+
+        Returns:
+            SpendingAggregates: The aggregates.
+        """
+        aggregates = cls()
+        for date, spend in zip(dframe["Date"], dframe["Spend"]):
+            aggregates.add(date, spend)
+        return aggregates
+
+    def add(self, date: datetime.datetime, spend: float):
+        """Adds a day of spending. Days must be added in date order.
+
+        Args:
+            date (datetime.datetime): The date.
+            spend (float): The spend.
+        """
+        spend = float(spend)
+        if self.first_date is None:
+            self.first_date = date
+            self.minimum = spend
+            self.maximum = spend
+        self.last_date = date
+        self.minimum = min(self.minimum, spend)
+        self.maximum = max(self.maximum, spend)
+        self.all_time.add(spend)
+        for window in self.windows.values():
+            window.add(spend)
+
+    def matches(self, dframe: pandas.DataFrame):
+        """Checks whether the aggregates are of the data in a dataframe, going by its length and last date
+        (rows are only ever added at the end, and older rows changing means the whole dataframe is read again).
+
+        Args:
+            dframe (pandas.DataFrame): The data. Columns: {"Date": datetime, "Spend": float}
+
+        Returns:
+            bool: True if the aggregates are of the same rows.
+        """
+        if self.count != len(dframe):
+            return False
+        return self.count == 0 or self.last_date == dframe["Date"].iloc[-1]
+
+    def summary(self):
+        """Gets the statistics used by /stats.
+
+        Returns:
+            dict: The statistics. "totaldays", "count", "minimum", "maximum",
+                and "total", "average", "median" for all time, then prefixed with "last{n}" for each window.
+        """
+        if self.count == 0:
+            totaldays = 0
+        else:
+            totaldays = (self.last_date - self.first_date).days
+        summary = {
+            "totaldays": totaldays,
+            "count": self.count,
+            "minimum": self.minimum,
+            "maximum": self.maximum,
+            "total": self.all_time.total,
+            "average": self.all_time.mean(),
+            "median": self.all_time.median(),
+        }
+        for size, window in self.windows.items():
+            summary[f"last{size}total"] = window.total
+            summary[f"last{size}average"] = window.mean()
+            summary[f"last{size}median"] = window.median()
+        return summary
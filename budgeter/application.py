@@ -0,0 +1,77 @@
+"""
+The bot's Application, which handles updates from different users at the same time.
+
+With concurrent_updates, python-telegram-bot starts handling each update as soon as it arrives,
+so one user waiting on a slow spreadsheet does not hold up everyone else. But the ConversationHandlers
+and user_data assume a user's updates are handled one at a time, in order (e.g., the answer to
+"what is your spreadsheet?" must not be handled before the /start that asked it), so
+each user's updates still wait for their previous one.
+
+They wait before taking one of the `handled_at_once` slots, not while holding one, so a user who sends
+many messages while their first is slow (e.g., waiting for quota) only ever takes up one slot.
+python-telegram-bot's own limit is taken before process_update is called, so it is set to
+MAX_PENDING_UPDATES, high enough that it is never reached (see bot.py).
+"""
+from __future__ import annotations
+import asyncio
+from telegram import Update
+from .tracing import TracedApplication
+
+# python-telegram-bot's limit on updates at once, which here includes updates waiting for their user's previous one
+MAX_PENDING_UPDATES = 2**20
+# how many updates are handled at once by default
+DEFAULT_HANDLED_AT_ONCE = 32
+
+
+def ordering_key(update: object):
+    """Which updates must be handled in order: those from the same user
+    (or, for updates without a user, the same chat).
+
+    Args:
+        update (object): The update.
+
+    Returns:
+        tuple | None: The key, or None if the update can be handled alongside any other.
+    """
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return ("user", update.effective_user.id)
+    if update.effective_chat is not None:
+        return ("chat", update.effective_chat.id)
+    return None
+
+
+class BudgeterApplication(TracedApplication):
+    """
+    An Application which handles each user's updates in order, and up to `handled_at_once` users' at the same time.
+    Use it with Application.builder().application_class(BudgeterApplication, kwargs={"handled_at_once": ...})
+    .concurrent_updates(MAX_PENDING_UPDATES).
+    """
+
+    def __init__(self, *args, handled_at_once: int = DEFAULT_HANDLED_AT_ONCE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.handled_at_once = handled_at_once
+        self._handling_slots = asyncio.BoundedSemaphore(handled_at_once)
+        # key -> [lock, number of updates holding or waiting for it]
+        self._ordering_locks = {}
+
+    async def process_update(self, update: object) -> None:
+        key = ordering_key(update)
+        if key is None:
+            async with self._handling_slots:
+                await super().process_update(update)
+            return
+        entry = self._ordering_locks.get(key)
+        if entry is None:
+            entry = self._ordering_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock lets waiters in in the order they arrived
+            async with entry[0], self._handling_slots:
+                await super().process_update(update)
+        finally:
+            entry[1] -= 1
+            # so there is not a lock left over for every user who has ever sent a message
+            if entry[1] == 0:
+                del self._ordering_locks[key]
@@ -1,39 +1,19 @@
-from telegram import Update
 from telegram.ext import ContextTypes
-import os
 import logging
+from ..errordigest import ErrorDigest, send_to_admin
 
-async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    bot = context.bot
-    try:
-        ADMIN_ID = os.environ["ADMIN_USER_ID"]
-    except KeyError as e:
-        raise ValueError(
-            "ADMIN_USER_ID environment variable not set."
-        ) from e
-    try:
-        user = update.effective_user
-        chat = update.effective_chat
-    except AttributeError:
-        user = "unknown"
-        chat = "unknown"
-    await bot.send_message(
-        chat_id=ADMIN_ID,
-        text=f"""
-Error!
+logger = logging.getLogger(__name__)
 
-User: {user}
 
-Chat: {chat}
-
-Update: {update}
-
-Error: {context.error}
-        """
-    )
-    print(context)
-    logger = logging.getLogger(__name__)
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error(
-        f"Update {update.update_id} caused error {context.error}"
+        f"Update {getattr(update, 'update_id', None)} caused error {context.error}",
+        exc_info=context.error,
     )
-    # raise context.error
+    # the admin is told about new errors now, and about the rest in a regular digest
+    digest: ErrorDigest = context.bot_data.get("error_digest")
+    if digest is None:
+        return
+    alert = digest.record(context.error, update)
+    if alert is not None:
+        await send_to_admin(context.bot, digest, alert)
@@ -6,26 +6,46 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
-from ..remind import queue_reminder, cancel_reminder
+from ..remind import (
+    DEFAULT_REMINDER_TIME,
+    DEFAULT_TIMEZONE,
+    parse_time,
+    is_timezone,
+)
+from ..metrics import timed_handler
 from .cancel import cancel_handler
 
 ASK_REMINDER_MESSAGE = """
-This bot can remind you at 10am every day to log the previous day's spending. It also prompts you to fill in any missed days.
+This bot can remind you every day to log the previous day's spending. It also prompts you to fill in any missed days.
 
 Your reminders are currently {}. What do you want to change?
 """
+REMINDERS_ON_TEXT = "on, at {} ({})"
 DO_REMIND_CHOICE = "Remind me"
 DONT_REMIND_CHOICE = "Don't remind me"
 
+ASK_TIME_MESSAGE = """
+What time should I remind you? (e.g., 9am or 21:30)
+"""
+NOT_A_TIME_MESSAGE = """
+I don't understand that time. Try something like 9am or 21:30, or /cancel
+"""
+ASK_TIMEZONE_MESSAGE = """
+What timezone are you in? Send me its name, like Europe/London or America/New_York (see <a href="https://en.wikipedia.org/wiki/List_of_tz_database_time_zones">the list</a>)
+"""
+NOT_A_TIMEZONE_MESSAGE = """
+I don't know that timezone. Send me a name like Europe/London, or /cancel
+"""
+
 DO_REMIND_MESSAGE = """
-I'll remind you to log your spending every day at 10am. If you want to change this, use /remind
+I'll remind you to log your spending every day at {} ({}). If you want to change this, use /remind
 """
 
 DONT_REMIND_MESSAGE = """
 Okay! You won't be bothered. If you change your mind, use /remind
 """
 
-USER_CONFIRMING_REMINDER = range(1)
+USER_CONFIRMING_REMINDER, USER_GIVING_TIME, USER_GIVING_TIMEZONE = range(3)
 
 
 async def ask_remind(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -33,7 +53,13 @@ async def ask_remind(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         reminders_on = context.user_data["reminders"]
     except KeyError:
         reminders_on = False
-    reminders_on_text = "on" if reminders_on else "off"
+    if reminders_on:
+        reminders_on_text = REMINDERS_ON_TEXT.format(
+            context.user_data.get("reminder_time", DEFAULT_REMINDER_TIME),
+            context.user_data.get("timezone", DEFAULT_TIMEZONE),
+        )
+    else:
+        reminders_on_text = "off"
     await update.effective_message.reply_html(
         ASK_REMINDER_MESSAGE.format(reminders_on_text),
         reply_markup=ReplyKeyboardMarkup(
@@ -45,11 +71,49 @@ async def ask_remind(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     return USER_CONFIRMING_REMINDER
 
 
+async def ask_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.effective_message.reply_text(
+        ASK_TIME_MESSAGE,
+        reply_markup=ReplyKeyboardMarkup(
+            [[context.user_data.get("reminder_time", DEFAULT_REMINDER_TIME)]],
+            resize_keyboard=True,
+        ),
+    )
+    return USER_GIVING_TIME
+
+
+async def give_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    reminder_time = parse_time(update.effective_message.text)
+    if reminder_time is None:
+        await update.effective_message.reply_text(NOT_A_TIME_MESSAGE)
+        return USER_GIVING_TIME
+    context.user_data["new_reminder_time"] = reminder_time
+    await update.effective_message.reply_html(
+        ASK_TIMEZONE_MESSAGE,
+        reply_markup=ReplyKeyboardMarkup(
+            [[context.user_data.get("timezone", DEFAULT_TIMEZONE)]],
+            resize_keyboard=True,
+        ),
+        disable_web_page_preview=True,
+    )
+    return USER_GIVING_TIMEZONE
+
+
+@timed_handler
 async def remind(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    timezone = update.effective_message.text.strip()
+    if not is_timezone(timezone):
+        await update.effective_message.reply_text(NOT_A_TIMEZONE_MESSAGE)
+        return USER_GIVING_TIMEZONE
+    reminder_time = context.user_data.pop("new_reminder_time")
     context.user_data["reminders"] = True
-    queue_reminder(context.job_queue, update.effective_user.id)
+    context.user_data["reminder_time"] = reminder_time
+    context.user_data["timezone"] = timezone
+    context.bot_data["reminder_schedule"].add(
+        update.effective_user.id, reminder_time, timezone
+    )
     await update.effective_message.reply_text(
-        DO_REMIND_MESSAGE,
+        DO_REMIND_MESSAGE.format(reminder_time, timezone),
         reply_markup=ReplyKeyboardRemove(),
     )
     return ConversationHandler.END
@@ -57,7 +121,7 @@ async def remind(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def dont_remind(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.user_data["reminders"] = False
-    cancel_reminder(context.job_queue, update.effective_user.id)
+    context.bot_data["reminder_schedule"].remove(update.effective_user.id)
     await update.effective_message.reply_text(
         DONT_REMIND_MESSAGE,
         reply_markup=ReplyKeyboardRemove(),
@@ -69,9 +133,15 @@ remind_handler = ConversationHandler(
     entry_points=[CommandHandler("remind", ask_remind)],
     states={
         USER_CONFIRMING_REMINDER: [
-            MessageHandler(filters.Regex(f"^({DO_REMIND_CHOICE})$"), remind),
+            MessageHandler(filters.Regex(f"^({DO_REMIND_CHOICE})$"), ask_time),
             MessageHandler(filters.Regex(f"^({DONT_REMIND_CHOICE})$"), dont_remind),
         ],
+        USER_GIVING_TIME: [
+            MessageHandler(filters.TEXT & ~filters.COMMAND, give_time),
+        ],
+        USER_GIVING_TIMEZONE: [
+            MessageHandler(filters.TEXT & ~filters.COMMAND, remind),
+        ],
     },
     fallbacks=[cancel_handler],
 )
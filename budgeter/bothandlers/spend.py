@@ -1,3 +1,5 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
 from telegram import Update
 from telegram.ext import (
     ContextTypes,
@@ -6,12 +8,16 @@ from telegram.ext import (
     CommandHandler,
     filters,
 )
-from ..spreadsheet import Spreadsheet
+from ..spreadsheet import open_spreadsheet
+from ..remind import record_last_logged_date
+from ..outbox import flush_outbox
+from ..metrics import timed_handler
 import datetime
-import pandas
-import numpy
 from .cancel import cancel_handler
 
+if TYPE_CHECKING:
+    import pandas
+
 USER_GIVING_DATA = range(1)
 
 SPREADSHEET_NOT_SET_UP_MESSAGE = """
@@ -30,10 +36,22 @@ SPENDING_DATA_MISSING_MESSAGE = """
 Spending data missing for {}. How much did you spend on this day? ({})
 """
 
+SEVERAL_DAYS_MISSING_MESSAGE = """
+{} days are missing. You can send several amounts at once, separated by spaces or new lines, for this day and the days after it.
+"""
+
 NOT_A_NUMBER_MESSAGE = """
 That doesn't look like a number. Try again?
 """
 
+NOT_A_NUMBER_IN_LIST_MESSAGE = """
+"{}" doesn't look like a number. Try again?
+"""
+
+TOO_MANY_AMOUNTS_MESSAGE = """
+You gave {} amounts, but only {} days are missing. Try again?
+"""
+
 DATA_NOT_ADDED_MESSAGE = """
 Data not added. Ask @alifeeerenn why. :)
 
@@ -50,11 +68,109 @@ Average spend over the last 30 days:
 Use /stats for more
 """
 
+RECORDED_FINAL_SPEND_NO_AVERAGE_MESSAGE = """
+Recorded £{:.2f}! You're up to date.
+
+Use /stats for more
+"""
+
 RECORDED_INTERMEDIATE_SPEND_MESSAGE = """
 Recorded £{:.2f}! Spending data missing for {}. How much did you spend on this day? ({})
 """
 
+RECORDED_SEVERAL_SPENDS_MESSAGE = """
+Recorded {} days, £{:.2f} in total ({} to {})!"""
+
+
+def get_first_day_without_data(df: pandas.DataFrame):
+    """Gets the first day that does not have spending data.
+
+    Args:
+        df (pandas.DataFrame): The spending data. Columns: {"Date": datetime, "Spend": float}
+
+    Returns:
+        datetime.datetime: The first date with a missing spend, or the day after the last date.
+            If there is no data at all, yesterday.
+    """
+    if len(df) == 0:
+        today = datetime.datetime.today().replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        return today - datetime.timedelta(days=1)
+    missing = df[df["Spend"].isna()]
+    if len(missing) > 0:
+        return missing["Date"].min()
+    return df["Date"].max() + datetime.timedelta(days=1)
+
+
+def get_last_logged_date(df: pandas.DataFrame):
+    """Gets the last day up to which there is spending data for every day.
+
+    Args:
+        df (pandas.DataFrame): The spending data. Columns: {"Date": datetime, "Spend": float}
 
+    Returns:
+        datetime.datetime | None: The day before the first day without data, or None if there is no data.
+    """
+    if len(df) == 0:
+        return None
+    return get_first_day_without_data(df) - datetime.timedelta(days=1)
+
+
+def with_pending_spends(df: pandas.DataFrame, pending: list[tuple]):
+    """Adds spends which are queued to be written to the spreadsheet (see SpendOutbox) to its data.
+
+    Args:
+        df (pandas.DataFrame): The spending data. Columns: {"Date": datetime, "Spend": float}
+        pending (list[tuple[int, datetime.datetime, float]]): (id, date, spend) of each queued spend.
+
+    Returns:
+        pandas.DataFrame: The spending data, including the queued spends.
+    """
+    if len(pending) == 0:
+        return df
+    import pandas
+
+    queued = pandas.DataFrame(
+        [(date, spend) for _, date, spend in pending], columns=["Date", "Spend"]
+    )
+    queued["Date"] = pandas.to_datetime(queued["Date"])
+    if len(df) == 0:
+        return queued
+    # a spend may have been written (and cached) just as it was read from the queue
+    return (
+        pandas.concat([df, queued], ignore_index=True)
+        .drop_duplicates("Date", keep="last")
+        .sort_values("Date", ignore_index=True)
+    )
+
+
+def days_missing_from(date: datetime.datetime):
+    """Counts the days from a date up to and including yesterday.
+
+    Args:
+        date (datetime.datetime): The first missing date.
+
+    Returns:
+        int: The number of days.
+    """
+    today = datetime.datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+    return (today - date).days
+
+
+def ask_for_date_message(next_date: datetime.datetime):
+    """Formats the date to ask the user about, e.g., ("Monday 01/01/2021", "2 days ago")."""
+    date = next_date.strftime("%d/%m/%Y")
+    dayofweek = next_date.strftime("%A")
+    daysago = (datetime.datetime.now() - next_date).days
+    if daysago == 1:
+        daysagotext = "yesterday"
+    else:
+        daysagotext = f"{daysago} days ago"
+    return f"{dayofweek} {date}", daysagotext
+
+
+@timed_handler
 async def spend(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
@@ -66,88 +182,127 @@ async def spend(
         await message.edit_text(SPREADSHEET_NOT_SET_UP_MESSAGE)
         return ConversationHandler.END
 
-    spreadsheet_client = context.bot_data["spreadsheet_client"]
-    spreadsheet = Spreadsheet(spreadsheet_client, spreadsheet_url)
+    spreadsheet = open_spreadsheet(context.bot_data, spreadsheet_url)
     try:
-        df = spreadsheet.get_spending_dataframe()
-    except Exception as e:
+        df = await spreadsheet.get_spending_dataframe()
+    except Exception:
         await message.edit_text(SPREADSHEET_BADLY_FORMATTED_MESSAGE)
         return ConversationHandler.END
+    outbox = context.bot_data.get("spend_outbox")
+    if outbox is not None:
+        df = with_pending_spends(df, outbox.pending(spreadsheet_url))
+    record_last_logged_date(context.user_data, get_last_logged_date(df))
 
-    next_date = df["Date"].max() + datetime.timedelta(days=1)
-    today = datetime.datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+    next_date = get_first_day_without_data(df)
+    days_missing = days_missing_from(next_date)
 
-    if next_date >= today:
+    if days_missing <= 0:
         await message.edit_text(UP_TO_DATE_MESSAGE)
         return ConversationHandler.END
 
     context.user_data["date"] = next_date
-    date = next_date.strftime("%d/%m/%Y")
-    dayofweek = next_date.strftime("%A")
-    daysago = (datetime.datetime.now() - next_date).days
-    if daysago == 1:
-        daysagotext = "yesterday"
-    else:
-        daysagotext = f"{daysago} days ago"
-
-    await message.edit_text(
-        SPENDING_DATA_MISSING_MESSAGE.format(f"{dayofweek} {date}", daysagotext)
-    )
+    text = SPENDING_DATA_MISSING_MESSAGE.format(*ask_for_date_message(next_date))
+    if days_missing > 1:
+        text += SEVERAL_DAYS_MISSING_MESSAGE.format(days_missing)
+    await message.edit_text(text)
     return USER_GIVING_DATA
 
 
+@timed_handler
 async def give_data(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
 ) -> None:
     message = await update.message.reply_text("Loading...")
-    try:
-        amount = float(update.message.text)
-    except ValueError:
+    amounts = []
+    for amount_text in update.message.text.split():
+        try:
+            amounts.append(float(amount_text))
+        except ValueError:
+            await message.edit_text(NOT_A_NUMBER_IN_LIST_MESSAGE.format(amount_text))
+            return USER_GIVING_DATA
+    if len(amounts) == 0:
         await message.edit_text(NOT_A_NUMBER_MESSAGE)
         return USER_GIVING_DATA
 
-    spreadsheet_url = context.user_data["spreadsheet_url"]
-    spreadsheet_client = context.bot_data["spreadsheet_client"]
-    spreadsheet = Spreadsheet(spreadsheet_client, spreadsheet_url)
-    data_added, why_not = spreadsheet.add_data(context.user_data["date"], amount)
-    if not data_added:
-        await message.edit_text(DATA_NOT_ADDED_MESSAGE.format(why_not))
-        return ConversationHandler.END
+    first_date = context.user_data["date"]
+    days_missing = days_missing_from(first_date)
+    if len(amounts) > 1 and len(amounts) > days_missing:
+        await message.edit_text(
+            TOO_MANY_AMOUNTS_MESSAGE.format(len(amounts), days_missing)
+        )
+        return USER_GIVING_DATA
+    rows = [
+        (first_date + datetime.timedelta(days=i), amount)
+        for i, amount in enumerate(amounts)
+    ]
 
-    try:
-        df = spreadsheet.get_spending_dataframe()
-    except Exception as e:
-        await message.edit_text(SPREADSHEET_BADLY_FORMATTED_MESSAGE)
-        return ConversationHandler.END
+    spreadsheet_url = context.user_data["spreadsheet_url"]
+    spreadsheet = open_spreadsheet(context.bot_data, spreadsheet_url)
+    outbox = context.bot_data.get("spend_outbox")
+    if outbox is None:
+        data_added, why_not = await spreadsheet.add_data_batch(rows)
+        if not data_added:
+            await message.edit_text(DATA_NOT_ADDED_MESSAGE.format(why_not))
+            return ConversationHandler.END
+        try:
+            df = await spreadsheet.get_spending_dataframe()
+        except Exception:
+            await message.edit_text(SPREADSHEET_BADLY_FORMATTED_MESSAGE)
+            return ConversationHandler.END
+    else:
+        # saved locally now, and written to the spreadsheet in the background
+        outbox.add(update.effective_user.id, spreadsheet_url, rows)
+        context.job_queue.run_once(flush_outbox, 0)
+        # only use data we already have, so the user does not wait for Google Sheets
+        df = spreadsheet.get_cached_dataframe()
+        if df is not None:
+            df = with_pending_spends(df, outbox.pending(spreadsheet_url))
+    if df is None:
+        record_last_logged_date(context.user_data, rows[-1][0])
+    else:
+        record_last_logged_date(context.user_data, get_last_logged_date(df))
 
-    next_date = df["Date"].max() + datetime.timedelta(days=1)
-    today = datetime.datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
-    if next_date >= today:
-        avg30d = df["Spend"].tail(30).mean()
-        avgdiff = avg30d - df["Spend"].tail(31).head(30).mean()
-        avgarrow = "⬆️" if avgdiff > 0 else "⬇️" if avgdiff < 0 else "➡️"
-        await message.edit_text(
-            RECORDED_FINAL_SPEND_MESSAGE.format(amount, avg30d, avgarrow, abs(avgdiff))
+    if len(amounts) > 1:
+        summary = RECORDED_SEVERAL_SPENDS_MESSAGE.format(
+            len(amounts),
+            sum(amounts),
+            rows[0][0].strftime("%d/%m/%Y"),
+            rows[-1][0].strftime("%d/%m/%Y"),
         )
-        return ConversationHandler.END
-    elif next_date < datetime.datetime.now():
-        context.user_data["date"] = next_date
-        date = next_date.strftime("%d/%m/%Y")
-        dayofweek = next_date.strftime("%A")
-        daysago = (datetime.datetime.now() - next_date).days
-        if daysago == 1:
-            daysagotext = "yesterday"
-        else:
-            daysagotext = f"{daysago} days ago"
+        amount = amounts[-1]
+    else:
+        summary = ""
+        amount = amounts[0]
 
+    if df is None:
+        next_date = rows[-1][0] + datetime.timedelta(days=1)
+    else:
+        next_date = get_first_day_without_data(df)
+    if days_missing_from(next_date) > 0:
+        context.user_data["date"] = next_date
         await message.edit_text(
-            RECORDED_INTERMEDIATE_SPEND_MESSAGE.format(
-                amount, f"{dayofweek} {date}", daysagotext
+            summary
+            + RECORDED_INTERMEDIATE_SPEND_MESSAGE.format(
+                amount, *ask_for_date_message(next_date)
             )
         )
         return USER_GIVING_DATA
 
+    if df is None:
+        await message.edit_text(
+            summary + RECORDED_FINAL_SPEND_NO_AVERAGE_MESSAGE.format(amount)
+        )
+        return ConversationHandler.END
+    avg30d = df["Spend"].tail(30).mean()
+    avgdiff = avg30d - df["Spend"].tail(31).head(30).mean()
+    avgarrow = "⬆️" if avgdiff > 0 else "⬇️" if avgdiff < 0 else "➡️"
+    await message.edit_text(
+        summary
+        + RECORDED_FINAL_SPEND_MESSAGE.format(amount, avg30d, avgarrow, abs(avgdiff))
+    )
+    return ConversationHandler.END
+
 
 spend_handler = ConversationHandler(
     entry_points=[CommandHandler("spend", spend)],
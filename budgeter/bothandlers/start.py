@@ -6,7 +6,8 @@ from telegram.ext import (
     CommandHandler,
     filters,
 )
-from ..spreadsheet import verifyurl, Spreadsheet
+from ..spreadsheet import verifyurl, Spreadsheet, open_spreadsheet
+from ..metrics import timed_handler
 from .cancel import cancel_handler
 
 USER_CHOOSING_SHEET_MODE, USER_CONFIRMING_CREATION, USERGIVING_SPREADSHEET_URL = range(
@@ -129,6 +130,7 @@ async def use_existing_spreadsheet(
     return USERGIVING_SPREADSHEET_URL
 
 
+@timed_handler
 async def give_spreadsheet_id(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
@@ -137,10 +139,9 @@ async def give_spreadsheet_id(
         await update.effective_message.reply_text(NOT_A_SPREADSHEET_URL_MESSAGE)
         return USERGIVING_SPREADSHEET_URL
 
-    spreadsheet_client = context.bot_data["spreadsheet_client"]
-    spreadsheet = Spreadsheet(spreadsheet_client, spreadsheet_id)
+    spreadsheet = open_spreadsheet(context.bot_data, spreadsheet_id)
     try:
-        sheet = spreadsheet.get_sheet1()
+        sheet = await spreadsheet.get_sheet1()
     except Exception as e:
         await update.effective_message.reply_text(
             COULD_NOT_ACCESS_SPREADSHEET_MESSAGE.format(spreadsheet_id)
@@ -154,7 +155,10 @@ async def give_spreadsheet_id(
         )
         return USERGIVING_SPREADSHEET_URL
 
+    # the spreadsheet may have been fixed by hand since we last saw it
+    spreadsheet.invalidate_cache()
     context.user_data["spreadsheet_url"] = spreadsheet_id
+    context.user_data.pop("last_logged_date", None)
     await update.effective_message.reply_text(SPREADSHEET_URL_ACCEPTED_MESSAGE)
     return ConversationHandler.END
 
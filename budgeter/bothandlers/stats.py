@@ -1,11 +1,18 @@
-import datetime
-import pandas
-from ..spreadsheet import Spreadsheet
-from telegram import Update
+import asyncio
+from ..spreadsheet import open_spreadsheet
+from ..remind import record_last_logged_date
+from .spend import get_last_logged_date
+from ..metrics import timed_handler
+from ..charts import (
+    render_chart_async,
+    chart_key,
+    DAILY,
+    DAILY_ZOOMED,
+    ROLLING_AVERAGE,
+)
+from telegram import InputMediaPhoto, Update
+from telegram.constants import ChatAction
 from telegram.ext import ContextTypes, CommandHandler
-import matplotlib.pyplot as plt
-import io
-
 
 NO_SPREADSHEET_URL_MESSAGE = """
 No spreadsheet URL found. Please create or link a spreadsheet first. /start
@@ -45,6 +52,9 @@ STATISTICS_MESSAGE = """
   {last30med_prog}
 """
 
+# Telegram's limit on the length of a photo caption
+MAX_CAPTION_LENGTH = 1024
+
 NOT_ENOUGH_DATA_FOR_ROLLING_MESSAGE = """
 When you have more than 30 days of data, I'll show you a rolling average ;).
 """
@@ -65,176 +75,156 @@ def num_to_progress_bar(num: float, max: float) -> str:
     return "▓" * num_bars + "░" * (TOTAL_BARS - num_bars)
 
 
+@timed_handler
 async def stats(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
 ):
-    message = await update.message.reply_text("Getting stats...")
-    spreadsheet_client = context.bot_data["spreadsheet_client"]
-
     try:
         spreadsheet_url = context.user_data["spreadsheet_url"]
     except KeyError:
-        await message.edit_text(NO_SPREADSHEET_URL_MESSAGE)
+        await update.message.reply_text(NO_SPREADSHEET_URL_MESSAGE)
         return
 
-    spreadsheet = Spreadsheet(spreadsheet_client, spreadsheet_url)
+    await update.effective_chat.send_action(ChatAction.UPLOAD_PHOTO)
+    spreadsheet = open_spreadsheet(context.bot_data, spreadsheet_url)
 
     try:
-        df = spreadsheet.get_spending_dataframe()
+        # the graphs need every day of data
+        df = await spreadsheet.get_spending_dataframe()
+        # and the statistics are of the same data as the graphs
+        summary = await spreadsheet.get_spending_summary(df)
     except Exception as e:
-        await message.edit_text(ERROR_PROCESSING_SPREADSHEET_MESSAGE.format(e))
+        await update.message.reply_text(ERROR_PROCESSING_SPREADSHEET_MESSAGE.format(e))
         return
-
-    totaldays = (df["Date"].max() - df["Date"].min()).days
-    total = df["Spend"].sum()
-    average = df["Spend"].mean()
-    median = df["Spend"].median()
-
-    last365total = df.tail(365)["Spend"].sum()
-    last365average = df.tail(365)["Spend"].mean()
-    last365median = df.tail(365)["Spend"].median()
-
-    last30total = df.tail(30)["Spend"].sum()
-    last30average = df.tail(30)["Spend"].mean()
-    last30median = df.tail(30)["Spend"].median()
+    record_last_logged_date(context.user_data, get_last_logged_date(df))
 
     max_avg = max(
-        average, last365average, last30average, median, last365median, last30median
+        summary["average"],
+        summary["last365average"],
+        summary["last30average"],
+        summary["median"],
+        summary["last365median"],
+        summary["last30median"],
     )
 
-    await message.edit_text(
-        STATISTICS_MESSAGE.format(
-            totaldays=totaldays,
-            total=total,
-            average=average,
-            avg_prog=num_to_progress_bar(average, max_avg),
-            median=median,
-            med_prog=num_to_progress_bar(median, max_avg),
-            last365total=last365total,
-            last365average=last365average,
-            last365avg_prog=num_to_progress_bar(last365average, max_avg),
-            last365median=last365median,
-            last365med_prog=num_to_progress_bar(last365median, max_avg),
-            last30total=last30total,
-            last30average=last30average,
-            last30avg_prog=num_to_progress_bar(last30average, max_avg),
-            last30median=last30median,
-            last30med_prog=num_to_progress_bar(last30median, max_avg),
-        ),
-        parse_mode="HTML",
+    text = STATISTICS_MESSAGE.format(
+        totaldays=summary["totaldays"],
+        total=summary["total"],
+        average=summary["average"],
+        avg_prog=num_to_progress_bar(summary["average"], max_avg),
+        median=summary["median"],
+        med_prog=num_to_progress_bar(summary["median"], max_avg),
+        last365total=summary["last365total"],
+        last365average=summary["last365average"],
+        last365avg_prog=num_to_progress_bar(summary["last365average"], max_avg),
+        last365median=summary["last365median"],
+        last365med_prog=num_to_progress_bar(summary["last365median"], max_avg),
+        last30total=summary["last30total"],
+        last30average=summary["last30average"],
+        last30avg_prog=num_to_progress_bar(summary["last30average"], max_avg),
+        last30median=summary["last30median"],
+        last30med_prog=num_to_progress_bar(summary["last30median"], max_avg),
     )
-
-    graph_message = await update.message.reply_text("Generating graph...")
-    graph_message_zoom = await update.message.reply_text("Generating zoomed graph...")
-    try:
-        figure = plt.figure()
-        ax = figure.add_subplot(111)
-
-        df.plot(
-            x="Date",
-            y="Spend",
-            ax=ax,
-        )
-
-        last_date = df["Date"].max()
-        days_ago_30 = last_date - datetime.timedelta(days=30)
-        days_ago_60 = last_date - datetime.timedelta(days=60)
-        ax.vlines(
-            days_ago_30,
-            0,
-            df["Spend"].max(),
-            color="red",
-            linestyle=":",
-            alpha=0.5,
-            label="30d ago",
-        )
-
-        rolling_spends_7d = df["Spend"].rolling(7).mean()
-        rolling_spends_7d_df = pandas.concat([df["Date"], rolling_spends_7d], axis=1)
-        rolling_spends_7d_df.columns = ["Date", "7d rolling average"]
-        rolling_spends_7d_df = rolling_spends_7d_df.dropna()
-        rolling_spends_7d_df.plot(
-            x="Date",
-            y="7d rolling average",
-            ax=ax,
-            linestyle="dashed",
-        )
-
-        ax.legend()
-        ax.set_ylabel("Spend (£)")
-        ax.set_xlabel("Date")
-        ax.set_title("Daily Spend")
-        ax.grid()
-        ax.set_ylim(bottom=0)
-        figure.tight_layout()
-
-        buf = io.BytesIO()
-        figure.savefig(buf, format="png")
-        buf.seek(0)
-
-        await update.message.reply_photo(buf)
-        await graph_message.delete()
-    except Exception as e:
-        await graph_message.edit_text("Error generating graph: {}".format(e))
-
-    try:
-        # set ylim to percentile 95
-        percentile_upper = df["Spend"].quantile(0.95)
-        ax.set_ylim(0, percentile_upper)
-        # set xlim to last 30 days
-        ax.set_xlim(days_ago_60, last_date)
-        figure.tight_layout()
-
-        buf = io.BytesIO()
-        figure.savefig(buf, format="png")
-        buf.seek(0)
-
-        await update.message.reply_photo(buf)
-        await graph_message_zoom.delete()
-    except Exception as e:
-        await graph_message_zoom.edit_text(
-            "Error generating zoomed graph: {}".format(e)
-        )
-
     # rolling average (only if there are more than 30 days of data)
     if len(df) < 40:
-        await update.message.reply_text(NOT_ENOUGH_DATA_FOR_ROLLING_MESSAGE)
+        text += NOT_ENOUGH_DATA_FOR_ROLLING_MESSAGE
+
+    dates = df["Date"].to_numpy()
+    spends = df["Spend"].to_numpy()
+
+    # draw all the graphs at once
+    graphs = await asyncio.gather(
+        *[
+            get_graph(context, kind, dates, spends)
+            for kind in [DAILY, DAILY_ZOOMED, ROLLING_AVERAGE]
+        ],
+        return_exceptions=True,
+    )
+    sent_graphs = []
+    for graph, error_text in zip(
+        graphs,
+        [
+            "Error generating graph: {}",
+            "Error generating zoomed graph: {}",
+            "Error generating rolling average graph: {}",
+        ],
+    ):
+        if isinstance(graph, Exception):
+            text += "\n" + error_text.format(graph)
+            continue
+        sent_graphs.append(graph)
+
+    await reply_with_graphs(update, context, text, sent_graphs)
+
+
+async def reply_with_graphs(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    text: str,
+    graphs: list[tuple[str, str | bytes]],
+):
+    """Replies with the statistics and graphs as one message: an album with the statistics as its caption,
+    or a photo if only one graph could be drawn (an album needs at least two).
+    The statistics are sent separately if they are too long for a caption.
+
+    Args:
+        update (Update): The update to reply to.
+        context (ContextTypes.DEFAULT_TYPE): The context, with the chart cache in bot_data.
+        text (str): The statistics (HTML).
+        graphs (list[tuple[str, str | bytes]]): The (key, file_id or PNG) of each graph (see get_graph).
+    """
+    if len(graphs) == 0 or len(text) > MAX_CAPTION_LENGTH:
+        await update.message.reply_html(text)
+        text = None
+    if len(graphs) == 0:
+        return
+    if len(graphs) == 1:
+        photo_messages = [
+            await update.message.reply_photo(
+                graphs[0][1], caption=text, parse_mode="HTML"
+            )
+        ]
+    else:
+        media = [InputMediaPhoto(photo) for _, photo in graphs]
+        if text is not None:
+            media[0] = InputMediaPhoto(graphs[0][1], caption=text, parse_mode="HTML")
+        photo_messages = await update.message.reply_media_group(media)
+
+    chart_cache = context.bot_data.get("chart_cache")
+    if chart_cache is not None:
+        for (key, _), photo_message in zip(graphs, photo_messages):
+            chart_cache.set_file_id(key, photo_message.photo[-1].file_id)
+
+
+async def get_graph(context: ContextTypes.DEFAULT_TYPE, kind: str, dates, spends):
+    """Gets a graph to send. If the same graph has been sent before, Telegram's file_id for it is used,
+    so it is neither drawn nor uploaded again.
 
-    rolling_average_message = await update.message.reply_text(
-        "Generating rolling average graph..."
+    Args:
+        context (ContextTypes.DEFAULT_TYPE): The context, with the chart cache and executor in bot_data.
+        kind (str): Which graph (one of budgeter.charts.CHART_KINDS).
+        dates (numpy.ndarray): The dates (datetime64).
+        spends (numpy.ndarray): The spends.
+
+    Returns:
+        str: The graph's key (see budgeter.charts.chart_key).
+        str | bytes: The graph's file_id, or the graph as a PNG.
+    """
+    chart_cache = context.bot_data.get("chart_cache")
+    key = chart_key(kind, dates, spends)
+    if chart_cache is not None:
+        png, file_id = chart_cache.get(key)
+        if file_id is not None:
+            return key, file_id
+        if png is not None:
+            return key, png
+    png = await render_chart_async(
+        context.bot_data.get("chart_executor"), kind, dates, spends
     )
-    try:
-        figure = plt.figure()
-        ax = figure.add_subplot(111)
-
-        rolling_spends_30d = df["Spend"].rolling(30).mean()
-        rolling_spends_30d_df = pandas.concat([df["Date"], rolling_spends_30d], axis=1)
-        rolling_spends_30d_df.columns = ["Date", "30d rolling average"]
-        rolling_spends_30d_df = rolling_spends_30d_df.dropna()
-        rolling_spends_30d_df.plot(
-            x="Date",
-            y="30d rolling average",
-            ax=ax,
-        )
-
-        ax.set_ylabel("Spend (£)")
-        ax.set_xlabel("End Date")
-        ax.set_title("30 day rolling average")
-        ax.grid()
-        ax.set_ylim(bottom=0)
-        figure.tight_layout()
-
-        buf = io.BytesIO()
-        figure.savefig(buf, format="png")
-        buf.seek(0)
-
-        await update.message.reply_photo(buf)
-        await rolling_average_message.delete()
-    except Exception as e:
-        await rolling_average_message.edit_text(
-            "Error generating rolling average graph: {}".format(e)
-        )
+    if chart_cache is not None:
+        chart_cache.set_png(key, png)
+    return key, png
 
 
 stats_handler = CommandHandler("stats", stats)
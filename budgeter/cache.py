@@ -0,0 +1,293 @@
+"""
+An in-process cache of each user's spending data, so that a conversation with the bot
+does not have to read the whole spreadsheet from Google Sheets on every message.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import time
+import threading
+import datetime
+from cachetools import TTLCache, LRUCache
+from .aggregates import SpendingAggregates
+
+if TYPE_CHECKING:
+    import pandas
+
+# how long a spreadsheet is trusted before it is read again (seconds).
+#  this is also the longest that manual edits to a spreadsheet can go unnoticed
+DEFAULT_TTL = 5 * 60
+# how many spreadsheets to keep in memory at once
+DEFAULT_MAXSIZE = 1024
+# how long to keep refreshing a spreadsheet by reading only its new rows,
+#  before reading the whole thing again to pick up edits to older rows (seconds)
+DEFAULT_FULL_READ_INTERVAL = 60 * 60
+
+
+class SpreadsheetCache:
+    """
+    A thread-safe cache of spending dataframes, keyed by spreadsheet ID.
+
+    Entries expire `ttl` seconds after they are stored, and the least recently used
+    entry is evicted when there are more than `maxsize` entries.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = DEFAULT_MAXSIZE,
+        ttl: float = DEFAULT_TTL,
+        full_read_interval: float = DEFAULT_FULL_READ_INTERVAL,
+    ):
+        """Creates a SpreadsheetCache object.
+
+        Args:
+            maxsize (int, optional): The maximum number of spreadsheets to cache.
+            ttl (float, optional): How long to keep each spreadsheet for (seconds).
+            full_read_interval (float, optional): How long an expired spreadsheet can be refreshed by
+                reading only its new rows (seconds).
+        """
+        self._dataframes = TTLCache(maxsize=maxsize, ttl=ttl)
+        # (dataframe, when it was last read in full) of each spreadsheet, to refresh expired
+        #  dataframes by reading only new rows
+        self._histories = LRUCache(maxsize=maxsize)
+        self._full_read_interval = full_read_interval
+        # running statistics of each spreadsheet, updated as rows are added
+        self._aggregates = LRUCache(maxsize=maxsize)
+        # (last date, number of rows) of each spreadsheet, for appending without a full read
+        self._tails = TTLCache(maxsize=maxsize, ttl=ttl)
+        # opened gspread worksheets, which stay valid until access to them fails
+        self._worksheets = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._dataframes)
+
+    def get_dataframe(self, spreadsheet_id: str):
+        """Gets a cached spending dataframe.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+
+        Returns:
+            pandas.DataFrame | None: A copy of the cached dataframe, or None if it is not cached.
+        """
+        with self._lock:
+            dframe = self._dataframes.get(spreadsheet_id)
+        if dframe is None:
+            return None
+        return dframe.copy()
+
+    def set_dataframe(
+        self,
+        spreadsheet_id: str,
+        dframe: pandas.DataFrame,
+        full_read: bool = True,
+        from_sheets: bool = True,
+    ):
+        """Stores a spending dataframe.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+            dframe (pandas.DataFrame): The dataframe. Columns: {"Date": datetime, "Spend": float}
+            full_read (bool, optional): Whether the whole spreadsheet was read to make the dataframe,
+                as opposed to only its new rows. Defaults to True.
+            from_sheets (bool, optional): Whether the dataframe was just read from Google Sheets,
+                as opposed to a local copy (see SpendingMirror), which can be hours out of date.
+                Rows are appended after the stored tail (see get_tail), so it is only stored if so. Defaults to True.
+        """
+        with self._lock:
+            self._dataframes[spreadsheet_id] = dframe.copy()
+            if from_sheets:
+                self._tails[spreadsheet_id] = tail_of_dataframe(dframe)
+            if full_read:
+                self._histories[spreadsheet_id] = (dframe.copy(), time.monotonic())
+                # older rows may have changed, so the statistics are worked out again when needed
+                self._aggregates.pop(spreadsheet_id, None)
+                return
+            if spreadsheet_id in self._histories:
+                _, full_read_at = self._histories[spreadsheet_id]
+                self._histories[spreadsheet_id] = (dframe.copy(), full_read_at)
+            aggregates = self._aggregates.get(spreadsheet_id)
+            if aggregates is not None and aggregates.count <= len(dframe):
+                new_rows = dframe.iloc[aggregates.count :]
+                for date, spend in zip(new_rows["Date"], new_rows["Spend"]):
+                    aggregates.add(date, spend)
+            else:
+                self._aggregates.pop(spreadsheet_id, None)
+
+    def get_history(self, spreadsheet_id: str):
+        """Gets an expired spending dataframe, which can be brought up to date by reading only new rows.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+
+        Returns:
+            pandas.DataFrame | None: A copy of the dataframe, or None if it has not been read in full recently.
+        """
+        with self._lock:
+            history = self._histories.get(spreadsheet_id)
+        if history is None:
+            return None
+        dframe, full_read_at = history
+        if time.monotonic() - full_read_at > self._full_read_interval:
+            return None
+        return dframe.copy()
+
+    def append_rows(
+        self,
+        spreadsheet_id: str,
+        rows: list[tuple[datetime.datetime, float]],
+        rows_before: int = None,
+    ):
+        """Appends rows to a cached dataframe (and tail), after they have been written to the spreadsheet.
+        Does nothing if the spreadsheet is not cached.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+            rows (list[tuple[datetime.datetime, float]]): The (date, spend) rows to add.
+            rows_before (int, optional): The number of rows in the spreadsheet before they were written,
+                including the header (see Spreadsheet.get_tail). If the cached dataframe does not have that many
+                (e.g., rows were added by hand since it was read), it is forgotten instead, so it is read again.
+                Defaults to None (not checked).
+
+        Returns:
+            bool: True if the cached dataframe was updated, False if it was not cached.
+        """
+        import pandas
+
+        with self._lock:
+            tail = self._tails.get(spreadsheet_id)
+            if rows_before is not None:
+                self._tails[spreadsheet_id] = (rows[-1][0], rows_before + len(rows))
+            elif tail is not None:
+                self._tails[spreadsheet_id] = (rows[-1][0], tail[1] + len(rows))
+            dframe = self._dataframes.get(spreadsheet_id)
+            if (
+                dframe is not None
+                and rows_before is not None
+                and len(dframe) + 1 != rows_before
+            ):
+                self._dataframes.pop(spreadsheet_id, None)
+                self._histories.pop(spreadsheet_id, None)
+                self._aggregates.pop(spreadsheet_id, None)
+                return False
+            aggregates = self._aggregates.get(spreadsheet_id)
+            if aggregates is not None:
+                for date, spend in rows:
+                    aggregates.add(date, spend)
+            if dframe is None:
+                return False
+            new_rows = pandas.DataFrame(rows, columns=["Date", "Spend"])
+            new_rows["Date"] = pandas.to_datetime(new_rows["Date"])
+            new_rows["Spend"] = pandas.to_numeric(new_rows["Spend"])
+            if len(dframe) > 0:
+                new_rows = pandas.concat([dframe, new_rows], ignore_index=True)
+            self._dataframes[spreadsheet_id] = new_rows
+            if spreadsheet_id in self._histories:
+                _, full_read_at = self._histories[spreadsheet_id]
+                self._histories[spreadsheet_id] = (new_rows, full_read_at)
+        return True
+
+    def get_summary(self, spreadsheet_id: str, dframe: pandas.DataFrame):
+        """Gets the spending statistics of a spreadsheet (see SpendingAggregates.summary).
+        The statistics are kept up to date as rows are added, so this does not go through the whole history,
+        unless they are not of the same data as `dframe` (e.g., it has been read again in full since),
+        when they are worked out again from it.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+            dframe (pandas.DataFrame): The data to get the statistics of (see Spreadsheet.get_spending_dataframe).
+
+        Returns:
+            dict: The statistics.
+        """
+        with self._lock:
+            aggregates = self._aggregates.get(spreadsheet_id)
+            if aggregates is not None and aggregates.matches(dframe):
+                return aggregates.summary()
+        # this goes through the whole history, so every other spreadsheet is not held up meanwhile
+        aggregates = SpendingAggregates.from_dataframe(dframe)
+        with self._lock:
+            self._aggregates[spreadsheet_id] = aggregates
+            return aggregates.summary()
+
+    def get_tail(self, spreadsheet_id: str):
+        """Gets the last date and number of rows of a spreadsheet.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+
+        Returns:
+            tuple[datetime.datetime | None, int] | None: (last date, number of rows including the header),
+                or None if it is not cached.
+        """
+        with self._lock:
+            return self._tails.get(spreadsheet_id)
+
+    def set_tail(self, spreadsheet_id: str, last_date: datetime.datetime, rows: int):
+        """Stores the last date and number of rows of a spreadsheet.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+            last_date (datetime.datetime | None): The last date in column A, or None if there is no data.
+            rows (int): The number of rows, including the header.
+        """
+        with self._lock:
+            self._tails[spreadsheet_id] = (last_date, rows)
+
+    def get_worksheet(self, spreadsheet_id: str):
+        """Gets an opened worksheet (the first sheet of a spreadsheet).
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+
+        Returns:
+            gspread.worksheet.Worksheet | None: The worksheet, or None if it is not cached.
+        """
+        with self._lock:
+            return self._worksheets.get(spreadsheet_id)
+
+    def set_worksheet(self, spreadsheet_id: str, worksheet):
+        """Stores an opened worksheet, so it does not have to be opened again.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+            worksheet (gspread.worksheet.Worksheet): The worksheet.
+        """
+        with self._lock:
+            self._worksheets[spreadsheet_id] = worksheet
+
+    def forget_worksheet(self, spreadsheet_id: str):
+        """Removes an opened worksheet, so it is opened again next time.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+        """
+        with self._lock:
+            self._worksheets.pop(spreadsheet_id, None)
+
+    def invalidate(self, spreadsheet_id: str):
+        """Removes a spreadsheet from the cache, so that it is read again next time.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+        """
+        with self._lock:
+            self._dataframes.pop(spreadsheet_id, None)
+            self._tails.pop(spreadsheet_id, None)
+            self._histories.pop(spreadsheet_id, None)
+            self._aggregates.pop(spreadsheet_id, None)
+
+
+def tail_of_dataframe(dframe: pandas.DataFrame):
+    """Gets the last date and number of rows of a spreadsheet from its spending dataframe.
+
+    Args:
+        dframe (pandas.DataFrame): The dataframe. Columns: {"Date": datetime, "Spend": float}
+
+    Returns:
+        tuple[datetime.datetime | None, int]: (last date, number of rows including the header)
+    """
+    if len(dframe) == 0:
+        return None, 1
+    return dframe["Date"].max().to_pydatetime(), len(dframe) + 1
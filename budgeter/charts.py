@@ -0,0 +1,331 @@
+"""
+Draws the graphs for /stats.
+
+Graphs are drawn in separate processes (see make_chart_executor), so that drawing does not
+block the bot, and several users' graphs can be drawn at once on all cores.
+Charts take plain arrays of dates and spends, and return PNG images as bytes.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import io
+import os
+import asyncio
+import hashlib
+import threading
+import multiprocessing
+import concurrent.futures
+from cachetools import LRUCache
+from .metrics import CHART_RENDER_SECONDS
+from .tracing import span
+
+if TYPE_CHECKING:
+    import numpy
+
+DAILY = "daily"
+DAILY_ZOOMED = "daily_zoomed"
+ROLLING_AVERAGE = "rolling_average"
+CHART_KINDS = (DAILY, DAILY_ZOOMED, ROLLING_AVERAGE)
+
+# how many bytes of rendered graphs to keep in memory
+DEFAULT_CHART_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def make_chart_executor(processes: int = None):
+    """Creates a pool of processes to draw graphs on.
+
+    Args:
+        processes (int, optional): The number of processes. Defaults to None (one per CPU).
+
+    Returns:
+        concurrent.futures.ProcessPoolExecutor: The pool.
+    """
+    # "spawn" so that processes do not inherit the bot's threads and open connections
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=processes or os.cpu_count(),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def _import_matplotlib():
+    # imports the figure and its backend, as drawing a graph does
+    _new_figure()
+
+
+def warm_up_chart_executor(
+    executor: concurrent.futures.Executor, processes: int = None
+):
+    """Starts the processes in a pool and imports matplotlib in them,
+    so that the first graphs are not slowed down by it.
+
+    Args:
+        executor (concurrent.futures.Executor): The pool (see make_chart_executor).
+        processes (int, optional): The number of processes in the pool. Defaults to None (one per CPU).
+    """
+    for _ in range(processes or os.cpu_count()):
+        executor.submit(_import_matplotlib)
+
+
+def rolling_mean(spends: numpy.ndarray, days: int):
+    """Gets the mean of each `days` consecutive spends.
+
+    Args:
+        spends (numpy.ndarray): The spends.
+        days (int): The size of the window.
+
+    Returns:
+        numpy.ndarray: The means, one per window (len(spends) - days + 1 of them).
+    """
+    import numpy
+
+    if len(spends) < days:
+        return numpy.array([], dtype=float)
+    cumulative = numpy.cumsum(numpy.insert(spends.astype(float), 0, 0.0))
+    return (cumulative[days:] - cumulative[:-days]) / days
+
+
+def _new_figure():
+    # a Figure made without pyplot is not kept in pyplot's global list of figures,
+    #  so it is freed as soon as it is no longer used
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    return figure, figure.add_subplot(111)
+
+
+def _to_png(figure):
+    figure.tight_layout()
+    buf = io.BytesIO()
+    figure.savefig(buf, format="png")
+    figure.clear()
+    return buf.getvalue()
+
+
+def _plot_daily(ax, dates: numpy.ndarray, spends: numpy.ndarray):
+    import numpy
+
+    ax.plot(dates, spends, label="Spend")
+
+    last_date = dates.max()
+    days_ago_30 = last_date - numpy.timedelta64(30, "D")
+    ax.vlines(
+        days_ago_30,
+        0,
+        spends.max(),
+        color="red",
+        linestyle=":",
+        alpha=0.5,
+        label="30d ago",
+    )
+
+    rolling_spends_7d = rolling_mean(spends, 7)
+    ax.plot(
+        dates[len(dates) - len(rolling_spends_7d) :],
+        rolling_spends_7d,
+        linestyle="dashed",
+        label="7d rolling average",
+    )
+
+    ax.legend()
+    ax.set_ylabel("Spend (£)")
+    ax.set_xlabel("Date")
+    ax.set_title("Daily Spend")
+    ax.grid()
+    ax.set_ylim(bottom=0)
+
+
+def render_daily(dates: numpy.ndarray, spends: numpy.ndarray):
+    """Draws each day's spend, with a 7 day rolling average.
+
+    Args:
+        dates (numpy.ndarray): The dates (datetime64).
+        spends (numpy.ndarray): The spends.
+
+    Returns:
+        bytes: The graph as a PNG.
+    """
+    figure, ax = _new_figure()
+    _plot_daily(ax, dates, spends)
+    return _to_png(figure)
+
+
+def render_daily_zoomed(dates: numpy.ndarray, spends: numpy.ndarray):
+    """Draws the daily graph (see render_daily), zoomed in on the last 60 days,
+    and cut off at the 95th percentile spend.
+
+    Args:
+        dates (numpy.ndarray): The dates (datetime64).
+        spends (numpy.ndarray): The spends.
+
+    Returns:
+        bytes: The graph as a PNG.
+    """
+    import numpy
+
+    figure, ax = _new_figure()
+    _plot_daily(ax, dates, spends)
+    last_date = dates.max()
+    # set ylim to percentile 95
+    ax.set_ylim(0, numpy.quantile(spends, 0.95))
+    # set xlim to last 60 days
+    ax.set_xlim(last_date - numpy.timedelta64(60, "D"), last_date)
+    return _to_png(figure)
+
+
+def render_rolling_average(dates: numpy.ndarray, spends: numpy.ndarray):
+    """Draws the 30 day rolling average spend.
+
+    Args:
+        dates (numpy.ndarray): The dates (datetime64).
+        spends (numpy.ndarray): The spends.
+
+    Returns:
+        bytes: The graph as a PNG.
+    """
+    figure, ax = _new_figure()
+    rolling_spends_30d = rolling_mean(spends, 30)
+    ax.plot(
+        dates[len(dates) - len(rolling_spends_30d) :],
+        rolling_spends_30d,
+        label="30d rolling average",
+    )
+    ax.legend()
+    ax.set_ylabel("Spend (£)")
+    ax.set_xlabel("End Date")
+    ax.set_title("30 day rolling average")
+    ax.grid()
+    ax.set_ylim(bottom=0)
+    return _to_png(figure)
+
+
+RENDERERS = {
+    DAILY: render_daily,
+    DAILY_ZOOMED: render_daily_zoomed,
+    ROLLING_AVERAGE: render_rolling_average,
+}
+
+
+def render_chart(kind: str, dates: numpy.ndarray, spends: numpy.ndarray):
+    """Draws a graph.
+
+    Args:
+        kind (str): Which graph to draw (one of CHART_KINDS).
+        dates (numpy.ndarray): The dates (datetime64).
+        spends (numpy.ndarray): The spends.
+
+    Raises:
+        ValueError: If the kind of graph is not known.
+
+    Returns:
+        bytes: The graph as a PNG.
+    """
+    try:
+        renderer = RENDERERS[kind]
+    except KeyError as e:
+        raise ValueError(f"Unknown chart: {kind}") from e
+    return renderer(dates, spends)
+
+
+async def render_chart_async(
+    executor: concurrent.futures.Executor,
+    kind: str,
+    dates: numpy.ndarray,
+    spends: numpy.ndarray,
+):
+    """Draws a graph on a pool of processes (see render_chart and make_chart_executor).
+
+    Args:
+        executor (concurrent.futures.Executor): The pool to draw on. If None, asyncio's default thread pool is used.
+        kind (str): Which graph to draw (one of CHART_KINDS).
+        dates (numpy.ndarray): The dates (datetime64).
+        spends (numpy.ndarray): The spends.
+
+    Returns:
+        bytes: The graph as a PNG.
+    """
+    loop = asyncio.get_running_loop()
+    with CHART_RENDER_SECONDS.time(kind=kind), span("chart.render", kind=kind):
+        return await loop.run_in_executor(executor, render_chart, kind, dates, spends)
+
+
+def chart_key(kind: str, dates: numpy.ndarray, spends: numpy.ndarray):
+    """Gets a key that identifies a graph by what it shows,
+    so the same graph is never drawn (or uploaded) twice.
+
+    Args:
+        kind (str): Which graph (one of CHART_KINDS).
+        dates (numpy.ndarray): The dates (datetime64).
+        spends (numpy.ndarray): The spends.
+
+    Returns:
+        str: The key.
+    """
+    import numpy
+
+    digest = hashlib.sha256(kind.encode())
+    digest.update(numpy.ascontiguousarray(dates.astype("datetime64[D]")).tobytes())
+    digest.update(numpy.ascontiguousarray(spends.astype(float)).tobytes())
+    return digest.hexdigest()
+
+
+class ChartCache:
+    """
+    A thread-safe cache of rendered graphs, keyed by chart_key.
+    The least recently used graphs are evicted when the graphs take up more than `max_bytes`.
+
+    Once a graph has been sent, Telegram's file_id for it is stored too,
+    so it can be sent again without uploading it.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CHART_CACHE_BYTES):
+        """Creates a ChartCache object.
+
+        Args:
+            max_bytes (int, optional): The most bytes of graphs to keep.
+        """
+        # (png, file_id)
+        self._charts = LRUCache(
+            maxsize=max_bytes, getsizeof=lambda chart: len(chart[0])
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Gets a graph.
+
+        Args:
+            key (str): The graph's key (see chart_key).
+
+        Returns:
+            bytes | None: The graph as a PNG, or None if it is not cached.
+            str | None: Telegram's file_id for the graph, or None if it has not been sent yet.
+        """
+        with self._lock:
+            return self._charts.get(key, (None, None))
+
+    def set_png(self, key: str, png: bytes):
+        """Stores a rendered graph.
+
+        Args:
+            key (str): The graph's key (see chart_key).
+            png (bytes): The graph as a PNG.
+        """
+        with self._lock:
+            try:
+                self._charts[key] = (png, None)
+            except ValueError:
+                # the graph is bigger than the whole cache
+                pass
+
+    def set_file_id(self, key: str, file_id: str):
+        """Stores Telegram's file_id for a graph that has been sent.
+        Does nothing if the graph is not cached.
+
+        Args:
+            key (str): The graph's key (see chart_key).
+            file_id (str): The file_id of the sent photo.
+        """
+        with self._lock:
+            png, _ = self._charts.get(key, (None, None))
+            if png is not None:
+                self._charts[key] = (png, file_id)
@@ -0,0 +1,226 @@
+"""
+Collects errors for the admin, instead of sending them one message each.
+
+Errors are grouped by fingerprint (the type of exception, and where in the bot's code it was raised),
+and counted. The admin is told straight away about errors the bot has not seen before (up to a limit),
+and gets a regular digest of everything, with counts, first and last times, and one example of each.
+So an outage of Google Sheets, or a storm of 429s, is a few messages, not thousands.
+"""
+from __future__ import annotations
+import os
+import logging
+import datetime
+import threading
+import traceback
+from telegram import Bot, Update
+from telegram.ext import ContextTypes
+from .tracing import traced_job
+
+logger = logging.getLogger(__name__)
+
+# how often the digest is sent (seconds)
+DEFAULT_DIGEST_INTERVAL = 60 * 60
+# the most alerts about new errors to send between digests. Any more are only in the digest
+MAX_ALERTS_PER_INTERVAL = 5
+# Telegram's limit on the length of a message
+MAX_MESSAGE_LENGTH = 4096
+# how much of an error's message to keep as its example
+MAX_SAMPLE_LENGTH = 300
+
+# errors are located by the innermost line of the bot's own code
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+NEW_ERROR_MESSAGE = """
+New error!
+
+{fingerprint}
+
+{sample}
+
+{where}
+
+{traceback}
+"""
+DIGEST_MESSAGE = """
+Errors since {since}:
+
+{errors}
+"""
+
+
+def fingerprint(error: BaseException):
+    """Identifies an error by its type and where it was raised,
+    so that the same problem gives the same fingerprint whatever its message.
+
+    Args:
+        error (BaseException): The error.
+
+    Returns:
+        str: The fingerprint, e.g., "gspread.exceptions.APIError at budgeter/spreadsheet.py:210 (with_sheet1)".
+    """
+    error_type = type(error)
+    name = (
+        error_type.__qualname__
+        if error_type.__module__ == "builtins"
+        else f"{error_type.__module__}.{error_type.__qualname__}"
+    )
+    frames = traceback.extract_tb(error.__traceback__)
+    if len(frames) == 0:
+        return name
+    own_frames = [
+        frame
+        for frame in frames
+        if os.path.abspath(frame.filename).startswith(PROJECT_ROOT + os.sep)
+    ]
+    frame = (own_frames or frames)[-1]
+    filename = os.path.abspath(frame.filename)
+    if filename.startswith(PROJECT_ROOT + os.sep):
+        filename = os.path.relpath(filename, PROJECT_ROOT)
+    return f"{name} at {filename}:{frame.lineno} ({frame.name})"
+
+
+def describe_update(update: object):
+    """Describes what an error happened while doing, without the user's messages (which can contain their spending).
+
+    Args:
+        update (object): The update being handled, or None (e.g., for errors in jobs).
+
+    Returns:
+        str: The description.
+    """
+    if not isinstance(update, Update):
+        return "not handling an update"
+    parts = [f"update {update.update_id}"]
+    if update.effective_user is not None:
+        parts.append(f"user {update.effective_user.id}")
+    message = update.effective_message
+    if message is not None and message.text and message.text.startswith("/"):
+        parts.append(message.text.split()[0])
+    return ", ".join(parts)
+
+
+def format_time(moment: datetime.datetime):
+    return moment.strftime("%Y-%m-%d %H:%M:%S UTC")
+
+
+class ErrorDigest:
+    """
+    Thread-safe counts of errors by fingerprint, since the last digest.
+    """
+
+    def __init__(
+        self,
+        admin_id: int = None,
+        max_alerts_per_interval: int = MAX_ALERTS_PER_INTERVAL,
+    ):
+        """Creates an ErrorDigest object.
+
+        Args:
+            admin_id (int, optional): The chat to send alerts and digests to.
+                Defaults to None (errors are only logged).
+            max_alerts_per_interval (int, optional): The most alerts about new errors between digests.
+        """
+        self.admin_id = admin_id
+        self.max_alerts_per_interval = max_alerts_per_interval
+        self._lock = threading.Lock()
+        # fingerprints seen since the bot started
+        self._known = set()
+        # fingerprint -> {"count", "first_seen", "last_seen", "sample"}, since the last digest
+        self._errors = {}
+        self._since = datetime.datetime.now(datetime.timezone.utc)
+        self._alerts = 0
+
+    def record(self, error: BaseException, update: object = None):
+        """Counts an error.
+
+        Args:
+            error (BaseException): The error.
+            update (object, optional): The update being handled when it happened. Defaults to None.
+
+        Returns:
+            str | None: An alert to send the admin now, if the error is new (and not too many have been sent),
+                otherwise None.
+        """
+        key = fingerprint(error)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        sample = f"{type(error).__name__}: {error}"[:MAX_SAMPLE_LENGTH]
+        where = describe_update(update)
+        with self._lock:
+            entry = self._errors.get(key)
+            if entry is None:
+                entry = {
+                    "count": 0,
+                    "first_seen": now,
+                    "sample": f"{sample} ({where})",
+                }
+                self._errors[key] = entry
+            entry["count"] += 1
+            entry["last_seen"] = now
+            if key in self._known:
+                return None
+            self._known.add(key)
+            if self._alerts >= self.max_alerts_per_interval:
+                return None
+            self._alerts += 1
+        # the last few frames, which are code, not users' data
+        frames = "".join(traceback.format_tb(error.__traceback__)[-3:])
+        return NEW_ERROR_MESSAGE.format(
+            fingerprint=key, sample=sample, where=where, traceback=frames
+        )[:MAX_MESSAGE_LENGTH]
+
+    def take_digest(self):
+        """Gets a digest of the errors since the last digest, and starts counting again.
+
+        Returns:
+            str | None: The digest, or None if there have been no errors.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            errors, self._errors = self._errors, {}
+            since, self._since = self._since, now
+            self._alerts = 0
+        if len(errors) == 0:
+            return None
+        lines = []
+        for key, entry in sorted(errors.items(), key=lambda item: -item[1]["count"]):
+            lines.append(
+                f"{entry['count']}× {key}\n"
+                f"  first {format_time(entry['first_seen'])}, last {format_time(entry['last_seen'])}\n"
+                f"  e.g., {entry['sample']}"
+            )
+        text = DIGEST_MESSAGE.format(
+            since=format_time(since), errors="\n\n".join(lines)
+        )
+        if len(text) > MAX_MESSAGE_LENGTH:
+            text = text[: MAX_MESSAGE_LENGTH - 20] + "\n\n(cut short)"
+        return text
+
+
+async def send_to_admin(bot: Bot, digest: ErrorDigest, text: str):
+    """Sends the admin a message about errors. Failing to send it is only logged,
+    so that errors while Telegram is struggling do not make more errors.
+
+    Args:
+        bot (Bot): The bot.
+        digest (ErrorDigest): The digest, which knows who the admin is.
+        text (str): The message.
+    """
+    if digest.admin_id is None:
+        return
+    try:
+        await bot.send_message(chat_id=digest.admin_id, text=text)
+    except Exception as error:
+        logger.warning("Could not send errors to the admin: %s", error)
+
+
+@traced_job
+async def send_error_digest(context: ContextTypes.DEFAULT_TYPE):
+    """Sends the admin the digest of errors, if there have been any. Runs as a regular job.
+
+    Args:
+        context: the context passed by the job queue
+    """
+    digest: ErrorDigest = context.bot_data["error_digest"]
+    text = digest.take_digest()
+    if text is not None:
+        await send_to_admin(context.bot, digest, text)
@@ -0,0 +1,282 @@
+"""
+An in-memory stand-in for Google Sheets (gspread's Client, Spreadsheet and Worksheet),
+to run the bot locally, and to measure caching, concurrency and retries, without a network.
+
+Every request can be slowed down (latency and jitter), and can fail like Google Sheets does when
+the quota is exceeded (429) or when it has problems (5xx). Select it in bot.py with FAKE_SHEETS=1.
+"""
+import re
+import json
+import time
+import random
+import threading
+from gspread.exceptions import APIError, SpreadsheetNotFound
+from gspread.utils import a1_to_rowcol, extract_id_from_url
+
+# what a new spreadsheet contains
+DEFAULT_HEADER = ["Date", "Spend"]
+
+A1_RANGE = re.compile(r"^([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?$")
+
+
+class FakeResponse:
+    """
+    Enough of a requests.Response for gspread.exceptions.APIError.
+    """
+
+    def __init__(self, status_code: int, message: str):
+        self.status_code = status_code
+        self._error = {"code": status_code, "message": message, "status": message}
+        self.text = json.dumps({"error": self._error})
+
+    def json(self):
+        return {"error": self._error}
+
+
+def column_number(letters: str):
+    """Converts column letters to a number, e.g., "A" -> 1, "AB" -> 28."""
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord("A") + 1
+    return number
+
+
+def column_letters(number: int):
+    """Converts a column number to letters, e.g., 1 -> "A", 28 -> "AB"."""
+    letters = ""
+    while number > 0:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def parse_range(range_name: str):
+    """Reads an A1 range (e.g., "A:B", "A5:B", "A1:B10", "B2") without a sheet name.
+
+    Args:
+        range_name (str): The range.
+
+    Raises:
+        ValueError: If the range is not understood.
+
+    Returns:
+        tuple[int, int, int | None, int]: (first row, first column, last row or None for no limit, last column),
+            all 1-based.
+    """
+    range_name = range_name.split("!")[-1].upper()
+    match = A1_RANGE.match(range_name)
+    if match is None:
+        raise ValueError(f"Unsupported range: {range_name}")
+    first_column, first_row, last_column, last_row = match.groups()
+    if last_column is None:
+        row, column = a1_to_rowcol(range_name)
+        return row, column, row, column
+    return (
+        int(first_row) if first_row else 1,
+        column_number(first_column),
+        int(last_row) if last_row else None,
+        column_number(last_column),
+    )
+
+
+class FakeClient:
+    """
+    Stands in for gspread.Client. Spreadsheets are created (with DEFAULT_HEADER) the first time they are opened,
+    unless `create_missing` is False.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        quota_error_rate: float = 0.0,
+        server_error_rate: float = 0.0,
+        create_missing: bool = True,
+        seed: int = None,
+    ):
+        """Creates a FakeClient object.
+
+        Args:
+            latency (float, optional): How long every request takes (seconds). Defaults to 0.
+            jitter (float, optional): Up to this much longer, at random (seconds). Defaults to 0.
+            quota_error_rate (float, optional): The fraction of requests that fail with 429. Defaults to 0.
+            server_error_rate (float, optional): The fraction of requests that fail with 500 or 503. Defaults to 0.
+            create_missing (bool, optional): Whether opening an unknown spreadsheet creates it,
+                rather than failing with SpreadsheetNotFound. Defaults to True.
+            seed (int, optional): Seed for the random jitter and failures. Defaults to None.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.quota_error_rate = quota_error_rate
+        self.server_error_rate = server_error_rate
+        self.create_missing = create_missing
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._spreadsheets = {}
+        # how many requests of each kind have been made (e.g., "get_values"), including failed ones
+        self.requests = {}
+
+    def request(self, kind: str):
+        """Simulates a request to Google Sheets: counts it, waits, and maybe fails.
+
+        Args:
+            kind (str): What the request is, for FakeClient.requests.
+
+        Raises:
+            gspread.exceptions.APIError: If the request fails.
+        """
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            roll = self._random.random()
+            server_error = self._random.choice((500, 503))
+        time.sleep(delay)
+        if roll < self.quota_error_rate:
+            raise APIError(
+                FakeResponse(429, "Quota exceeded for quota metric 'Read requests'")
+            )
+        if roll < self.quota_error_rate + self.server_error_rate:
+            raise APIError(FakeResponse(server_error, "The service is unavailable."))
+
+    def create(self, spreadsheet_id: str, rows: list[list] = None):
+        """Creates a spreadsheet.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+            rows (list[list], optional): Its first sheet's contents. Defaults to just DEFAULT_HEADER.
+
+        Returns:
+            FakeSpreadsheet: The spreadsheet.
+        """
+        spreadsheet = FakeSpreadsheet(
+            self, spreadsheet_id, [DEFAULT_HEADER] if rows is None else rows
+        )
+        with self._lock:
+            self._spreadsheets[spreadsheet_id] = spreadsheet
+        return spreadsheet
+
+    def open_by_key(self, key: str):
+        self.request("open")
+        with self._lock:
+            spreadsheet = self._spreadsheets.get(key)
+        if spreadsheet is None:
+            if not self.create_missing:
+                raise SpreadsheetNotFound
+            spreadsheet = self.create(key)
+        return spreadsheet
+
+    def open_by_url(self, url: str):
+        try:
+            key = extract_id_from_url(url)
+        except Exception:
+            key = url
+        return self.open_by_key(key)
+
+
+class FakeSpreadsheet:
+    """
+    Stands in for gspread.Spreadsheet, with a single sheet.
+    """
+
+    def __init__(self, client: FakeClient, spreadsheet_id: str, rows: list[list]):
+        self.client = client
+        self.id = spreadsheet_id
+        self._sheet1 = FakeWorksheet(client, rows)
+
+    @property
+    def sheet1(self):
+        self.client.request("sheet1")
+        return self._sheet1
+
+
+class FakeWorksheet:
+    """
+    Stands in for gspread.Worksheet. Values are stored as they are given (numbers stay numbers).
+    """
+
+    def __init__(self, client: FakeClient, rows: list[list]):
+        self.client = client
+        self._rows = [list(row) for row in rows]
+        self._lock = threading.Lock()
+
+    @property
+    def row_count(self):
+        with self._lock:
+            return len(self._rows)
+
+    def _last_row_in_columns(self, first_column: int, last_column: int):
+        for index in range(len(self._rows) - 1, -1, -1):
+            cells = self._rows[index][first_column - 1 : last_column]
+            if any(cell not in ("", None) for cell in cells):
+                return index + 1
+        return 0
+
+    def get_values(self, range_name: str = None, **kwargs):
+        self.client.request("get_values")
+        with self._lock:
+            if range_name is None:
+                first_row, first_column = 1, 1
+                last_row = None
+                last_column = max((len(row) for row in self._rows), default=0)
+            else:
+                first_row, first_column, last_row, last_column = parse_range(range_name)
+            if last_row is None:
+                last_row = self._last_row_in_columns(first_column, last_column)
+            values = [
+                list(row[first_column - 1 : last_column])
+                for row in self._rows[first_row - 1 : last_row]
+            ]
+        # like gspread, trailing empty rows are dropped and the rest padded to the same width
+        while values and all(cell in ("", None) for cell in values[-1]):
+            values.pop()
+        width = max((len(row) for row in values), default=0)
+        return [row + [""] * (width - len(row)) for row in values]
+
+    def get_all_values(self, **kwargs):
+        return self.get_values(**kwargs)
+
+    def update(self, range_name: str, values: list[list] = None, **kwargs):
+        self.client.request("update")
+        with self._lock:
+            self._write(range_name, values)
+
+    def batch_update(self, data: list[dict], **kwargs):
+        self.client.request("batch_update")
+        with self._lock:
+            for update in data:
+                self._write(update["range"], update["values"])
+
+    def _write(self, range_name: str, values: list[list]):
+        first_row, first_column, _, _ = parse_range(range_name)
+        for row_offset, row_values in enumerate(values):
+            row_index = first_row - 1 + row_offset
+            while len(self._rows) <= row_index:
+                self._rows.append([])
+            row = self._rows[row_index]
+            for column_offset, value in enumerate(row_values):
+                column_index = first_column - 1 + column_offset
+                while len(row) <= column_index:
+                    row.append("")
+                row[column_index] = value
+
+    def insert_row(self, values: list, index: int = 1, **kwargs):
+        self.client.request("insert_row")
+        with self._lock:
+            self._rows.insert(index - 1, list(values))
+
+    def append_row(self, values: list, **kwargs):
+        self.append_rows([values], **kwargs)
+
+    def append_rows(self, values: list[list], table_range: str = None, **kwargs):
+        self.client.request("append_rows")
+        with self._lock:
+            if table_range is None:
+                first_column, last_column = 1, max(
+                    (len(row) for row in self._rows), default=1
+                )
+            else:
+                _, first_column, _, last_column = parse_range(table_range)
+            # after the last row of the table, like Google Sheets' "append"
+            next_row = self._last_row_in_columns(first_column, last_column) + 1
+            first_cell = f"{column_letters(first_column)}{next_row}"
+            self._write(first_cell, values)
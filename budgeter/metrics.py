@@ -0,0 +1,496 @@
+"""
+Counters and latency histograms for the bot, served in Prometheus' text format on a local HTTP
+endpoint (see start_metrics_server), so that slow handlers, Google Sheets errors, and the like
+can be graphed and alerted on.
+
+The metrics are module-level (e.g., HANDLER_SECONDS), and are updated where the work happens:
+handlers are wrapped with timed_handler, Google Sheets calls are counted in Spreadsheet.request,
+Telegram calls in InstrumentedRequest, graphs in render_chart_async, and reminders in ReminderSchedule.
+"""
+from __future__ import annotations
+import math
+import time
+import logging
+import threading
+import functools
+import contextlib
+import http.server
+from telegram.request import BaseRequest, RequestData
+from .tracing import span, CLIENT
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the latency histograms' buckets (seconds)
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    math.inf,
+)
+
+
+def format_labels(labels: dict):
+    """Formats labels for the Prometheus text format, e.g., {"handler": "spend"} -> '{handler="spend"}'."""
+    if len(labels) == 0:
+        return ""
+    escaped = (
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_value(value: float):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """
+    A named metric, with one value per combination of label values. Thread-safe.
+    """
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        """Creates a metric.
+
+        Args:
+            name (str): The metric's name, e.g., "budgeter_handler_seconds".
+            documentation (str): What it measures.
+            labelnames (tuple, optional): The names of its labels. Defaults to () (no labels).
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} has labels {self.labelnames}, not {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Gets the metric's current values.
+
+        Returns:
+            list[tuple[str, dict, float]]: (sample name, labels, value) of each sample.
+        """
+        raise NotImplementedError
+
+    def render(self):
+        """Formats the metric in Prometheus' text format.
+
+        Returns:
+            str: The metric's lines, ending with a newline.
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """
+    A count that only goes up, e.g., of requests made.
+    """
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """Adds to the count.
+
+        Args:
+            amount (float, optional): How much to add. Defaults to 1.
+            **labels: The value of each label.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            (f"{self.name}_total", dict(zip(self.labelnames, key)), value)
+            for key, value in sorted(values)
+        ]
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, e.g., the length of a queue.
+    It is either set, or read from a function whenever the metrics are served.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function, **labels):
+        """Reads the value from a function whenever the metrics are served.
+
+        Args:
+            function (Callable[[], float]): Gets the value.
+            **labels: The value of each label.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def get(self, **labels):
+        key = self._key(labels)
+        with self._lock:
+            function = self._functions.get(key)
+            value = self._values.get(key, 0)
+        return function() if function is not None else value
+
+    def samples(self):
+        with self._lock:
+            keys = sorted(set(self._values) | set(self._functions))
+        samples = []
+        for key in keys:
+            labels = dict(zip(self.labelnames, key))
+            try:
+                samples.append((self.name, labels, self.get(**labels)))
+            except Exception as error:
+                logger.warning("Could not read %s: %s", self.name, error)
+        return samples
+
+
+class Histogram(Metric):
+    """
+    Counts of observations (e.g., how long something took) in buckets, with their sum.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        """Creates a histogram.
+
+        Args:
+            name (str): The metric's name, e.g., "budgeter_handler_seconds".
+            documentation (str): What it measures.
+            labelnames (tuple, optional): The names of its labels. Defaults to () (no labels).
+            buckets (tuple, optional): The upper bound of each bucket, ascending (a last bucket for everything
+                bigger is added if needed). Defaults to DEFAULT_BUCKETS.
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+
+    def observe(self, value: float, **labels):
+        """Records an observation.
+
+        Args:
+            value (float): The observation, e.g., a duration in seconds.
+            **labels: The value of each label.
+        """
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Records how long the body of a `with` statement takes (seconds), even if it raises.
+
+        Args:
+            **labels: The value of each label.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+        return sum(counts)
+
+    def samples(self):
+        with self._lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in sorted(self._values.items())
+            ]
+        samples = []
+        for key, counts, total in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(
+                    (
+                        f"{self.name}_bucket",
+                        {**labels, "le": format_value(bound)},
+                        cumulative,
+                    )
+                )
+            samples.append((f"{self.name}_count", labels, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+        return samples
+
+
+class Registry:
+    """
+    The metrics to serve.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric):
+        """Adds a metric.
+
+        Args:
+            metric (Metric): The metric.
+
+        Raises:
+            ValueError: If there is already a metric with the same name.
+
+        Returns:
+            Metric: The metric, for convenience.
+        """
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"There is already a metric called {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Formats all the metrics in Prometheus' text format.
+
+        Returns:
+            str: The metrics.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.render() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(
+    Histogram(
+        "budgeter_handler_seconds",
+        "Time taken to handle an update, by handler.",
+        ("handler",),
+    )
+)
+SHEETS_REQUESTS = REGISTRY.register(
+    Counter(
+        "budgeter_sheets_requests",
+        "Google Sheets requests (including retries), by operation and outcome (ok, an HTTP status, or error).",
+        ("operation", "outcome"),
+    )
+)
+SHEETS_REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "budgeter_sheets_request_seconds",
+        "Time taken by a Google Sheets request, by operation.",
+        ("operation",),
+    )
+)
+CHART_RENDER_SECONDS = REGISTRY.register(
+    Histogram(
+        "budgeter_chart_render_seconds",
+        "Time taken to draw a graph, including waiting for a process, by kind of graph.",
+        ("kind",),
+    )
+)
+TELEGRAM_REQUESTS = REGISTRY.register(
+    Counter(
+        "budgeter_telegram_requests",
+        "Telegram Bot API calls, by method and outcome (an HTTP status, or error).",
+        ("method", "outcome"),
+    )
+)
+TELEGRAM_REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "budgeter_telegram_request_seconds",
+        "Time taken by a Telegram Bot API call, by method.",
+        ("method",),
+    )
+)
+OUTBOX_SPENDS = REGISTRY.register(
+    Gauge(
+        "budgeter_outbox_spends",
+        "Spends waiting to be written to spreadsheets.",
+    )
+)
+UPDATE_QUEUE_UPDATES = REGISTRY.register(
+    Gauge(
+        "budgeter_update_queue_updates",
+        "Updates from Telegram waiting to be handled.",
+    )
+)
+REMINDER_FANOUT_SECONDS = REGISTRY.register(
+    Histogram(
+        "budgeter_reminder_fanout_seconds",
+        "Time taken to send all the reminders due at one time.",
+        buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, math.inf),
+    )
+)
+REMINDERS = REGISTRY.register(
+    Counter(
+        "budgeter_reminders",
+        "Reminders, by result (sent, up_to_date, blocked or failed).",
+        ("result",),
+    )
+)
+
+
+def timed_handler(callback):
+    """Wraps a handler callback so that how long it takes is recorded in HANDLER_SECONDS,
+    labelled with the callback's name, and as a span in the update's trace.
+
+    Args:
+        callback (Callable[[Update, CallbackContext], Awaitable]): The callback.
+
+    Returns:
+        Callable[[Update, CallbackContext], Awaitable]: The wrapped callback.
+    """
+    handler = callback.__name__
+
+    @functools.wraps(callback)
+    async def timed(update, context):
+        with HANDLER_SECONDS.time(handler=handler), span(f"handler.{handler}"):
+            return await callback(update, context)
+
+    return timed
+
+
+class InstrumentedRequest(BaseRequest):
+    """
+    Wraps how the bot talks to the Telegram Bot API, to count and time every call
+    (see TELEGRAM_REQUESTS and TELEGRAM_REQUEST_SECONDS).
+    """
+
+    def __init__(self, request: BaseRequest):
+        """Creates an InstrumentedRequest object.
+
+        Args:
+            request (BaseRequest): The request to wrap, e.g., telegram.request.HTTPXRequest().
+        """
+        self.request = request
+
+    async def initialize(self):
+        await self.request.initialize()
+
+    async def shutdown(self):
+        await self.request.shutdown()
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ):
+        api_method = url.rsplit("/", 1)[-1]
+        outcome = "error"
+        with TELEGRAM_REQUEST_SECONDS.time(method=api_method), span(
+            f"telegram.{api_method}", CLIENT
+        ):
+            try:
+                code, payload = await self.request.do_request(
+                    url,
+                    method,
+                    request_data=request_data,
+                    read_timeout=read_timeout,
+                    write_timeout=write_timeout,
+                    connect_timeout=connect_timeout,
+                    pool_timeout=pool_timeout,
+                )
+                outcome = str(code)
+            finally:
+                TELEGRAM_REQUESTS.inc(method=api_method, outcome=outcome)
+        return code, payload
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scraped every few seconds, so not worth logging
+        pass
+
+
+def start_metrics_server(
+    port: int, host: str = "127.0.0.1", registry: Registry = REGISTRY
+):
+    """Serves the metrics at http://host:port/metrics, on a background thread.
+
+    Args:
+        port (int): The port to listen on (0 for any free port).
+        host (str, optional): The address to listen on. Defaults to "127.0.0.1" (only this machine).
+        registry (Registry, optional): The metrics to serve. Defaults to REGISTRY.
+
+    Returns:
+        http.server.ThreadingHTTPServer: The server. Stop it with shutdown().
+    """
+    handler = type("MetricsHandler", (MetricsHandler,), {"registry": registry})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Serving metrics on http://%s:%d/metrics", *server.server_address)
+    return server
@@ -0,0 +1,363 @@
+"""
+A local copy of each spreadsheet's spending data (columns A and B), stored in an SQLite database.
+
+Commands read users' data from here instead of from Google Sheets, so they are fast, and keep working
+when Google Sheets is slow or down. The copy is kept up to date by the bot's own writes,
+and by sync_mirrors, which regularly reads the new rows of each spreadsheet (and, less often,
+the whole spreadsheet, see Spreadsheet.sync) to pick up changes made to it by hand.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import math
+import time
+import sqlite3
+import logging
+import datetime
+import threading
+from telegram.ext import ContextTypes
+from .tracing import traced_job
+from .quota import READ
+
+if TYPE_CHECKING:
+    import pandas
+
+logger = logging.getLogger(__name__)
+
+# how often each spreadsheet's new rows are read, if the quota allows (seconds)
+DEFAULT_SYNC_INTERVAL = 15 * 60
+# how often sync_mirrors runs (seconds)
+SYNC_JOB_INTERVAL = 60
+# the most of the read quota sync_mirrors uses, leaving the rest for users' own requests
+MAX_SYNC_SHARE = 0.5
+# the most reads syncing a spreadsheet takes: opening it, finding its first sheet, and reading its new rows
+READS_PER_SYNC = 3
+# sync_mirrors does nothing if the Google Sheets quota is busier than this (see QuotaManager.pressure)
+MAX_SYNC_PRESSURE = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spends (
+    spreadsheet_id TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    spend REAL,
+    PRIMARY KEY (spreadsheet_id, row)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS spreadsheets (
+    spreadsheet_id TEXT PRIMARY KEY,
+    spreadsheet_url TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    synced_at REAL NOT NULL,
+    full_synced_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS spreadsheets_by_synced_at ON spreadsheets (synced_at);
+"""
+
+
+class SpendingMirror:
+    """
+    A thread-safe local copy of spending dataframes, keyed by spreadsheet ID.
+    """
+
+    def __init__(self, filepath: str = "spending_mirror.sqlite3"):
+        """Creates a SpendingMirror object.
+
+        Args:
+            filepath (str, optional): The database file. Defaults to "spending_mirror.sqlite3".
+        """
+        self.filepath = filepath
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self.filepath, check_same_thread=False, isolation_level=None
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # it is only a copy, so losing the last writes if the machine crashes is fine
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def get_dataframe(self, spreadsheet_id: str):
+        """Gets the copy of a spreadsheet's spending data.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+
+        Returns:
+            pandas.DataFrame | None: The data (columns: {"Date": datetime, "Spend": float}),
+                or None if there is no copy.
+        """
+        with self._lock:
+            synced = self.connection.execute(
+                "SELECT rows FROM spreadsheets WHERE spreadsheet_id = ?",
+                (spreadsheet_id,),
+            ).fetchone()
+            if synced is None:
+                return None
+            rows = self.connection.execute(
+                "SELECT date, spend FROM spends WHERE spreadsheet_id = ? ORDER BY row",
+                (spreadsheet_id,),
+            ).fetchall()
+        import pandas
+
+        dframe = pandas.DataFrame(rows, columns=["Date", "Spend"])
+        dframe["Date"] = pandas.to_datetime(dframe["Date"])
+        dframe["Spend"] = pandas.to_numeric(dframe["Spend"]).astype(float)
+        return dframe
+
+    def get_tail(self, spreadsheet_id: str):
+        """Gets the last date and number of rows of the copy of a spreadsheet, without loading all of it.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+
+        Returns:
+            tuple[datetime.datetime | None, int] | None: (last date, number of rows including the header),
+                or None if there is no copy.
+        """
+        with self._lock:
+            synced = self.connection.execute(
+                "SELECT rows FROM spreadsheets WHERE spreadsheet_id = ?",
+                (spreadsheet_id,),
+            ).fetchone()
+            if synced is None:
+                return None
+            last = self.connection.execute(
+                "SELECT date FROM spends WHERE spreadsheet_id = ? ORDER BY row DESC LIMIT 1",
+                (spreadsheet_id,),
+            ).fetchone()
+        last_date = None if last is None else datetime.datetime.fromisoformat(last[0])
+        return last_date, synced[0] + 1
+
+    def get_full_synced_at(self, spreadsheet_id: str):
+        """Gets when a spreadsheet was last copied in full.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+
+        Returns:
+            float | None: The time (time.time), or None if there is no copy.
+        """
+        with self._lock:
+            synced = self.connection.execute(
+                "SELECT full_synced_at FROM spreadsheets WHERE spreadsheet_id = ?",
+                (spreadsheet_id,),
+            ).fetchone()
+        return None if synced is None else synced[0]
+
+    def set_dataframe(
+        self,
+        spreadsheet_id: str,
+        spreadsheet_url: str,
+        dframe: pandas.DataFrame,
+        full_read: bool = True,
+    ):
+        """Stores a spreadsheet's spending data.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+            spreadsheet_url (str): The url of the spreadsheet, to sync it later.
+            dframe (pandas.DataFrame): The data. Columns: {"Date": datetime, "Spend": float}
+            full_read (bool, optional): Whether the whole spreadsheet was read to make the dataframe.
+                If not, only rows after the ones already stored are written. Defaults to True.
+        """
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN")
+            synced = self.connection.execute(
+                "SELECT rows, full_synced_at FROM spreadsheets WHERE spreadsheet_id = ?",
+                (spreadsheet_id,),
+            ).fetchone()
+            if full_read or synced is None or synced[0] > len(dframe):
+                self.connection.execute(
+                    "DELETE FROM spends WHERE spreadsheet_id = ?", (spreadsheet_id,)
+                )
+                first_new_row = 0
+                full_synced_at = now
+            else:
+                first_new_row, full_synced_at = synced
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO spends (spreadsheet_id, row, date, spend) VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        spreadsheet_id,
+                        row,
+                        date.date().isoformat(),
+                        None if math.isnan(spend) else float(spend),
+                    )
+                    for row, (date, spend) in enumerate(
+                        zip(dframe["Date"], dframe["Spend"])
+                    )
+                    if row >= first_new_row
+                ],
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO spreadsheets VALUES (?, ?, ?, ?, ?)",
+                (spreadsheet_id, spreadsheet_url, len(dframe), now, full_synced_at),
+            )
+
+    def append_rows(
+        self,
+        spreadsheet_id: str,
+        rows: list[tuple[datetime.datetime, float]],
+        rows_before: int = None,
+    ):
+        """Appends rows to the copy of a spreadsheet, after they have been written to the spreadsheet.
+        Does nothing if there is no copy.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+            rows (list[tuple[datetime.datetime, float]]): The (date, spend) rows to add.
+            rows_before (int, optional): The number of rows in the spreadsheet before they were written,
+                including the header (see Spreadsheet.get_tail). If the copy does not have that many
+                (e.g., rows were added by hand since it was synced), they are not appended,
+                and it is synced first next time instead (see sync_mirrors). Defaults to None (not checked).
+        """
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN")
+            synced = self.connection.execute(
+                "SELECT rows FROM spreadsheets WHERE spreadsheet_id = ?",
+                (spreadsheet_id,),
+            ).fetchone()
+            if synced is None:
+                return
+            (first_new_row,) = synced
+            if rows_before is not None and first_new_row + 1 != rows_before:
+                self.connection.execute(
+                    "UPDATE spreadsheets SET synced_at = 0 WHERE spreadsheet_id = ?",
+                    (spreadsheet_id,),
+                )
+                return
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO spends (spreadsheet_id, row, date, spend) VALUES (?, ?, ?, ?)",
+                [
+                    (spreadsheet_id, first_new_row + i, date.date().isoformat(), spend)
+                    for i, (date, spend) in enumerate(rows)
+                ],
+            )
+            self.connection.execute(
+                "UPDATE spreadsheets SET rows = ? WHERE spreadsheet_id = ?",
+                (first_new_row + len(rows), spreadsheet_id),
+            )
+
+    def get_stale(self, older_than: float, limit: int = None):
+        """Gets the spreadsheets which were synced the longest time ago.
+
+        Args:
+            older_than (float): Only spreadsheets not synced for this long (seconds).
+            limit (int, optional): The most spreadsheets to get. Defaults to None (all of them).
+
+        Returns:
+            list[str]: The urls of the spreadsheets, least recently synced first.
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT spreadsheet_url FROM spreadsheets WHERE synced_at < ? ORDER BY synced_at LIMIT ?",
+                (time.time() - older_than, -1 if limit is None else limit),
+            ).fetchall()
+        return [url for url, in rows]
+
+    def get_synced_at(self, spreadsheet_id: str):
+        """Gets when a spreadsheet was last synced (see sync_mirrors).
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+
+        Returns:
+            float | None: The time (time.time), or None if there is no copy.
+        """
+        with self._lock:
+            synced = self.connection.execute(
+                "SELECT synced_at FROM spreadsheets WHERE spreadsheet_id = ?",
+                (spreadsheet_id,),
+            ).fetchone()
+        return None if synced is None else synced[0]
+
+    def mark_synced(self, spreadsheet_id: str):
+        """Records that a spreadsheet has been checked and has not changed.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+        """
+        with self._lock:
+            self.connection.execute(
+                "UPDATE spreadsheets SET synced_at = ? WHERE spreadsheet_id = ?",
+                (time.time(), spreadsheet_id),
+            )
+
+    def invalidate(self, spreadsheet_id: str):
+        """Removes the copy of a spreadsheet, so that it is read in full next time.
+
+        Args:
+            spreadsheet_id (str): The ID of the spreadsheet.
+        """
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.execute(
+                "DELETE FROM spends WHERE spreadsheet_id = ?", (spreadsheet_id,)
+            )
+            self.connection.execute(
+                "DELETE FROM spreadsheets WHERE spreadsheet_id = ?", (spreadsheet_id,)
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM spreadsheets"
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def sync_batch_size(spreadsheets: int, reads_per_minute: float = None):
+    """Works out how many spreadsheets sync_mirrors should read each time it runs:
+    enough to read each one every DEFAULT_SYNC_INTERVAL, but no more than MAX_SYNC_SHARE of the read quota allows.
+    With more spreadsheets than that, each one is read less often (see Spreadsheet.get_spending_dataframe,
+    which reads the new rows of the ones people are using).
+
+    Args:
+        spreadsheets (int): The number of spreadsheets.
+        reads_per_minute (float, optional): The read quota (see QuotaManager.per_minute). Defaults to None (no limit).
+
+    Returns:
+        int: The number of spreadsheets.
+    """
+    wanted = math.ceil(spreadsheets * SYNC_JOB_INTERVAL / DEFAULT_SYNC_INTERVAL)
+    if reads_per_minute is None:
+        return wanted
+    allowed = reads_per_minute * SYNC_JOB_INTERVAL / 60 * MAX_SYNC_SHARE
+    return min(wanted, max(1, int(allowed / READS_PER_SYNC)))
+
+
+@traced_job
+async def sync_mirrors(context: ContextTypes.DEFAULT_TYPE):
+    """Brings the local copies of the least recently synced spreadsheets up to date. Runs as a regular job.
+
+    Args:
+        context: the context passed by the job queue
+    """
+    from .spreadsheet import open_spreadsheet
+
+    mirror: SpendingMirror = context.bot_data["spending_mirror"]
+    quota = context.bot_data.get("spreadsheet_quota")
+    if quota is not None and quota.pressure() > MAX_SYNC_PRESSURE:
+        # users' own requests come first
+        return
+    batch = sync_batch_size(
+        len(mirror), None if quota is None else quota.per_minute(READ)
+    )
+    for spreadsheet_url in mirror.get_stale(DEFAULT_SYNC_INTERVAL, batch):
+        spreadsheet = open_spreadsheet(context.bot_data, spreadsheet_url)
+        try:
+            await spreadsheet.sync()
+        except Exception as error:
+            logger.warning("Could not sync %s: %s", spreadsheet_url, error)
+            # try others first next time
+            mirror.mark_synced(spreadsheet.spreadsheet_id)
@@ -0,0 +1,337 @@
+"""
+A local, durable queue of spends waiting to be written to users' spreadsheets.
+
+/spend records spends here and answers straight away, instead of waiting for Google Sheets
+(or failing when it is down). flush_outbox then writes them to the spreadsheets in the background,
+one batch per spreadsheet, and only removes them once they are written.
+"""
+from __future__ import annotations
+import math
+import asyncio
+import sqlite3
+import logging
+import datetime
+import threading
+from telegram.ext import ContextTypes
+from .spreadsheet import open_spreadsheet
+from .tracing import traced_job
+
+logger = logging.getLogger(__name__)
+
+# how often queued spends are written to spreadsheets, if nothing else triggers it (seconds)
+DEFAULT_FLUSH_INTERVAL = 30
+# how many times to try writing a spend before giving up on it and telling the user
+MAX_ATTEMPTS = 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spends (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    spreadsheet_url TEXT NOT NULL,
+    date TEXT NOT NULL,
+    spend REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS spends_by_spreadsheet ON spends (spreadsheet_url, id);
+"""
+
+SPENDS_NOT_SAVED_MESSAGE = """
+Sorry! I couldn't save your spending for {} to your spreadsheet:
+
+{}
+
+Please add it by hand, or fix the problem and use /spend again.
+"""
+ALREADY_HAS_LATER_DATA_MESSAGE = "Your spreadsheet already has a different spend for that day, or spending for a later day."
+
+
+class SpendOutbox:
+    """
+    A thread-safe queue of spends, stored in an SQLite database so that they survive the bot restarting.
+    """
+
+    def __init__(self, filepath: str = "spend_outbox.sqlite3"):
+        """Creates a SpendOutbox object.
+
+        Args:
+            filepath (str, optional): The database file. Defaults to "spend_outbox.sqlite3".
+        """
+        self.filepath = filepath
+        self._connection = None
+        self._lock = threading.Lock()
+        # only one flush at a time, and another straight after it if spends were added meanwhile
+        self._flushing = False
+        self._added_while_flushing = False
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self.filepath, check_same_thread=False, isolation_level=None
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # a spend is only acknowledged once it is on disk
+            self._connection.execute("PRAGMA synchronous=FULL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def add(
+        self,
+        user_id: int,
+        spreadsheet_url: str,
+        rows: list[tuple[datetime.datetime, float]],
+    ):
+        """Queues spends to be written to a spreadsheet.
+
+        Args:
+            user_id (int): The user the spends are for, to tell them if they cannot be written.
+            spreadsheet_url (str): The url of the spreadsheet.
+            rows (list[tuple[datetime.datetime, float]]): The (date, spend) rows to write, in ascending date order.
+        """
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.executemany(
+                "INSERT INTO spends (user_id, spreadsheet_url, date, spend) VALUES (?, ?, ?, ?)",
+                [
+                    (user_id, spreadsheet_url, date.isoformat(), spend)
+                    for date, spend in rows
+                ],
+            )
+        self._added_while_flushing = True
+
+    def pending(self, spreadsheet_url: str):
+        """Gets the spends queued for a spreadsheet.
+
+        Args:
+            spreadsheet_url (str): The url of the spreadsheet.
+
+        Returns:
+            list[tuple[int, datetime.datetime, float]]: (id, date, spend) of each spend, in the order they were queued.
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT id, date, spend FROM spends WHERE spreadsheet_url = ? ORDER BY id",
+                (spreadsheet_url,),
+            ).fetchall()
+        return [
+            (id, datetime.datetime.fromisoformat(date), spend)
+            for id, date, spend in rows
+        ]
+
+    def pending_spreadsheets(self):
+        """Gets the spreadsheets which have spends queued.
+
+        Returns:
+            list[tuple[str, int]]: (spreadsheet url, user id) of each spreadsheet.
+        """
+        with self._lock:
+            return self.connection.execute(
+                "SELECT spreadsheet_url, MIN(user_id) FROM spends GROUP BY spreadsheet_url"
+            ).fetchall()
+
+    def remove(self, ids: list[int]):
+        """Removes spends from the queue, e.g., once they have been written.
+
+        Args:
+            ids (list[int]): The ids of the spends (see SpendOutbox.pending).
+        """
+        with self._lock:
+            self.connection.executemany(
+                "DELETE FROM spends WHERE id = ?", [(id,) for id in ids]
+            )
+
+    def record_failure(self, ids: list[int]):
+        """Counts a failed attempt to write spends.
+
+        Args:
+            ids (list[int]): The ids of the spends.
+
+        Returns:
+            bool: True if the spends have been tried MAX_ATTEMPTS times, and should be given up on.
+        """
+        if len(ids) == 0:
+            return False
+        with self._lock:
+            self.connection.executemany(
+                "UPDATE spends SET attempts = attempts + 1 WHERE id = ?",
+                [(id,) for id in ids],
+            )
+            (attempts,) = self.connection.execute(
+                f"SELECT MAX(attempts) FROM spends WHERE id IN ({','.join('?' * len(ids))})",
+                ids,
+            ).fetchone()
+        return attempts is not None and attempts >= MAX_ATTEMPTS
+
+    def begin_flush(self):
+        """Marks a flush as started (see flush_outbox), unless one is running already.
+
+        Returns:
+            bool: True if the flush should go ahead, False if another one is running
+                (which will go round again for any spends added meanwhile).
+        """
+        if self._flushing:
+            return False
+        self._flushing = True
+        self._added_while_flushing = False
+        return True
+
+    def flush_again(self):
+        """Checks whether spends have been added since the flush started (or last went round),
+        so it should go round again.
+
+        Returns:
+            bool: True if spends have been added.
+        """
+        added, self._added_while_flushing = self._added_while_flushing, False
+        return added
+
+    def end_flush(self):
+        """Marks the flush as finished (see begin_flush)."""
+        self._flushing = False
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM spends").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+async def find_written(spreadsheet, spends: list[tuple[int, datetime.datetime, float]]):
+    """Finds which spends dated on or before the last date in a spreadsheet are in it already
+    (e.g., the bot stopped after writing them, but before removing them from the queue).
+    The others cannot be added any more (e.g., a later day was added by hand meanwhile).
+
+    Args:
+        spreadsheet (AsyncSpreadsheet): The spreadsheet.
+        spends (list[tuple[int, datetime.datetime, float]]): (id, date, spend) of each spend.
+
+    Raises:
+        ValueError: If the spreadsheet is not formatted correctly.
+
+    Returns:
+        list[tuple[int, datetime.datetime, float]]: The spends which are in the spreadsheet.
+        list[tuple[int, datetime.datetime, float]]: The spends which are not.
+    """
+    # read it again, as the cached data may be from before the spends were written
+    dframe = await spreadsheet.sync()
+    spends_by_date = {
+        date.to_pydatetime(): spend
+        for date, spend in zip(dframe["Date"], dframe["Spend"])
+    }
+    written, not_written = [], []
+    for id, date, spend in spends:
+        in_sheet = spends_by_date.get(date)
+        if in_sheet is not None and math.isclose(in_sheet, spend, abs_tol=0.005):
+            written.append((id, date, spend))
+        else:
+            not_written.append((id, date, spend))
+    return written, not_written
+
+
+async def tell_not_saved(
+    context: ContextTypes.DEFAULT_TYPE,
+    user_id: int,
+    spends: list[tuple[int, datetime.datetime, float]],
+    why_not: str,
+):
+    """Tells a user that some of their spends could not be written to their spreadsheet.
+
+    Args:
+        context: the context passed by the job queue
+        user_id (int): The user.
+        spends (list[tuple[int, datetime.datetime, float]]): (id, date, spend) of each spend.
+        why_not (str): Why they could not be written.
+    """
+    dates = ", ".join(date.strftime("%d/%m/%Y") for _, date, _ in spends)
+    await context.bot.send_message(
+        chat_id=user_id, text=SPENDS_NOT_SAVED_MESSAGE.format(dates, why_not)
+    )
+
+
+async def flush_spreadsheet(
+    context: ContextTypes.DEFAULT_TYPE, spreadsheet_url: str, user_id: int
+):
+    """Writes the spends queued for one spreadsheet, in one batch.
+    Spends which are already in the spreadsheet (see find_written) are not written again.
+    If the spreadsheet has a later day than a spend, the spend can no longer be added, so the user is told.
+
+    Args:
+        context: the context passed by the job queue
+        spreadsheet_url (str): The url of the spreadsheet.
+        user_id (int): The user the spreadsheet belongs to.
+    """
+    outbox: SpendOutbox = context.bot_data["spend_outbox"]
+    pending = outbox.pending(spreadsheet_url)
+    spreadsheet = open_spreadsheet(context.bot_data, spreadsheet_url)
+    try:
+        # read again, not from the cache, as the spreadsheet may have been edited by hand since it was cached.
+        #  the spends are then appended after this tail (see Spreadsheet.add_data_batch)
+        last_date, _ = await spreadsheet.get_tail(fresh=True)
+        earlier = [
+            spend
+            for spend in pending
+            if last_date is not None and spend[1] <= last_date
+        ]
+        if len(earlier) > 0:
+            written, not_written = await find_written(spreadsheet, earlier)
+        why_not = None
+    except Exception as error:
+        why_not = str(error)
+    if why_not is None:
+        if len(earlier) > 0:
+            outbox.remove([id for id, _, _ in written + not_written])
+            if len(not_written) > 0:
+                await tell_not_saved(
+                    context, user_id, not_written, ALREADY_HAS_LATER_DATA_MESSAGE
+                )
+            pending = [spend for spend in pending if spend not in earlier]
+        if len(pending) == 0:
+            return
+        rows = sorted((date, spend) for _, date, spend in pending)
+        data_added, why_not = await spreadsheet.add_data_batch(rows)
+        if data_added:
+            outbox.remove([id for id, _, _ in pending])
+            return
+    logger.warning("Could not write queued spends to %s: %s", spreadsheet_url, why_not)
+    ids = [id for id, _, _ in pending]
+    if outbox.record_failure(ids):
+        outbox.remove(ids)
+        await tell_not_saved(context, user_id, pending, why_not)
+
+
+@traced_job
+async def flush_outbox(context: ContextTypes.DEFAULT_TYPE):
+    """Writes all queued spends to their spreadsheets. Runs as a job, both regularly and whenever spends are queued.
+
+    Args:
+        context: the context passed by the job queue
+    """
+    outbox: SpendOutbox = context.bot_data["spend_outbox"]
+    if not outbox.begin_flush():
+        # the flush that is running will go round again
+        return
+    try:
+        while True:
+            spreadsheets = outbox.pending_spreadsheets()
+            results = await asyncio.gather(
+                *(
+                    flush_spreadsheet(context, spreadsheet_url, user_id)
+                    for spreadsheet_url, user_id in spreadsheets
+                ),
+                return_exceptions=True,
+            )
+            for (spreadsheet_url, _), result in zip(spreadsheets, results):
+                if isinstance(result, Exception):
+                    logger.error(
+                        "Error writing queued spends to %s",
+                        spreadsheet_url,
+                        exc_info=result,
+                    )
+            if not outbox.flush_again():
+                break
+    finally:
+        outbox.end_flush()
@@ -0,0 +1,210 @@
+"""
+Stores the bot's data (e.g., each user's spreadsheet URL) in an SQLite database.
+
+Unlike PicklePersistence, which writes every user's data to one file whenever anything changes,
+each user has their own row, and only users whose data has changed are written.
+"""
+import os
+import pickle
+import sqlite3
+import logging
+import threading
+from telegram.ext import BasePersistence, PersistenceInput, PicklePersistence
+
+logger = logging.getLogger(__name__)
+
+# user_data keys which only matter during a conversation, so are not worth saving
+DEFAULT_TRANSIENT_KEYS = ("date", "new_reminder_time")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS callback_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL, key BLOB NOT NULL, state BLOB NOT NULL, PRIMARY KEY (name, key)
+);
+CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    A persistence class (see telegram.ext.BasePersistence) which stores data in an SQLite database in WAL mode.
+    """
+
+    def __init__(
+        self,
+        filepath: str = "bot_data.sqlite3",
+        store_data: PersistenceInput = None,
+        update_interval: float = 60,
+        migrate_from: str = None,
+        transient_keys: tuple = DEFAULT_TRANSIENT_KEYS,
+    ):
+        """Creates an SQLitePersistence object.
+
+        Args:
+            filepath (str, optional): The database file. Defaults to "bot_data.sqlite3".
+            store_data (PersistenceInput, optional): Which kinds of data to store. Defaults to all.
+            update_interval (float, optional): How often the application saves data (seconds). Defaults to 60.
+            migrate_from (str, optional): A PicklePersistence file (single file) to copy data from,
+                the first time the database is used. Defaults to None.
+            transient_keys (tuple, optional): user_data keys not to save.
+        """
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.filepath = filepath
+        self.migrate_from = migrate_from
+        self.transient_keys = transient_keys
+        self._connection = None
+        self._lock = threading.Lock()
+        # what was last written for each row, so that unchanged rows are not written again
+        self._written = {}
+        self._migration_checked = False
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self.filepath, check_same_thread=False, isolation_level=None
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # in WAL mode, this is still safe if the bot crashes (but not if the machine does)
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    async def _migrate(self):
+        """Copies data from the old pickle file, if there is one and it has not been copied before."""
+        if self._migration_checked:
+            return
+        self._migration_checked = True
+        if self.migrate_from is None or not os.path.exists(self.migrate_from):
+            return
+        with self._lock:
+            migrated = self.connection.execute(
+                "SELECT value FROM metadata WHERE key = 'migrated_from'"
+            ).fetchone()
+        if migrated is not None:
+            return
+        logger.info("Migrating persistent data from %s", self.migrate_from)
+        old_persistence = PicklePersistence(filepath=self.migrate_from)
+        user_data = await old_persistence.get_user_data()
+        chat_data = await old_persistence.get_chat_data()
+        conversations = old_persistence.conversations or {}
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN")
+            for table, rows in [("user_data", user_data), ("chat_data", chat_data)]:
+                for id, row in (rows or {}).items():
+                    self.connection.execute(
+                        f"INSERT OR REPLACE INTO {table} (id, data) VALUES (?, ?)",
+                        (id, self._dumps(table, row)),
+                    )
+            for name, states in conversations.items():
+                for key, state in states.items():
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                        (name, pickle.dumps(key), pickle.dumps(state)),
+                    )
+            self.connection.execute(
+                "INSERT INTO metadata (key, value) VALUES ('migrated_from', ?)",
+                (self.migrate_from,),
+            )
+
+    def _dumps(self, table: str, data):
+        if table == "user_data":
+            data = {
+                key: value
+                for key, value in data.items()
+                if key not in self.transient_keys
+            }
+        return pickle.dumps(data)
+
+    def _get_rows(self, table: str):
+        with self._lock:
+            rows = self.connection.execute(f"SELECT id, data FROM {table}").fetchall()
+        for id, blob in rows:
+            self._written[(table, id)] = blob
+        return {id: pickle.loads(blob) for id, blob in rows}
+
+    def _update_row(self, table: str, id: int, data):
+        blob = self._dumps(table, data)
+        if self._written.get((table, id)) == blob:
+            return
+        with self._lock:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO {table} (id, data) VALUES (?, ?)", (id, blob)
+            )
+        self._written[(table, id)] = blob
+
+    def _drop_row(self, table: str, id: int):
+        with self._lock:
+            self.connection.execute(f"DELETE FROM {table} WHERE id = ?", (id,))
+        self._written.pop((table, id), None)
+
+    async def get_user_data(self):
+        await self._migrate()
+        return self._get_rows("user_data")
+
+    async def get_chat_data(self):
+        await self._migrate()
+        return self._get_rows("chat_data")
+
+    async def get_bot_data(self):
+        return self._get_rows("bot_data").get(0, {})
+
+    async def get_callback_data(self):
+        return self._get_rows("callback_data").get(0)
+
+    async def get_conversations(self, name: str):
+        await self._migrate()
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT key, state FROM conversations WHERE name = ?", (name,)
+            ).fetchall()
+        return {pickle.loads(key): pickle.loads(state) for key, state in rows}
+
+    async def update_user_data(self, user_id: int, data: dict):
+        self._update_row("user_data", user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        self._update_row("chat_data", chat_id, data)
+
+    async def update_bot_data(self, data):
+        self._update_row("bot_data", 0, data)
+
+    async def update_callback_data(self, data):
+        self._update_row("callback_data", 0, data)
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object):
+        with self._lock:
+            if new_state is None:
+                self.connection.execute(
+                    "DELETE FROM conversations WHERE name = ? AND key = ?",
+                    (name, pickle.dumps(key)),
+                )
+            else:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                    (name, pickle.dumps(key), pickle.dumps(new_state)),
+                )
+
+    async def drop_user_data(self, user_id: int):
+        self._drop_row("user_data", user_id)
+
+    async def drop_chat_data(self, chat_id: int):
+        self._drop_row("chat_data", chat_id)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,330 @@
+"""
+Keeps the bot's Google Sheets requests under its quota.
+
+Every user's spreadsheet is read and written with the same service account, so they all share
+one quota of requests per minute (separately for reads and writes). Instead of failing with
+"429: Quota exceeded" during busy periods, requests wait their turn here, and when Google Sheets
+does push back (429 or 5xx), every request backs off together, exponentially and with jitter.
+
+Requests made on the spreadsheet threads for the event loop (see QuotaManager.run_deferring)
+do not wait on their thread: they hand the wait back to the event loop, so that a few requests
+waiting for quota do not take up every thread, and hold up users whose data is cached.
+"""
+import time
+import random
+import asyncio
+import logging
+import threading
+import itertools
+import contextvars
+import collections
+from gspread.exceptions import APIError
+from .ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+READ = "read"
+WRITE = "write"
+
+# Google Sheets allows 60 reads and 60 writes per minute per user (the service account).
+#  the rate plus the burst must stay under that over any minute
+DEFAULT_READS_PER_MINUTE = 50
+DEFAULT_WRITES_PER_MINUTE = 50
+DEFAULT_BURST = 10
+# responses worth retrying after backing off
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 64.0
+# the longest a request waits for quota before giving up (seconds)
+DEFAULT_TIMEOUT = 120.0
+# how many times a call is handed back to the event loop to wait for quota, before it waits on its thread
+MAX_DEFERRALS = 5
+
+# the quota reserved for the call running on this thread (see QuotaManager.run_deferring)
+_reservation = contextvars.ContextVar("quota_reservation", default=None)
+
+
+class QuotaTimeout(Exception):
+    """Raised when a request has waited too long for quota."""
+
+
+class QuotaDeferred(Exception):
+    """Raised on a spreadsheet thread when a request has to wait for quota, so that the call
+    is run again once the event loop has waited for it (see QuotaManager.run_deferring).
+    """
+
+    def __init__(self, kind: str, tokens: float):
+        super().__init__(f"Waiting for {tokens} {kind} quota")
+        self.kind = kind
+        self.tokens = tokens
+
+
+class Reservation:
+    """
+    Quota taken on the event loop for a call, for its requests to use on its thread.
+    """
+
+    def __init__(self):
+        self.tokens = {READ: 0.0, WRITE: 0.0}
+        # the call can only be run again if it has not written anything yet
+        self.deferrable = True
+
+    def take(self, kind: str, tokens: float):
+        if self.tokens[kind] < tokens:
+            return False
+        self.tokens[kind] -= tokens
+        return True
+
+
+class QuotaManager:
+    """
+    A thread-safe gate for Google Sheets requests, with a token bucket for reads and one for writes.
+
+    Reads and writes wait in separate queues, in order of arrival, so neither holds up the other.
+    Requests which fail with a status in RETRY_STATUS_CODES pause both (the quota is shared)
+    for an exponentially growing, jittered time, then are retried.
+    """
+
+    def __init__(
+        self,
+        reads_per_minute: float = DEFAULT_READS_PER_MINUTE,
+        writes_per_minute: float = DEFAULT_WRITES_PER_MINUTE,
+        burst: float = DEFAULT_BURST,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_backoff: float = DEFAULT_BASE_BACKOFF,
+        max_backoff: float = DEFAULT_MAX_BACKOFF,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        """Creates a QuotaManager object.
+
+        Args:
+            reads_per_minute (float, optional): The average number of reads allowed per minute.
+            writes_per_minute (float, optional): The average number of writes allowed per minute.
+            burst (float, optional): How many requests of each kind can be made at once after a quiet period.
+            max_retries (int, optional): How many times to retry a request that fails with 429 or 5xx.
+            base_backoff (float, optional): How long to back off after the first failure (seconds).
+            max_backoff (float, optional): The longest to back off for (seconds).
+            timeout (float, optional): The longest a request waits for quota (seconds).
+        """
+        self._buckets = {
+            READ: TokenBucket(reads_per_minute / 60, burst),
+            WRITE: TokenBucket(writes_per_minute / 60, burst),
+        }
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        # the order of every waiting request, by kind
+        self._waiting = {kind: collections.deque() for kind in self._buckets}
+        self._order = itertools.count()
+        # no requests are made until then (time.monotonic)
+        self._paused_until = 0.0
+        # how many requests have failed in a row
+        self._failures = 0
+
+    def _try_take(self, kind: str, tokens: float, entry: int = None):
+        """Takes quota if the request is first in its queue (or the queue is empty, if `entry` is None)
+        and there is quota for it. Call with the condition held.
+
+        Returns:
+            float | None: 0 if the quota was taken, how long to wait before trying again (seconds),
+                or None if other requests are first.
+        """
+        waiting = self._waiting[kind]
+        if len(waiting) > 0 and waiting[0] != entry:
+            return None
+        wait = self._paused_until - time.monotonic()
+        if wait > 0:
+            return wait
+        return self._buckets[kind].try_acquire(tokens)
+
+    def acquire(self, kind: str = READ, tokens: float = 1):
+        """Waits until a request can be made. Requests of each kind are let through in order of arrival.
+
+        Within a call started by run_deferring, the call's reservation is used if it has enough quota.
+        Otherwise, if there is no quota now, QuotaDeferred is raised, to wait on the event loop instead.
+
+        Args:
+            kind (str, optional): READ or WRITE. Defaults to READ.
+            tokens (float, optional): How many requests it counts as. Defaults to 1.
+
+        Raises:
+            QuotaTimeout: If the request has waited for longer than `timeout`.
+            QuotaDeferred: If the request is part of a call which should wait on the event loop.
+        """
+        reservation = _reservation.get()
+        if reservation is not None:
+            if reservation.take(kind, tokens):
+                return
+            if reservation.deferrable:
+                with self._condition:
+                    if self._try_take(kind, tokens) == 0:
+                        return
+                raise QuotaDeferred(kind, tokens)
+        entry = next(self._order)
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            self._waiting[kind].append(entry)
+            try:
+                while True:
+                    wait = self._try_take(kind, tokens, entry)
+                    if wait == 0:
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise QuotaTimeout(
+                            f"Waited more than {self.timeout:.0f}s for Google Sheets quota"
+                        )
+                    # requests behind the first one wait until it has gone
+                    self._condition.wait(
+                        remaining if wait is None else min(wait, remaining)
+                    )
+            finally:
+                self._waiting[kind].remove(entry)
+                self._condition.notify_all()
+
+    async def acquire_async(self, kind: str = READ, tokens: float = 1):
+        """Waits, without blocking the event loop, until a request can be made (see acquire).
+
+        Args:
+            kind (str, optional): READ or WRITE. Defaults to READ.
+            tokens (float, optional): How many requests it counts as. Defaults to 1.
+
+        Raises:
+            QuotaTimeout: If the request has waited for longer than `timeout`.
+        """
+        bucket = self._buckets[kind]
+        entry = next(self._order)
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            self._waiting[kind].append(entry)
+        try:
+            while True:
+                with self._condition:
+                    wait = self._try_take(kind, tokens, entry)
+                if wait == 0:
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise QuotaTimeout(
+                        f"Waited more than {self.timeout:.0f}s for Google Sheets quota"
+                    )
+                if wait is None:
+                    # roughly until the requests ahead have had their turn
+                    wait = tokens / bucket.rate
+                await asyncio.sleep(min(wait, remaining))
+        finally:
+            with self._condition:
+                self._waiting[kind].remove(entry)
+                self._condition.notify_all()
+
+    async def run_deferring(self, run):
+        """Runs a call which makes Google Sheets requests on another thread (e.g., a Spreadsheet method
+        on the spreadsheet thread pool), waiting for quota on the event loop instead of on the thread.
+
+        When a request in the call has to wait for quota, the call stops (with QuotaDeferred)
+        before making it, the quota is waited for here, and the call is run again,
+        using that quota. Calls which have written to Google Sheets are not run again,
+        so their later requests wait on their thread.
+
+        Args:
+            run (Callable[[], Awaitable[T]]): Starts the call on the other thread.
+                It must run in a copy of the current context (see tracing.run_in_context).
+
+        Returns:
+            T: The result of the call.
+        """
+        reservation = Reservation()
+        token = _reservation.set(reservation)
+        try:
+            for deferrals in itertools.count():
+                reservation.deferrable = deferrals < MAX_DEFERRALS
+                try:
+                    return await run()
+                except QuotaDeferred as deferred:
+                    await self.acquire_async(deferred.kind, deferred.tokens)
+                    reservation.tokens[deferred.kind] += deferred.tokens
+        finally:
+            _reservation.reset(token)
+            # give back what the call did not use, e.g., if its data was cached by the time it ran again
+            with self._condition:
+                for kind, tokens in reservation.tokens.items():
+                    self._buckets[kind].give_back(tokens)
+                self._condition.notify_all()
+
+    def call(self, operation, kind: str = READ, tokens: float = 1):
+        """Makes a request when there is quota for it, retrying if Google Sheets pushes back.
+
+        Args:
+            operation (Callable[[], T]): The request.
+            kind (str, optional): READ or WRITE. Defaults to READ.
+            tokens (float, optional): How many requests it counts as. Defaults to 1.
+
+        Raises:
+            QuotaTimeout: If the request has waited for longer than `timeout`.
+            gspread.exceptions.APIError: If the request fails for another reason, or too many times.
+
+        Returns:
+            T: The result of the request.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(kind, tokens)
+            try:
+                result = operation()
+            except APIError as error:
+                if (
+                    error.response.status_code not in RETRY_STATUS_CODES
+                    or attempt == self.max_retries
+                ):
+                    raise
+                self._back_off(error)
+                continue
+            with self._condition:
+                self._failures = 0
+            if kind == WRITE:
+                reservation = _reservation.get()
+                if reservation is not None:
+                    # running the call again would write again
+                    reservation.deferrable = False
+            return result
+
+    def _back_off(self, error: APIError):
+        with self._condition:
+            self._failures += 1
+            delay = min(self.max_backoff, self.base_backoff * 2 ** (self._failures - 1))
+            # jitter, so that requests that failed together are not retried together
+            delay *= 0.5 + random.random()
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._condition.notify_all()
+        logger.warning(
+            "Google Sheets returned %s, backing off for %.1fs",
+            error.response.status_code,
+            delay,
+        )
+
+    def per_minute(self, kind: str = READ):
+        """Gets how many requests of a kind are allowed per minute, on average.
+
+        Args:
+            kind (str, optional): READ or WRITE. Defaults to READ.
+
+        Returns:
+            float: The number of requests.
+        """
+        return self._buckets[kind].rate * 60
+
+    def pressure(self):
+        """Gets how close the bot is to its quota, e.g., to put off work that can wait.
+
+        Returns:
+            float: From 0 (no recent requests) to 1 (requests are waiting, or backing off).
+        """
+        with self._condition:
+            if any(self._waiting.values()) or time.monotonic() < self._paused_until:
+                return 1.0
+            return max(
+                1 - bucket.available() / bucket.capacity
+                for bucket in self._buckets.values()
+            )
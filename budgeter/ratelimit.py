@@ -0,0 +1,96 @@
+"""
+A token bucket, to keep the bot under the rate limits of the APIs it calls
+(e.g., Telegram's limit of about 30 messages per second, and Google Sheets' quotas, see quota.py).
+"""
+import time
+import asyncio
+
+
+class TokenBucket:
+    """
+    Allows `rate` calls per second on average, with bursts of up to `capacity` calls.
+
+    Not thread-safe: use it from one event loop, or hold a lock around it (as QuotaManager does).
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        """Creates a TokenBucket object. The bucket starts full.
+
+        Args:
+            rate (float): How many tokens are added per second.
+            capacity (float, optional): The most tokens the bucket can hold. Defaults to `rate` (one second's worth).
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        # no tokens are handed out until then, e.g., after being told to retry later
+        self._paused_until = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    def try_acquire(self, tokens: float = 1):
+        """Takes tokens if there are enough, without waiting.
+
+        Args:
+            tokens (float, optional): How many tokens to take. Defaults to 1.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise how long to wait before trying again (seconds).
+        """
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill(now)
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1):
+        """Waits until there are enough tokens, then takes them.
+
+        Args:
+            tokens (float, optional): How many tokens to take. Defaults to 1.
+        """
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    def give_back(self, tokens: float):
+        """Returns tokens which were taken but not used (up to the capacity).
+
+        Args:
+            tokens (float): How many tokens to return.
+        """
+        self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def pause(self, seconds: float):
+        """Stops handing out tokens for a while, e.g., when the API says to retry later.
+        The bucket is empty afterwards, so calls resume gradually.
+
+        Args:
+            seconds (float): How long to pause for.
+        """
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0.0
+        self._updated_at = self._paused_until
+
+    def available(self):
+        """Gets how many tokens there are now.
+
+        Returns:
+            float: The number of tokens (0 while paused).
+        """
+        now = time.monotonic()
+        if now < self._paused_until:
+            return 0.0
+        self._refill(now)
+        return self._tokens
@@ -1,11 +1,48 @@
 """
 Functions for:
-- enabling/disabling daily reminders to log spending.
-- sending the daily reminder.
+- scheduling the daily reminders to log spending.
+- sending the daily reminders.
+
+Each user picks a time and timezone for their reminder. Users are grouped by the minute (in UTC)
+their reminder is due, and there is one job per minute that has any users (see ReminderSchedule),
+instead of one job per user. Each job sends its users' reminders spread out over a window,
+and all of them share one limit to stay under Telegram's rate limit.
+
+Whether a user gets reminders is stored in their user_data ("reminders"),
+along with their "reminder_time" ("HH:MM", their local time) and "timezone" (e.g., "Europe/London").
+Users who have already logged yesterday's spending ("last_logged_date", see record_last_logged_date)
+are not reminded.
 """
+import re
+import math
+import time
 import random
+import asyncio
+import logging
 import datetime
+import zoneinfo
+from telegram import Bot
+from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError
 from telegram.ext import ContextTypes, JobQueue
+from .ratelimit import TokenBucket
+from .spreadsheet import open_spreadsheet
+from .metrics import REMINDER_FANOUT_SECONDS, REMINDERS
+from .tracing import traced_job
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REMINDER_TIME = "09:00"
+DEFAULT_TIMEZONE = "UTC"
+# how long after each reminder time the reminders are spread over (seconds)
+DEFAULT_REMINDER_WINDOW = 10 * 60
+# Telegram allows about 30 messages per second in total, so this leaves room for replies to users
+DEFAULT_MESSAGES_PER_SECOND = 20
+# how many reminders can be waiting for a response from Telegram at once
+SENDERS = 8
+# how many times to try sending a reminder before giving up on it
+MAX_ATTEMPTS = 5
+# a user is not reminded twice within this long, e.g., when the clocks change (seconds)
+MIN_TIME_BETWEEN_REMINDERS = 12 * 60 * 60
 
 greetings = [
     "Sup",
@@ -22,81 +59,424 @@ greetings = [
 ]
 
 
-def jobname(user: int) -> str:
-    """Turns a user id into a unique job name for the reminder job.
-    Then, when we want to cancel the job, we can just use the job name.
+def parse_time(text: str):
+    """Reads a time of day, e.g., "9", "9am", "21:30", or "9:30pm".
 
     Args:
-        user (int): user id
+        text (str): the time
 
     Returns:
-        str: job name
+        str | None: the time as "HH:MM", or None if it is not a time
     """
-    return f"reminder-{user}"
+    match = re.fullmatch(r"(\d{1,2})(?:[:.](\d{2}))?\s*(am|pm)?", text.strip().lower())
+    if match is None:
+        return None
+    hour, minute, half = int(match[1]), int(match[2] or 0), match[3]
+    if half is not None:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if half == "pm" else 0)
+    if hour > 23 or minute > 59:
+        return None
+    return f"{hour:02}:{minute:02}"
 
 
-def queue_reminder(job_queue: JobQueue, user: int, run_now: bool = False):
-    """Queues a daily reminder for a user.
+def is_timezone(name: str):
+    """Checks if a timezone name (e.g., "Europe/London") is known.
 
     Args:
-        job_queue (JobQueue): the job queue (usually context.job_queue)
-        user (int): user id
-        run_now (bool, optional): whether to run the reminder immediately. Defaults to False.
+        name (str): the timezone name
 
     Returns:
-        str: "success" if successful, "already_in_queue" if already in queue
+        bool: True if it is a timezone
     """
-    already_a_job = job_queue.get_jobs_by_name(jobname(user))
-    if already_a_job:
-        return "already_in_queue"
-    job_queue.run_daily(
-        remind,
-        time=datetime.time(hour=9, minute=0),
-        chat_id=user,
-        name=jobname(user),
-    )
-    return "success"
+    try:
+        zoneinfo.ZoneInfo(name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
 
 
-def cancel_reminder(job_queue: JobQueue, user: int):
-    """Cancels a daily reminder for a user.
+def record_last_logged_date(user_data: dict, date: datetime.datetime):
+    """Remembers the last day a user has logged spending for, so they are not reminded to log it.
+    Call this whenever their spreadsheet is read or written.
 
     Args:
-        job_queue (JobQueue): the job queue (usually context.job_queue)
-        user (int): user id
+        user_data (dict): the user's user_data
+        date (datetime.datetime | None): the last day with spending data, or None if there is none
+    """
+    if date is None:
+        user_data.pop("last_logged_date", None)
+        return
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    user_data["last_logged_date"] = date
+
+
+def is_up_to_date(user_data: dict, timezone: str = DEFAULT_TIMEZONE):
+    """Checks if a user has logged yesterday's spending, as far as the bot knows
+    (see record_last_logged_date). They may have logged it in the spreadsheet without the bot knowing.
+
+    Args:
+        user_data (dict): the user's user_data
+        timezone (str, optional): the user's timezone, which decides when yesterday was. Defaults to "UTC".
 
     Returns:
-        str: "success" if successful
+        bool: True if yesterday has been logged
     """
-    jobs = job_queue.get_jobs_by_name(jobname(user))
-    if not jobs:
-        return "not_in_queue"
-    for job in jobs:
-        job.schedule_removal()
-    return "success"
+    last_logged_date = user_data.get("last_logged_date")
+    if last_logged_date is None:
+        return False
+    today = datetime.datetime.now(zoneinfo.ZoneInfo(timezone)).date()
+    return last_logged_date >= today - datetime.timedelta(days=1)
 
 
-async def remind(context: ContextTypes.DEFAULT_TYPE):
-    """Sends a daily reminder to log spending.
+async def check_up_to_date(bot_data: dict, user_data: dict):
+    """Checks if a user has logged yesterday's spending, looking at the end of their spreadsheet
+    (see Spreadsheet.get_last_date, which only reads Google Sheets if the bot's own copies are out of date).
+    Their "last_logged_date" is updated.
 
     Args:
-        context: the context passed by the job queue
+        bot_data (dict): the application's bot_data
+        user_data (dict): the user's user_data
 
-    Raises:
-        ValueError: if the user id is not set in the context
+    Returns:
+        bool: True if yesterday has been logged
     """
-    try:
-        user = context.job.chat_id
-    except KeyError as error:
-        raise ValueError("user not set in reminder") from error
+    timezone = user_data.get("timezone", DEFAULT_TIMEZONE)
+    if is_up_to_date(user_data, timezone):
+        return True
+    if "spreadsheet_url" not in user_data:
+        return False
+    spreadsheet = open_spreadsheet(bot_data, user_data["spreadsheet_url"])
+    last_date = await spreadsheet.get_last_date()
+    record_last_logged_date(user_data, last_date)
+    return is_up_to_date(user_data, timezone)
+
+
+async def save_user_data(application, users: list[int]):
+    """Saves users' user_data to persistence now. The application only saves the data of users who
+    sent the update or own the job being handled, so this is needed for changes made for other users, e.g., in a job.
+
+    Args:
+        application (telegram.ext.Application): the application
+        users (list[int]): user ids
+    """
+    persistence = application.persistence
+    if persistence is None or not persistence.store_data.user_data:
+        return
+    for user in users:
+        await persistence.update_user_data(user, application.user_data[user])
+
+
+def utc_bucket(reminder_time: str, timezone: str, date: datetime.date):
+    """Gets the time in UTC of a user's reminder on a given day.
+    This changes when the user's clocks change, so it depends on the date.
+
+    Args:
+        reminder_time (str): the local time ("HH:MM")
+        timezone (str): the timezone name (e.g., "Europe/London")
+        date (datetime.date): the local date
+
+    Returns:
+        str: the time in UTC ("HH:MM")
+    """
+    local = datetime.datetime.combine(
+        date,
+        datetime.time.fromisoformat(reminder_time),
+        tzinfo=zoneinfo.ZoneInfo(timezone),
+    )
+    return local.astimezone(datetime.timezone.utc).strftime("%H:%M")
+
+
+class ReminderSchedule:
+    """
+    An index from minutes of the day (in UTC) to the users whose reminders are due then,
+    with one daily job for each minute that has users.
+    """
+
+    def __init__(
+        self,
+        job_queue: JobQueue,
+        window: float = DEFAULT_REMINDER_WINDOW,
+        messages_per_second: float = DEFAULT_MESSAGES_PER_SECOND,
+    ):
+        """Creates a ReminderSchedule object.
+
+        Args:
+            job_queue (JobQueue): the job queue (usually application.job_queue)
+            window (float, optional): how long to spread each minute's reminders over (seconds).
+            messages_per_second (float, optional): the most reminders to send per second, over all minutes.
+        """
+        self.job_queue = job_queue
+        self.window = window
+        self.bucket = TokenBucket(messages_per_second)
+        # "HH:MM" (UTC) -> set of user ids
+        self._users_by_bucket = {}
+        # user id -> (bucket, reminder time, timezone)
+        self._users = {}
+        # user id -> when they were last reminded (time.monotonic)
+        self._reminded_at = {}
+
+    def __len__(self):
+        return len(self._users)
+
+    @property
+    def buckets(self):
+        return sorted(self._users_by_bucket)
+
+    def users_at(self, bucket: str):
+        """Gets the users whose reminders are due at a time.
+
+        Args:
+            bucket (str): the time in UTC ("HH:MM")
 
+        Returns:
+            set[int]: user ids
+        """
+        return set(self._users_by_bucket.get(bucket, ()))
+
+    def add(
+        self,
+        user: int,
+        reminder_time: str = DEFAULT_REMINDER_TIME,
+        timezone: str = DEFAULT_TIMEZONE,
+        date: datetime.date = None,
+    ):
+        """Adds a user's daily reminder, or moves it if they already have one.
+
+        Args:
+            user (int): user id
+            reminder_time (str, optional): the local time ("HH:MM"). Defaults to "09:00".
+            timezone (str, optional): the timezone name. Defaults to "UTC".
+            date (datetime.date, optional): the date of the next reminder, which matters when
+                the clocks change. Defaults to today in the user's timezone.
+        """
+        if date is None:
+            date = datetime.datetime.now(zoneinfo.ZoneInfo(timezone)).date()
+        bucket = utc_bucket(reminder_time, timezone, date)
+        if self._users.get(user, (None,))[0] == bucket:
+            self._users[user] = (bucket, reminder_time, timezone)
+            return
+        self.remove(user)
+        self._users[user] = (bucket, reminder_time, timezone)
+        users = self._users_by_bucket.setdefault(bucket, set())
+        if not users:
+            self.job_queue.run_daily(
+                self.remind_bucket,
+                time=datetime.time.fromisoformat(bucket).replace(
+                    tzinfo=datetime.timezone.utc
+                ),
+                name=jobname(bucket),
+                data=bucket,
+            )
+        users.add(user)
+
+    def remove(self, user: int):
+        """Removes a user's daily reminder. Does nothing if they do not have one.
+
+        Args:
+            user (int): user id
+        """
+        if user not in self._users:
+            return
+        bucket, _, _ = self._users.pop(user)
+        users = self._users_by_bucket[bucket]
+        users.discard(user)
+        if not users:
+            del self._users_by_bucket[bucket]
+            for job in self.job_queue.get_jobs_by_name(jobname(bucket)):
+                job.schedule_removal()
+
+    def restore(self, all_user_data: dict):
+        """Adds the reminders of every user who has them turned on, e.g., after the bot restarts.
+
+        Args:
+            all_user_data (dict): user id -> user_data (usually application.user_data)
+        """
+        for user_id, user_data in all_user_data.items():
+            if "spreadsheet_url" in user_data and user_data.get("reminders", False):
+                self.add(
+                    user_id,
+                    user_data.get("reminder_time", DEFAULT_REMINDER_TIME),
+                    user_data.get("timezone", DEFAULT_TIMEZONE),
+                )
+
+    @traced_job
+    async def remind_bucket(self, context: ContextTypes.DEFAULT_TYPE):
+        """Sends the reminders due at one time. Runs as a daily job.
+
+        Args:
+            context: the context passed by the job queue
+        """
+        bucket = context.job.data
+        now = time.monotonic()
+        users = [
+            user
+            for user in self.users_at(bucket)
+            if now - self._reminded_at.get(user, -math.inf)
+            >= MIN_TIME_BETWEEN_REMINDERS
+        ]
+        # tomorrow's reminder may be at a different time in UTC if the clocks change,
+        #  so everyone is put in the right place for it before sending
+        for user in users:
+            self._reminded_at[user] = now
+            _, reminder_time, timezone = self._users[user]
+            tomorrow = datetime.datetime.now(
+                zoneinfo.ZoneInfo(timezone)
+            ).date() + datetime.timedelta(days=1)
+            self.add(user, reminder_time, timezone, tomorrow)
+        all_user_data = context.application.user_data
+        # users who the bot knows have logged yesterday are not reminded (or checked)
+        users = [
+            user
+            for user in users
+            if not is_up_to_date(all_user_data[user], self._users[user][2])
+        ]
+        changed = set()
+
+        async def needs_reminder(user: int):
+            user_data = all_user_data[user]
+            last_logged_date = user_data.get("last_logged_date")
+            try:
+                up_to_date = await check_up_to_date(context.bot_data, user_data)
+            except Exception as error:
+                # remind them anyway
+                logger.warning("Could not check spreadsheet of %s: %s", user, error)
+                return True
+            if user_data.get("last_logged_date") != last_logged_date:
+                changed.add(user)
+            return not up_to_date
+
+        with REMINDER_FANOUT_SECONDS.time():
+            results = await send_reminders(
+                context.bot,
+                users,
+                window=self.window,
+                bucket=self.bucket,
+                check=needs_reminder,
+            )
+        for result, result_users in results.items():
+            REMINDERS.inc(len(result_users), result=result)
+        # users who have blocked the bot will never get reminders again
+        for user in results["blocked"]:
+            all_user_data[user]["reminders"] = False
+            changed.add(user)
+            self.remove(user)
+        await save_user_data(context.application, sorted(changed))
+        logger.info(
+            "Sent %d reminders for %s UTC (%d up to date, %d blocked, %d failed)",
+            len(results["sent"]),
+            bucket,
+            len(results["up_to_date"]),
+            len(results["blocked"]),
+            len(results["failed"]),
+        )
+
+
+def jobname(bucket: str) -> str:
+    """Turns a reminder time into a unique job name for the job that sends reminders at that time.
+
+    Args:
+        bucket (str): the time in UTC ("HH:MM")
+
+    Returns:
+        str: job name
+    """
+    return f"reminders-{bucket}"
+
+
+def reminder_text():
     greeting = random.choice(greetings)
-    await context.bot.send_message(
-        chat_id=user,
-        text=f"""
+    return f"""
 {greeting}! How much did you spend yesterday?
 /spend
 
 (to disable these reminders, use /remind)
-""",
-    )
+"""
+
+
+async def send_reminder(bot: Bot, bucket: TokenBucket, user: int):
+    """Sends a reminder to one user, waiting for the rate limit, and retrying if Telegram says to.
+
+    Args:
+        bot (Bot): the bot
+        bucket (TokenBucket): the rate limit shared by all reminders
+        user (int): user id
+
+    Returns:
+        str: "sent", "blocked" if the user has blocked the bot, or "failed"
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        await bucket.acquire()
+        try:
+            await bot.send_message(chat_id=user, text=reminder_text())
+            return "sent"
+        except RetryAfter as error:
+            # the limit is for the whole bot, so every sender waits
+            bucket.pause(error.retry_after)
+        except Forbidden:
+            return "blocked"
+        except BadRequest as error:
+            logger.warning("Could not send reminder to %s: %s", user, error)
+            return "failed"
+        except NetworkError as error:
+            logger.info("Retrying reminder to %s after %s", user, error)
+            await asyncio.sleep(2**attempt + random.random())
+    logger.warning("Gave up sending reminder to %s", user)
+    return "failed"
+
+
+async def send_reminders(
+    bot: Bot,
+    users: list[int],
+    window: float = DEFAULT_REMINDER_WINDOW,
+    messages_per_second: float = DEFAULT_MESSAGES_PER_SECOND,
+    bucket: TokenBucket = None,
+    check=None,
+):
+    """Sends reminders to many users, spread out evenly over `window` seconds in a random order,
+    and never faster than `messages_per_second`.
+    Each user can be checked first, e.g., for whether they still need reminding, shortly before their turn,
+    so a reminder is sent as soon as its own check is done, not after everyone's.
+
+    Args:
+        bot (Bot): the bot
+        users (list[int]): user ids
+        window (float, optional): how long to spread the reminders over (seconds).
+        messages_per_second (float, optional): the most reminders to send per second.
+        bucket (TokenBucket, optional): a rate limit to share with other senders.
+            Defaults to a new one, allowing `messages_per_second`.
+        check (Callable[[int], Awaitable[bool]], optional): called with each user id before sending to them.
+            They are only reminded if it returns True. Defaults to None (everyone is reminded).
+
+    Returns:
+        dict[str, list[int]]: the users, by how sending to them went (see send_reminder),
+            or "up_to_date" if `check` returned False
+    """
+    users = list(users)
+    random.shuffle(users)
+    if bucket is None:
+        bucket = TokenBucket(messages_per_second)
+    queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    for i, user in enumerate(users):
+        queue.put_nowait((start + window * i / max(len(users), 1), user))
+    results = {"sent": [], "up_to_date": [], "blocked": [], "failed": []}
+
+    async def sender():
+        while not queue.empty():
+            due, user = queue.get_nowait()
+            try:
+                if check is not None and not await check(user):
+                    results["up_to_date"].append(user)
+                    continue
+                await asyncio.sleep(max(0, due - loop.time()))
+                results[await send_reminder(bot, bucket, user)].append(user)
+            except Exception:
+                logger.exception("Could not send reminder to %s", user)
+                results["failed"].append(user)
+
+    await asyncio.gather(*(sender() for _ in range(SENDERS)))
+    return results
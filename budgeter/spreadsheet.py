@@ -1,11 +1,31 @@
 """
 This file is used to connect to the Google Sheets API.
 """
-import re
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import time
+import asyncio
 import datetime
+import functools
+import concurrent.futures
 import gspread
 from gspread.utils import ValueRenderOption, DateTimeOption, ValueInputOption
-import pandas
+from .cache import SpreadsheetCache
+from .quota import QuotaManager, QuotaDeferred, READ, WRITE
+from .mirror import SpendingMirror, DEFAULT_SYNC_INTERVAL, MAX_SYNC_PRESSURE
+from .metrics import SHEETS_REQUESTS, SHEETS_REQUEST_SECONDS
+from .tracing import span, traced, run_in_context, CLIENT
+from .aggregates import SpendingAggregates
+
+if TYPE_CHECKING:
+    import pandas
+
+# how long a local copy of a spreadsheet can be brought up to date by reading only its new rows,
+#  before the whole spreadsheet is read again to pick up edits to older rows (seconds)
+DEFAULT_FULL_SYNC_INTERVAL = 24 * 60 * 60
+
+# how many row numbers to list for each problem with a spreadsheet's format
+MAX_ROWS_IN_MESSAGE = 10
 
 
 def verifyurl(url: str):
@@ -24,6 +44,40 @@ def verifyurl(url: str):
     return True
 
 
+def spreadsheet_id_from_url(url: str):
+    """Gets the ID of a spreadsheet from its url, to use as a key for caching.
+
+    Args:
+        url (str): The url of the spreadsheet.
+
+    Returns:
+        str: The spreadsheet ID, or the url itself if it does not contain one.
+    """
+    try:
+        return gspread.utils.extract_id_from_url(url)
+    except gspread.exceptions.NoValidUrlKeyFound:
+        return url
+
+
+@traced("spreadsheet.rows_to_dataframe")
+def rows_to_dataframe(rows: list[list]):
+    """Converts rows of a (correctly formatted) spreadsheet to a spending dataframe.
+
+    Args:
+        rows (list[list]): The rows after the header, as a 2d array. [row][column]
+
+    Returns:
+        pandas.DataFrame: The data as a dataframe. Columns: {"Date": datetime, "Spend": float}
+    """
+    import pandas
+
+    first_two_columns = [row[:2] for row in rows]
+    dframe = pandas.DataFrame(first_two_columns, columns=["Date", "Spend"])
+    dframe["Date"] = pandas.to_datetime(dframe["Date"], format="%d/%m/%Y")
+    dframe["Spend"] = pandas.to_numeric(dframe["Spend"])
+    return dframe
+
+
 def str_to_date(string: str):
     """Converts a string to a date.
 
@@ -72,109 +126,292 @@ def is_float(string: str):
     return True
 
 
+def measure_request(operation, name: str):
+    """Makes a Google Sheets request, counting and timing it (see budgeter.metrics).
+
+    Args:
+        operation (Callable[[], T]): The request.
+        name (str): What the request is, e.g., "get_values".
+
+    Returns:
+        T: The result of the request.
+    """
+    outcome = "error"
+    with SHEETS_REQUEST_SECONDS.time(operation=name), span(f"sheets.{name}", CLIENT):
+        try:
+            result = operation()
+            outcome = "ok"
+            return result
+        except gspread.exceptions.APIError as e:
+            outcome = str(e.response.status_code)
+            raise
+        finally:
+            SHEETS_REQUESTS.inc(operation=name, outcome=outcome)
+
+
 class Spreadsheet:
     """
     A class to connect to the Google Sheets API and view/edit spreadsheets.
     """
 
-    def __init__(self, spreadsheet_client: gspread.client.Client, spreadsheet_url: str):
+    def __init__(
+        self,
+        spreadsheet_client: gspread.client.Client,
+        spreadsheet_url: str,
+        cache: SpreadsheetCache = None,
+        quota: QuotaManager = None,
+        mirror: SpendingMirror = None,
+    ):
         """Creates a Spreadsheet object.
 
         Args:
             credentials (gspread.client.Client): A spreadsheet client created by gspread.service_account().
             spreadsheet_url (str): The url of the spreadsheet to connect to.
+            cache (SpreadsheetCache, optional): A cache of spending data shared between users. Defaults to None (no caching).
+            quota (QuotaManager, optional): The Google Sheets quota shared between users. Defaults to None (no limit).
+            mirror (SpendingMirror, optional): A local copy of users' data, to read instead of Google Sheets.
+                Defaults to None (no copy).
         """
         self.spreadsheet_client = spreadsheet_client
         self.spreadsheet_url = spreadsheet_url
+        self.spreadsheet_id = spreadsheet_id_from_url(spreadsheet_url)
+        self.cache = cache
+        self.quota = quota
+        self.mirror = mirror
+
+    def request(
+        self,
+        operation,
+        kind: str = READ,
+        tokens: float = 1,
+        name: str = "request",
+    ):
+        """Makes a Google Sheets request, within the quota if there is one (see QuotaManager.call).
+
+        Args:
+            operation (Callable[[], T]): The request.
+            kind (str, optional): READ or WRITE. Defaults to READ.
+            tokens (float, optional): How many requests it makes. Defaults to 1.
+            name (str, optional): What the request is, for the metrics. Defaults to "request".
+
+        Returns:
+            T: The result of the request.
+        """
+        operation = functools.partial(measure_request, operation, name)
+        if self.quota is None:
+            return operation()
+        return self.quota.call(operation, kind, tokens)
+
+    def open_sheet1(self):
+        """Opens the first sheet of the spreadsheet, or uses the one opened last time.
+        Opening a sheet costs a request to Google Sheets on top of reading or writing it.
+
+        Returns:
+            gspread.worksheet.Worksheet: The first sheet.
+        """
+        if self.cache is not None:
+            worksheet = self.cache.get_worksheet(self.spreadsheet_id)
+            if worksheet is not None:
+                return worksheet
+        # opening the spreadsheet and finding its first sheet are a request each
+        worksheet = self.request(
+            lambda: self.spreadsheet_client.open_by_url(self.spreadsheet_url).sheet1,
+            READ,
+            tokens=2,
+            name="open",
+        )
+        if self.cache is not None:
+            self.cache.set_worksheet(self.spreadsheet_id, worksheet)
+        return worksheet
+
+    def with_sheet1(self, operation, kind: str = READ, name: str = "request"):
+        """Runs an operation (one request) on the first sheet of the spreadsheet.
+        If a previously opened sheet can no longer be found or accessed,
+        (e.g., it was deleted or unshared) the sheet is opened again and the operation retried once.
+
+        Args:
+            operation (Callable[[gspread.worksheet.Worksheet], T]): The operation.
+            kind (str, optional): Whether the operation reads or writes (READ or WRITE). Defaults to READ.
+            name (str, optional): What the operation is, for the metrics. Defaults to "request".
+
+        Returns:
+            T: The result of the operation.
+        """
+        worksheet = self.open_sheet1()
+        try:
+            return self.request(lambda: operation(worksheet), kind, name=name)
+        except gspread.exceptions.APIError as e:
+            if self.cache is None or e.response.status_code not in (403, 404):
+                raise
+        self.cache.forget_worksheet(self.spreadsheet_id)
+        worksheet = self.open_sheet1()
+        return self.request(lambda: operation(worksheet), kind, name=name)
 
     def get_sheet1(self):
-        """Gets the first sheet of the spreadsheet.
+        """Gets columns A and B of the first sheet of the spreadsheet.
+        The other columns are for the user, so they are not read.
 
         Returns:
             list[list]: The sheet as a 2d array. [row][column]
         """
-        spreadsheet = self.spreadsheet_client.open_by_url(self.spreadsheet_url)
-        return spreadsheet.sheet1.get_values(
-            value_render_option=ValueRenderOption.unformatted,
-            date_time_render_option=DateTimeOption.formated_string,
+        return self.with_sheet1(
+            lambda worksheet: worksheet.get_values(
+                "A:B",
+                value_render_option=ValueRenderOption.unformatted,
+                date_time_render_option=DateTimeOption.formated_string,
+            ),
+            name="get_values",
         )
 
-    def verify_format(data: list[list]):
-        """Verifies that the spreadsheet is formatted correctly, i.e.,
-        - A1 and B1 are strings (column headers)
-        - A2 onwards are dates
-        - B2 onwards are floats
-        - If An is empty, Bn is empty
-        - If Bn is empty, An is empty
+    def get_sheet1_rows_after(self, row_count: int):
+        """Gets columns A and B of the first sheet of the spreadsheet, after the first `row_count` rows.
+
+        Args:
+            row_count (int): The number of rows already known (including the header).
+
+        Returns:
+            list[list]: The new rows as a 2d array. [row][column]
+        """
+        return self.with_sheet1(
+            lambda worksheet: worksheet.get_values(
+                f"A{row_count + 1}:B",
+                value_render_option=ValueRenderOption.unformatted,
+                date_time_render_option=DateTimeOption.formated_string,
+            ),
+            name="get_values",
+        )
+
+    def find_format_errors(data: list[list]):
+        """Finds everything wrong with the format of the spreadsheet (see verify_format).
+        Columns A and B are checked all at once with pandas, so this is fast even for years of data.
 
         Args:
             data (list[list]): The spreadsheet data, as a 2d array. [row][column]
 
         Returns:
-            bool: True if the spreadsheet is formatted correctly, False if not.
-            message: A message explaining why the spreadsheet is not formatted correctly.
+            list[tuple[int, str]]: (row number, message) for each problem, in the order they were checked.
         """
         # check empty
         if len(data) == 0:
-            return True, None
+            return []
         # check columns
         if len(data[0]) == 1:
-            return False, "There is only one column. There should be two or zero."
+            return [(1, "There is only one column. There should be two or zero.")]
 
         # check headers
+        errors = []
         A1 = data[0][0]
         B1 = data[0][1]
         if not (isinstance(A1, str) and isinstance(B1, str)):
-            return False, "A1 and B1 should be headers (strings)"
-        if is_date(A1):
-            return False, "A1 is a date. It should be a header (string)"
-        if is_float(B1):
-            return False, "B1 is a float. It should be a header (string)"
+            errors.append((1, "A1 and B1 should be headers (strings)"))
+        elif is_date(A1):
+            errors.append((1, "A1 is a date. It should be a header (string)"))
+        elif is_float(B1):
+            errors.append((1, "B1 is a float. It should be a header (string)"))
 
         # check data
-        blank_row = False
-        dates = []
-        dates_parsed = []
-        for row in data[1:]:
-            A = row[0]
-            B = row[1]
-            if A == "" and B == "":
-                blank_row = True
-                continue
-            if blank_row:
-                return False, "There is a blank row in the middle of columns A and B."
-            if A == "" and B != "":
-                return (
-                    False,
-                    "One of the dates in column A is missing. Remove the spend or add a date here.",
-                )
-            if A != "" and B == "":
-                return (
-                    False,
-                    "One of the spends in column B is missing. Remove the date or add a spend here.",
-                )
-            if not is_date(A):
-                return (
-                    False,
-                    "The cells in column A do not look like dates. Make sure they are.",
-                )
-            if not is_float(B):
-                return (
-                    False,
-                    "The cells in column B do not look like floats. Make sure they are.",
-                )
-            if A in dates:
-                return False, "There are duplicate dates in column A."
-            dates.append(A)
-            # if A < last date in dates_parsed
-            if len(dates_parsed) > 0 and str_to_date(A) < dates_parsed[-1]:
-                return False, "The dates in column A are not in ascending order."
-            dates_parsed.append(str_to_date(A))
+        if len(data) == 1:
+            return errors
+        import pandas
+
+        columns = pandas.DataFrame(data[1:], dtype=object)
+        A = columns[0]
+        B = (
+            columns[1]
+            if len(columns.columns) > 1
+            else pandas.Series(None, index=A.index)
+        )
+        # spreadsheet row numbers (1-indexed, after the header)
+        rows = columns.index + 2
+        A_blank = A.isna() | (A == "")
+        B_blank = B.isna() | (B == "")
+        blank = A_blank & B_blank
+        filled = (~blank).to_numpy().nonzero()[0]
+        last_filled = filled[-1] if len(filled) > 0 else -1
+        dates = pandas.to_datetime(
+            A.where(~A_blank).astype(str),
+            format="%d/%m/%Y",
+            errors="coerce",
+        )
+        spends = pandas.to_numeric(B.where(~B_blank), errors="coerce")
+        previous_dates = dates.ffill().shift()
+
+        checks = [
+            (
+                blank & (columns.index < last_filled),
+                "There is a blank row in the middle of columns A and B.",
+            ),
+            (
+                A_blank & ~B_blank,
+                "One of the dates in column A is missing. Remove the spend or add a date here.",
+            ),
+            (
+                ~A_blank & B_blank,
+                "One of the spends in column B is missing. Remove the date or add a spend here.",
+            ),
+            (
+                ~A_blank & dates.isna(),
+                "The cells in column A do not look like dates. Make sure they are.",
+            ),
+            (
+                ~B_blank & spends.isna(),
+                "The cells in column B do not look like floats. Make sure they are.",
+            ),
+            (
+                dates.notna() & dates.duplicated(),
+                "There are duplicate dates in column A.",
+            ),
+            (
+                dates < previous_dates,
+                "The dates in column A are not in ascending order.",
+            ),
+        ]
+        for failed, message in checks:
+            errors.extend((int(row), message) for row in rows[failed.to_numpy()])
+        return errors
+
+    @traced("spreadsheet.verify_format")
+    def verify_format(data: list[list]):
+        """Verifies that the spreadsheet is formatted correctly, i.e.,
+        - A1 and B1 are strings (column headers)
+        - A2 onwards are dates
+        - B2 onwards are floats
+        - If An is empty, Bn is empty
+        - If Bn is empty, An is empty
+        - Dates are unique and in ascending order
+        - There are no blank rows between data
 
-        return True, None
+        Args:
+            data (list[list]): The spreadsheet data, as a 2d array. [row][column]
 
+        Returns:
+            bool: True if the spreadsheet is formatted correctly, False if not.
+            message: A message explaining every way the spreadsheet is not formatted correctly.
+        """
+        errors = Spreadsheet.find_format_errors(data)
+        if len(errors) == 0:
+            return True, None
+        # group rows by problem, so the message is readable however many rows are wrong
+        rows_by_message = {}
+        for row, message in errors:
+            rows_by_message.setdefault(message, []).append(row)
+        lines = []
+        for message, rows in rows_by_message.items():
+            rows_text = ", ".join(str(row) for row in rows[:MAX_ROWS_IN_MESSAGE])
+            if len(rows) > MAX_ROWS_IN_MESSAGE:
+                rows_text += f" and {len(rows) - MAX_ROWS_IN_MESSAGE} more"
+            row_or_rows = "row" if len(rows) == 1 else "rows"
+            lines.append(f"{message} ({row_or_rows} {rows_text})")
+        return False, "\n".join(lines)
+
+    @traced("spreadsheet.get_spending_dataframe")
     def get_spending_dataframe(self):
         """Gets the data as a pandas dataframe.
+        If the spreadsheet is in the cache, the cached data is used instead of reading the spreadsheet.
+        Otherwise, if there is a local copy of it (see SpendingMirror), that is used,
+        after reading its new rows if it has not been synced for DEFAULT_SYNC_INTERVAL and the quota is not busy
+        (sync_mirrors cannot read every spreadsheet that often once there are many).
+        Otherwise, it is read from Google Sheets (see sync).
 
         Raises:
             ValueError: If the spreadsheet is not formatted correctly.
@@ -182,18 +419,235 @@ class Spreadsheet:
         Returns:
             pandas.DataFrame: The data as a dataframe. Columns: {"Date": datetime, "Spend": float}
         """
+        if self.cache is not None:
+            dframe = self.cache.get_dataframe(self.spreadsheet_id)
+            if dframe is not None:
+                return dframe
+        if self.mirror is not None:
+            dframe = self.mirror.get_dataframe(self.spreadsheet_id)
+            if dframe is not None and self.mirror_needs_sync():
+                try:
+                    return self.sync()
+                except (ValueError, QuotaDeferred):
+                    raise
+                except Exception:
+                    # e.g., Google Sheets is down, so the local copy will do
+                    pass
+            if dframe is not None:
+                if self.cache is not None:
+                    self.cache.set_dataframe(
+                        self.spreadsheet_id, dframe, full_read=False, from_sheets=False
+                    )
+                return dframe
+        return self.sync()
+
+    def mirror_needs_sync(self):
+        """Checks whether the local copy should be brought up to date before it is used,
+        i.e., it has not been synced for DEFAULT_SYNC_INTERVAL, and the quota is not busy.
+
+        Returns:
+            bool: True if it should be synced.
+        """
+        synced_at = self.mirror.get_synced_at(self.spreadsheet_id)
+        if synced_at is not None and time.time() - synced_at < DEFAULT_SYNC_INTERVAL:
+            return False
+        return self.quota is None or self.quota.pressure() <= MAX_SYNC_PRESSURE
+
+    @traced("spreadsheet.sync")
+    def sync(self):
+        """Reads the data from Google Sheets, and updates the cache and local copy.
+        If it was read in full recently, only the new rows are read.
+
+        Raises:
+            ValueError: If the spreadsheet is not formatted correctly.
+
+        Returns:
+            pandas.DataFrame: The data as a dataframe. Columns: {"Date": datetime, "Spend": float}
+        """
+        history = self.get_history()
+        if history is not None:
+            dframe = self.read_new_rows(history)
+            if dframe is not None:
+                self.store_dataframe(dframe, full_read=False)
+                return dframe
         data = self.get_sheet1()
         valid, message = Spreadsheet.verify_format(data)
         if not valid:
             raise ValueError(message)
-        first_two_columns = [row[:2] for row in data]
-        dframe = pandas.DataFrame(first_two_columns[1:], columns=["Date", "Spend"])
-        dframe["Date"] = pandas.to_datetime(dframe["Date"], format="%d/%m/%Y")
-        dframe["Spend"] = pandas.to_numeric(dframe["Spend"])
+        dframe = rows_to_dataframe(data[1:])
+        self.store_dataframe(dframe, full_read=True)
         return dframe
 
+    def get_history(self):
+        """Gets the data as it was last read, if it was last read in full recently enough
+        to be brought up to date by reading only the new rows.
+
+        Returns:
+            pandas.DataFrame | None: The data, or None if it has not been read in full recently.
+        """
+        if self.cache is not None:
+            history = self.cache.get_history(self.spreadsheet_id)
+            if history is not None:
+                return history
+        if self.mirror is not None:
+            full_synced_at = self.mirror.get_full_synced_at(self.spreadsheet_id)
+            if (
+                full_synced_at is not None
+                and time.time() - full_synced_at < DEFAULT_FULL_SYNC_INTERVAL
+            ):
+                return self.mirror.get_dataframe(self.spreadsheet_id)
+        return None
+
+    def store_dataframe(self, dframe: pandas.DataFrame, full_read: bool):
+        """Stores data read from Google Sheets in the cache and local copy.
+
+        Args:
+            dframe (pandas.DataFrame): The data. Columns: {"Date": datetime, "Spend": float}
+            full_read (bool): Whether the whole spreadsheet was read, as opposed to only its new rows.
+        """
+        if self.cache is not None:
+            self.cache.set_dataframe(self.spreadsheet_id, dframe, full_read=full_read)
+        if self.mirror is not None:
+            self.mirror.set_dataframe(
+                self.spreadsheet_id, self.spreadsheet_url, dframe, full_read=full_read
+            )
+
+    def get_cached_dataframe(self):
+        """Gets the data as a pandas dataframe, only if it is cached (see get_spending_dataframe).
+
+        Returns:
+            pandas.DataFrame | None: The data, or None if it is not cached.
+        """
+        if self.cache is None:
+            return None
+        return self.cache.get_dataframe(self.spreadsheet_id)
+
+    @traced("spreadsheet.get_spending_summary")
+    def get_spending_summary(self, dframe: pandas.DataFrame = None):
+        """Gets statistics of the spending data (see SpendingAggregates.summary).
+        If the spreadsheet is in the cache, running statistics are used instead of going through all the data.
+
+        Args:
+            dframe (pandas.DataFrame, optional): The data, if it has already been got with get_spending_dataframe,
+                so that the statistics are of the same data (e.g., as graphs of it). Defaults to None (get it).
+
+        Raises:
+            ValueError: If the spreadsheet is not formatted correctly.
+
+        Returns:
+            dict: The statistics.
+        """
+        if dframe is None:
+            dframe = self.get_spending_dataframe()
+        if self.cache is None:
+            return SpendingAggregates.from_dataframe(dframe).summary()
+        return self.cache.get_summary(self.spreadsheet_id, dframe)
+
+    def read_new_rows(self, dframe: pandas.DataFrame):
+        """Brings a previously read dataframe up to date by reading only the rows after it.
+
+        Args:
+            dframe (pandas.DataFrame): The previously read data. Columns: {"Date": datetime, "Spend": float}
+
+        Returns:
+            pandas.DataFrame | None: The updated data,
+                or None if the new rows could not be read or do not follow on from the old ones.
+        """
+        try:
+            new_data = self.get_sheet1_rows_after(len(dframe) + 1)
+        except gspread.exceptions.APIError:
+            # e.g., the range is past the end of the sheet
+            return None
+        if len(new_data) == 0:
+            return dframe
+        # check the new rows along with the last old row, so the date order is checked too
+        previous_rows = [["Date", "Spend"]]
+        if len(dframe) > 0:
+            last = dframe.iloc[-1]
+            previous_rows.append([last["Date"].strftime("%d/%m/%Y"), last["Spend"]])
+        valid, _ = Spreadsheet.verify_format(previous_rows + new_data)
+        if not valid:
+            return None
+        import pandas
+
+        new_rows = rows_to_dataframe(new_data)
+        if len(dframe) == 0:
+            return new_rows
+        return pandas.concat([dframe, new_rows], ignore_index=True)
+
+    def invalidate_cache(self):
+        """Forgets any cached data for this spreadsheet, so that it is read again next time."""
+        if self.cache is not None:
+            self.cache.invalidate(self.spreadsheet_id)
+        if self.mirror is not None:
+            self.mirror.invalidate(self.spreadsheet_id)
+
+    @traced("spreadsheet.get_tail")
+    def get_tail(self, fresh: bool = False):
+        """Gets the last date and the number of rows in the spreadsheet, without reading all of it.
+        Uses the cache if possible, otherwise only reads column A.
+
+        Args:
+            fresh (bool, optional): Whether to read column A even if the tail is cached,
+                e.g., because the spreadsheet may have been edited by hand since. Defaults to False.
+
+        Raises:
+            ValueError: If the last date in column A is not a date.
+
+        Returns:
+            datetime.datetime | None: The last date, or None if there is no data.
+            int: The number of rows, including the header.
+        """
+        if self.cache is not None and not fresh:
+            tail = self.cache.get_tail(self.spreadsheet_id)
+            if tail is not None:
+                return tail
+        column_a = self.with_sheet1(
+            lambda worksheet: worksheet.get_values(
+                "A:A",
+                value_render_option=ValueRenderOption.unformatted,
+                date_time_render_option=DateTimeOption.formated_string,
+            ),
+            name="get_values",
+        )
+        rows = len(column_a)
+        if rows <= 1:
+            last_date = None
+        elif is_date(column_a[-1][0]):
+            last_date = str_to_date(column_a[-1][0])
+        else:
+            raise ValueError(
+                "The last cell in column A does not look like a date. Make sure it is."
+            )
+        if self.cache is not None:
+            self.cache.set_tail(self.spreadsheet_id, last_date, rows)
+        return last_date, rows
+
+    @traced("spreadsheet.get_last_date")
+    def get_last_date(self):
+        """Gets the last date in the spreadsheet, reading Google Sheets only if the bot's own copies are out of date:
+        the cached tail is used if there is one, then the local copy, unless it needs syncing (see mirror_needs_sync).
+        Otherwise, only column A is read (see get_tail).
+
+        Raises:
+            ValueError: If the last date in column A is not a date.
+
+        Returns:
+            datetime.datetime | None: The last date, or None if there is no data.
+        """
+        if self.cache is not None:
+            tail = self.cache.get_tail(self.spreadsheet_id)
+            if tail is not None:
+                return tail[0]
+        if self.mirror is not None and not self.mirror_needs_sync():
+            tail = self.mirror.get_tail(self.spreadsheet_id)
+            if tail is not None:
+                return tail[0]
+        last_date, _ = self.get_tail()
+        return last_date
+
     def add_data(self, date_dt: datetime.datetime, spend: float):
-        """Adds a row to the spreadsheet.
+        """Adds a row to the end of the spreadsheet.
 
         Args:
             date (datetime.datetime): The date to add.
@@ -203,29 +657,169 @@ class Spreadsheet:
             bool: True if successful, False if not.
             message: A "why" message if unsuccessful.
         """
-        date_str = date_dt.strftime("%d/%m/%Y")
-        current_data = self.get_spending_dataframe()
-        if date_dt in current_data["Date"].values:
+        return self.add_data_batch([(date_dt, spend)])
+
+    @traced("spreadsheet.add_data_batch")
+    def add_data_batch(self, rows: list[tuple[datetime.datetime, float]]):
+        """Adds several rows to the end of the spreadsheet in one request.
+        Only the last date is checked (see get_tail), so the write takes the same time however long the spreadsheet is.
+        The cached tail is used if there is one. It is only ever from Google Sheets, not the local copy,
+        but can still be up to a few minutes old, so callers which can wait (e.g., the outbox) read it first with fresh=True.
+
+        Args:
+            rows (list[tuple[datetime.datetime, float]]): The (date, spend) rows to add, in ascending date order.
+
+        Returns:
+            bool: True if successful, False if not.
+            message: A "why" message if unsuccessful.
+        """
+        if len(rows) == 0:
+            return True, None
+        dates = [date_dt for date_dt, _ in rows]
+        if len(set(dates)) != len(dates):
             return False, "Attempting to add a duplicate date to spreadsheet."
-        if date_dt < current_data["Date"].max():
+        if dates != sorted(dates):
+            return False, "Attempting to add dates that are not in ascending order."
+        try:
+            last_date, rows_before = self.get_tail()
+        except ValueError as e:
+            return False, f"Spreadsheet is not formatted correctly: {e}"
+        if last_date is not None and dates[0] == last_date:
+            return False, "Attempting to add a duplicate date to spreadsheet."
+        if last_date is not None and dates[0] < last_date:
             return (
                 False,
                 "Attempting to add a date before most recent data to spreadsheet.",
             )
-        new_row = [date_str, spend]
-        spreadsheet = self.spreadsheet_client.open_by_url(self.spreadsheet_url)
-        # index is length of dataframe + 1
+        new_rows = [[date_dt.strftime("%d/%m/%Y"), spend] for date_dt, spend in rows]
+        # append after the last row of columns A:B, leaving other columns alone
         try:
-            spreadsheet.sheet1.insert_row(
-                new_row,
-                index=len(current_data) + 2,
-                value_input_option=ValueInputOption.user_entered,
+            self.with_sheet1(
+                lambda worksheet: worksheet.append_rows(
+                    new_rows,
+                    value_input_option=ValueInputOption.user_entered,
+                    insert_data_option="OVERWRITE",
+                    table_range="A:B",
+                ),
+                WRITE,
+                name="append_rows",
             )
+        except QuotaDeferred:
+            # nothing has been written, and the call will be run again
+            raise
         except Exception as e:
+            # we don't know what state the spreadsheet is in now
+            self.invalidate_cache()
             return False, f"Error adding data to spreadsheet: {e}"
+        if self.cache is not None:
+            self.cache.append_rows(self.spreadsheet_id, rows, rows_before)
+        if self.mirror is not None:
+            self.mirror.append_rows(self.spreadsheet_id, rows, rows_before)
         return True, None
 
 
+class AsyncSpreadsheet:
+    """
+    Wraps a Spreadsheet so that its (blocking) Google Sheets calls run on a thread pool,
+    instead of blocking the event loop for every other user.
+    """
+
+    def __init__(
+        self,
+        spreadsheet: Spreadsheet,
+        executor: concurrent.futures.Executor = None,
+    ):
+        """Creates an AsyncSpreadsheet object.
+
+        Args:
+            spreadsheet (Spreadsheet): The spreadsheet to wrap.
+            executor (concurrent.futures.Executor, optional): The thread pool to run calls on. Defaults to None (asyncio's default thread pool).
+        """
+        self.spreadsheet = spreadsheet
+        self.executor = executor
+
+    @property
+    def spreadsheet_url(self):
+        return self.spreadsheet.spreadsheet_url
+
+    @property
+    def spreadsheet_id(self):
+        return self.spreadsheet.spreadsheet_id
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+
+        def run():
+            # in this context, so that spans recorded on the thread are part of the current trace
+            return loop.run_in_executor(self.executor, run_in_context(func, *args))
+
+        if self.spreadsheet.quota is None:
+            return await run()
+        # requests wait for quota here, not on the thread
+        return await self.spreadsheet.quota.run_deferring(run)
+
+    async def get_sheet1(self):
+        """See Spreadsheet.get_sheet1"""
+        return await self._run(self.spreadsheet.get_sheet1)
+
+    async def get_spending_dataframe(self):
+        """See Spreadsheet.get_spending_dataframe"""
+        return await self._run(self.spreadsheet.get_spending_dataframe)
+
+    def get_cached_dataframe(self):
+        """See Spreadsheet.get_cached_dataframe"""
+        return self.spreadsheet.get_cached_dataframe()
+
+    async def sync(self):
+        """See Spreadsheet.sync"""
+        return await self._run(self.spreadsheet.sync)
+
+    async def get_spending_summary(self, dframe: pandas.DataFrame = None):
+        """See Spreadsheet.get_spending_summary"""
+        return await self._run(self.spreadsheet.get_spending_summary, dframe)
+
+    async def get_tail(self, fresh: bool = False):
+        """See Spreadsheet.get_tail"""
+        return await self._run(self.spreadsheet.get_tail, fresh)
+
+    async def get_last_date(self):
+        """See Spreadsheet.get_last_date"""
+        return await self._run(self.spreadsheet.get_last_date)
+
+    async def add_data(self, date_dt: datetime.datetime, spend: float):
+        """See Spreadsheet.add_data"""
+        return await self._run(self.spreadsheet.add_data, date_dt, spend)
+
+    async def add_data_batch(self, rows: list[tuple[datetime.datetime, float]]):
+        """See Spreadsheet.add_data_batch"""
+        return await self._run(self.spreadsheet.add_data_batch, rows)
+
+    def invalidate_cache(self):
+        """See Spreadsheet.invalidate_cache"""
+        self.spreadsheet.invalidate_cache()
+
+
+def open_spreadsheet(bot_data: dict, spreadsheet_url: str):
+    """Creates an AsyncSpreadsheet for a user, using the client, cache, quota, local copy, and thread pool
+    shared between users in the application's bot_data.
+
+    Args:
+        bot_data (dict): The application's bot_data (usually context.bot_data).
+        spreadsheet_url (str): The url of the spreadsheet to connect to.
+
+    Returns:
+        AsyncSpreadsheet: The spreadsheet.
+    """
+    spreadsheet = Spreadsheet(
+        bot_data["spreadsheet_client"],
+        spreadsheet_url,
+        bot_data.get("spreadsheet_cache"),
+        bot_data.get("spreadsheet_quota"),
+        bot_data.get("spending_mirror"),
+    )
+    return AsyncSpreadsheet(spreadsheet, bot_data.get("spreadsheet_executor"))
+
+
 def main():
     # authentication
     CREDENTIALS_PATH = "google_credentials.json"
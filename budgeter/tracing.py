@@ -0,0 +1,393 @@
+"""
+Lightweight tracing, to see where the time goes when a command is slow.
+
+Each update from Telegram starts a trace (see TracedApplication), as does each run of a job
+(see traced_job), and the work done for it records
+spans inside it: handlers, Spreadsheet methods, each Google Sheets request, drawing graphs,
+and each Telegram Bot API call. The current span is kept in a context variable, so it follows
+the update into tasks and, via run_in_context, onto the spreadsheet threads.
+
+Traces which take longer than a threshold are logged as one line of JSON. All traces can also be
+written to a file as OTLP JSON (one ExportTraceServiceRequest per line, like the OpenTelemetry
+Collector's file exporter), to load into Jaeger, Grafana Tempo, and the like.
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import logging
+import threading
+import functools
+import contextlib
+import contextvars
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# traces taking longer than this are logged (seconds)
+DEFAULT_SLOW_THRESHOLD = 2.0
+# the most spans kept in one trace, e.g., for the reminders job, which makes a call per user
+MAX_SPANS = 500
+SERVICE_NAME = "telegram-budgeter"
+
+# OTLP span kinds
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+# OTLP status codes
+STATUS_ERROR = 2
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed piece of work within a trace.
+    """
+
+    def __init__(
+        self,
+        trace: Trace,
+        name: str,
+        parent: Span = None,
+        kind: int = INTERNAL,
+        attributes: dict = None,
+    ):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def end(self):
+        self.duration = time.perf_counter() - self._start
+
+    @property
+    def end_ns(self):
+        return self.start_ns + int((self.duration or 0) * 1e9)
+
+
+class Trace:
+    """
+    The spans recorded for one update. Spans can be added from several threads.
+    """
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self.dropped_spans = 0
+        # spans are not recorded after this, e.g., by a job scheduled while handling the update
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def start_span(self, name: str, parent: Span = None, **kwargs):
+        """Starts a span in the trace.
+
+        Returns:
+            Span | None: The span, or None if the trace has finished or is full (see MAX_SPANS).
+        """
+        with self._lock:
+            if self.finished:
+                return None
+            if len(self.spans) >= MAX_SPANS:
+                self.dropped_spans += 1
+                return None
+            span = Span(self, name, parent, **kwargs)
+            self.spans.append(span)
+        return span
+
+    def finish(self):
+        with self._lock:
+            self.finished = True
+
+    @property
+    def root(self):
+        return self.spans[0]
+
+    def to_log(self):
+        """Summarises the trace for the slow trace log.
+
+        Returns:
+            dict: The trace, with times in milliseconds from the start of the trace.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        start_ns = self.root.start_ns
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "duration_ms": round(self.root.duration * 1000, 1),
+            "attributes": self.root.attributes,
+            **({"dropped_spans": self.dropped_spans} if self.dropped_spans else {}),
+            "spans": [
+                {
+                    "name": span.name,
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "start_ms": round((span.start_ns - start_ns) / 1e6, 1),
+                    # None if it has not finished, e.g., a task left running
+                    "duration_ms": (
+                        round(span.duration * 1000, 1)
+                        if span.duration is not None
+                        else None
+                    ),
+                    **({"attributes": span.attributes} if span.attributes else {}),
+                    **({"error": span.error} if span.error is not None else {}),
+                }
+                for span in spans[1:]
+            ],
+        }
+
+    def to_otlp(self):
+        """Converts the trace to OTLP JSON.
+
+        Returns:
+            dict: An ExportTraceServiceRequest.
+        """
+        with self._lock:
+            spans = [span for span in self.spans if span.duration is not None]
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": otlp_attributes({"service.name": SERVICE_NAME})
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [
+                                {
+                                    "traceId": self.trace_id,
+                                    "spanId": span.span_id,
+                                    "parentSpanId": span.parent_id or "",
+                                    "name": span.name,
+                                    "kind": span.kind,
+                                    "startTimeUnixNano": str(span.start_ns),
+                                    "endTimeUnixNano": str(span.end_ns),
+                                    "attributes": otlp_attributes(span.attributes),
+                                    "status": (
+                                        {"code": STATUS_ERROR, "message": span.error}
+                                        if span.error is not None
+                                        else {}
+                                    ),
+                                }
+                                for span in spans
+                            ],
+                        }
+                    ],
+                }
+            ]
+        }
+
+
+def otlp_attributes(attributes: dict):
+    """Converts attributes to OTLP JSON's list of typed key-value pairs.
+
+    Args:
+        attributes (dict): The attributes.
+
+    Returns:
+        list[dict]: The attributes in OTLP JSON.
+    """
+    converted = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            # 64-bit integers are strings in OTLP JSON
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        converted.append({"key": key, "value": typed})
+    return converted
+
+
+class Tracer:
+    """
+    Starts traces, and logs or exports them when they finish.
+    """
+
+    def __init__(
+        self, slow_threshold: float = DEFAULT_SLOW_THRESHOLD, export_path: str = None
+    ):
+        """Creates a Tracer object.
+
+        Args:
+            slow_threshold (float, optional): Traces taking longer than this are logged (seconds).
+                Defaults to DEFAULT_SLOW_THRESHOLD.
+            export_path (str, optional): A file to append every trace to, as OTLP JSON.
+                Defaults to None (no file).
+        """
+        self.configure(slow_threshold, export_path)
+        self._export_lock = threading.Lock()
+
+    def configure(
+        self, slow_threshold: float = DEFAULT_SLOW_THRESHOLD, export_path: str = None
+    ):
+        """Changes the settings (see Tracer.__init__)."""
+        self.slow_threshold = slow_threshold
+        self.export_path = export_path
+
+    @contextlib.contextmanager
+    def trace(self, name: str, kind: int = SERVER, **attributes):
+        """Starts a trace for the body of a `with` statement, with a root span called `name`.
+
+        Args:
+            name (str): What is being traced, e.g., "update".
+            kind (int, optional): The OTLP kind of the root span. Defaults to SERVER.
+            **attributes: Attributes of the root span.
+
+        Yields:
+            Span: The root span.
+        """
+        root = Trace().start_span(name, kind=kind, attributes=attributes)
+        token = _current_span.set(root)
+        try:
+            yield root
+        except Exception as error:
+            root.error = repr(error)
+            raise
+        finally:
+            _current_span.reset(token)
+            root.end()
+            root.trace.finish()
+            self.export(root.trace)
+
+    def export(self, trace: Trace):
+        """Logs a finished trace if it was slow, and writes it to the export file if there is one.
+
+        Args:
+            trace (Trace): The trace.
+        """
+        if trace.root.duration >= self.slow_threshold:
+            logger.warning("Slow trace: %s", json.dumps(trace.to_log(), default=str))
+        if self.export_path is not None:
+            line = json.dumps(trace.to_otlp(), default=str)
+            try:
+                with self._export_lock, open(self.export_path, "a") as file:
+                    file.write(line + "\n")
+            except OSError as error:
+                logger.warning("Could not export trace: %s", error)
+
+
+TRACER = Tracer()
+
+
+@contextlib.contextmanager
+def span(name: str, kind: int = INTERNAL, **attributes):
+    """Records a span for the body of a `with` statement, inside the current span.
+    Does nothing (and yields None) if nothing is being traced.
+
+    Args:
+        name (str): What is being done, e.g., "sheets.get_values".
+        kind (int, optional): The OTLP kind of the span, e.g., CLIENT for calls to other services.
+            Defaults to INTERNAL.
+        **attributes: Attributes of the span.
+
+    Yields:
+        Span | None: The span.
+    """
+    parent = _current_span.get()
+    child = (
+        parent.trace.start_span(name, parent, kind=kind, attributes=attributes)
+        if parent is not None
+        else None
+    )
+    if child is None:
+        yield None
+        return
+    token = _current_span.set(child)
+    try:
+        yield child
+    except Exception as error:
+        child.error = repr(error)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def traced(name: str):
+    """Decorates a (synchronous) function to record a span each time it is called (see span).
+
+    Args:
+        name (str): The name of the spans.
+    """
+
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def traced_job(callback):
+    """Wraps a job callback so that each run is a trace of its own,
+    rather than part of the trace of whatever update scheduled the job.
+
+    Args:
+        callback (Callable[..., Awaitable]): The callback.
+
+    Returns:
+        Callable[..., Awaitable]: The wrapped callback.
+    """
+    name = f"job.{callback.__name__}"
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        with TRACER.trace(name, kind=INTERNAL):
+            return await callback(*args, **kwargs)
+
+    return wrapper
+
+
+def run_in_context(function, *args):
+    """Makes a function, to run on another thread, run in the current context,
+    so that the spans it records are part of the current trace.
+    (loop.run_in_executor does not do this itself, unlike asyncio.to_thread.)
+
+    Args:
+        function (Callable[..., T]): The function.
+        *args: Its arguments.
+
+    Returns:
+        Callable[[], T]: The function, bound to its arguments and the current context.
+    """
+    return functools.partial(contextvars.copy_context().run, function, *args)
+
+
+class TracedApplication(Application):
+    """
+    An Application which starts a trace for each update it handles.
+    Use it with Application.builder().application_class(TracedApplication).
+    """
+
+    async def process_update(self, update: object) -> None:
+        if not isinstance(update, Update):
+            await super().process_update(update)
+            return
+        attributes = {"update_id": update.update_id}
+        if update.effective_user is not None:
+            attributes["user_id"] = update.effective_user.id
+        message = update.effective_message
+        if message is not None and message.text and message.text.startswith("/"):
+            # only the command, as messages can contain users' spending
+            attributes["command"] = message.text.split()[0]
+        with TRACER.trace("update", **attributes):
+            await super().process_update(update)
@@ -0,0 +1,130 @@
+import math
+import random
+import unittest
+import os
+import sys
+import pandas
+import datetime
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from budgeter.aggregates import SpendingAggregates
+from budgeter.cache import SpreadsheetCache
+
+
+def make_dataframe(days: int, seed: int = 0):
+    rng = random.Random(seed)
+    start = datetime.datetime(2020, 1, 1)
+    return pandas.DataFrame(
+        {
+            "Date": [start + datetime.timedelta(days=i) for i in range(days)],
+            "Spend": [round(rng.uniform(0, 50), 2) for _ in range(days)],
+        }
+    )
+
+
+class TestSpendingAggregates(unittest.TestCase):
+    def assert_matches_pandas(self, summary, df):
+        self.assertEqual(
+            summary["totaldays"], (df["Date"].max() - df["Date"].min()).days
+        )
+        self.assertAlmostEqual(summary["total"], df["Spend"].sum())
+        self.assertAlmostEqual(summary["average"], df["Spend"].mean())
+        self.assertAlmostEqual(summary["median"], df["Spend"].median())
+        self.assertEqual(summary["minimum"], df["Spend"].min())
+        self.assertEqual(summary["maximum"], df["Spend"].max())
+        for window in [7, 30, 365]:
+            tail = df.tail(window)["Spend"]
+            self.assertAlmostEqual(summary[f"last{window}total"], tail.sum())
+            self.assertAlmostEqual(summary[f"last{window}average"], tail.mean())
+            self.assertAlmostEqual(summary[f"last{window}median"], tail.median())
+
+    def test_from_dataframe(self):
+        # arrange
+        df = make_dataframe(400)
+
+        # act
+        summary = SpendingAggregates.from_dataframe(df).summary()
+
+        # assert
+        self.assert_matches_pandas(summary, df)
+
+    def test_add(self):
+        # arrange
+        df = make_dataframe(400)
+        aggregates = SpendingAggregates.from_dataframe(df.head(390))
+
+        # act
+        for date, spend in zip(df.tail(10)["Date"], df.tail(10)["Spend"]):
+            aggregates.add(date, spend)
+
+        # assert
+        self.assert_matches_pandas(aggregates.summary(), df)
+
+    def test_empty(self):
+        summary = SpendingAggregates().summary()
+        self.assertEqual(summary["count"], 0)
+        self.assertTrue(math.isnan(summary["average"]))
+
+    def test_cache_updates_summary_on_append(self):
+        # arrange
+        df = make_dataframe(40)
+        cache = SpreadsheetCache()
+        cache.set_dataframe("id", df.head(39))
+        cache.get_summary("id", df.head(39))
+        aggregates = cache._aggregates["id"]
+
+        # act
+        cache.append_rows("id", [(df["Date"].iloc[-1], df["Spend"].iloc[-1])])
+        summary = cache.get_summary("id", cache.get_dataframe("id"))
+
+        # assert
+        self.assert_matches_pandas(summary, df)
+        # updated, not worked out again
+        self.assertIs(cache._aggregates["id"], aggregates)
+
+    def test_cache_summary_is_of_the_data_given(self):
+        # arrange
+        df = make_dataframe(40)
+        cache = SpreadsheetCache()
+        cache.set_dataframe("id", df)
+        cache.get_summary("id", df)
+        # e.g., a row edited by hand, then the whole spreadsheet read again
+        edited = df.copy()
+        edited.loc[39, "Date"] = edited.loc[39, "Date"] + datetime.timedelta(days=1)
+        edited.loc[39, "Spend"] = 1000.0
+
+        # act
+        summary = cache.get_summary("id", edited)
+
+        # assert
+        self.assert_matches_pandas(summary, edited)
+
+    def test_cache_not_locked_while_working_out_summary(self):
+        # arrange
+        df = make_dataframe(40)
+        cache = SpreadsheetCache()
+        locked = []
+        from_dataframe = SpendingAggregates.from_dataframe
+
+        def check_lock(dframe):
+            locked.append(cache._lock.locked())
+            return from_dataframe(dframe)
+
+        # act
+        with patch.object(SpendingAggregates, "from_dataframe", check_lock):
+            summary = cache.get_summary("id", df)
+
+        # assert
+        self.assertEqual(locked, [False])
+        self.assert_matches_pandas(summary, df)
+
+    def test_running_median_of_many_days(self):
+        # arrange
+        df = make_dataframe(5000)
+
+        # act
+        summary = SpendingAggregates.from_dataframe(df).summary()
+
+        # assert
+        self.assertAlmostEqual(summary["median"], df["Spend"].median())
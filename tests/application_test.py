@@ -0,0 +1,114 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import asyncio
+import datetime
+import warnings
+from telegram import Update, Message, Chat, User
+from telegram.ext import Application
+from telegram.warnings import PTBUserWarning
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from budgeter.application import (
+    BudgeterApplication,
+    ordering_key,
+    MAX_PENDING_UPDATES,
+)
+
+
+def make_update(update_id: int, user_id: int):
+    return Update(
+        update_id,
+        message=Message(
+            update_id,
+            datetime.datetime.now(datetime.timezone.utc),
+            Chat(user_id, Chat.PRIVATE),
+            from_user=User(user_id, "user", False),
+            text="/stats",
+        ),
+    )
+
+
+class TestBudgeterApplication(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.application = (
+            Application.builder()
+            .application_class(BudgeterApplication, kwargs={"handled_at_once": 2})
+            .token("123:ABC")
+            .concurrent_updates(MAX_PENDING_UPDATES)
+            .build()
+        )
+        self.events = []
+
+        async def process_update(application, update):
+            self.events.append(("start", update.update_id))
+            await asyncio.sleep(0.05)
+            self.events.append(("end", update.update_id))
+
+        patcher = patch.object(Application, "process_update", process_update)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_same_user_in_order(self):
+        # act
+        await asyncio.gather(
+            *(self.application.process_update(make_update(i, 1)) for i in range(3))
+        )
+
+        # assert
+        self.assertEqual(
+            self.events,
+            [
+                ("start", 0),
+                ("end", 0),
+                ("start", 1),
+                ("end", 1),
+                ("start", 2),
+                ("end", 2),
+            ],
+        )
+        # no locks are kept for users with nothing to handle
+        self.assertEqual(self.application._ordering_locks, {})
+
+    async def test_different_users_at_once(self):
+        # act
+        await asyncio.gather(
+            *(self.application.process_update(make_update(i, i)) for i in range(2))
+        )
+
+        # assert
+        self.assertEqual(
+            [event for event, _ in self.events], ["start"] * 2 + ["end"] * 2
+        )
+
+    async def test_busy_user_takes_one_slot(self):
+        # arrange: as python-telegram-bot hands out updates
+        fetcher = asyncio.create_task(self.application._update_fetcher())
+        self.addCleanup(fetcher.cancel)
+
+        # act: user 1 sends several messages, then users 2 and 3 one each
+        with warnings.catch_warnings():
+            # about the application not running, which does not matter here
+            warnings.simplefilter("ignore", PTBUserWarning)
+            for i in range(4):
+                await self.application.update_queue.put(make_update(i, 1))
+            await self.application.update_queue.put(make_update(4, 2))
+            await self.application.update_queue.put(make_update(5, 3))
+            await asyncio.wait_for(self.application.update_queue.join(), 5)
+
+        # assert: user 2 did not wait for all of user 1's, and there were never more than 2 at once
+        self.assertLess(self.events.index(("start", 4)), self.events.index(("end", 1)))
+        running = 0
+        for event, _ in self.events:
+            running += 1 if event == "start" else -1
+            self.assertLessEqual(running, 2)
+
+    def test_ordering_key(self):
+        self.assertEqual(ordering_key(make_update(1, 5)), ("user", 5))
+        self.assertIsNone(ordering_key(Update(1)))
+        self.assertIsNone(ordering_key("not an update"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import os
+import sys
+import pandas
+import numpy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from budgeter.charts import (
+    CHART_KINDS,
+    ChartCache,
+    chart_key,
+    make_chart_executor,
+    render_chart,
+    render_chart_async,
+    rolling_mean,
+)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def make_series(days: int):
+    dates = pandas.date_range("2021-01-01", periods=days, freq="D").to_numpy()
+    spends = (numpy.arange(days) % 17).astype(float)
+    return dates, spends
+
+
+class TestCharts(unittest.TestCase):
+    def test_rolling_mean(self):
+        _, spends = make_series(50)
+        expected = pandas.Series(spends).rolling(7).mean().dropna().to_numpy()
+        numpy.testing.assert_allclose(rolling_mean(spends, 7), expected)
+
+    def test_rolling_mean_not_enough_data(self):
+        _, spends = make_series(5)
+        self.assertEqual(len(rolling_mean(spends, 7)), 0)
+
+    def test_render_chart(self):
+        dates, spends = make_series(100)
+        for kind in CHART_KINDS:
+            png = render_chart(kind, dates, spends)
+            self.assertTrue(png.startswith(PNG_SIGNATURE), kind)
+
+    def test_render_unknown_chart(self):
+        dates, spends = make_series(10)
+        with self.assertRaises(ValueError):
+            render_chart("pie", dates, spends)
+
+
+class TestChartExecutor(unittest.IsolatedAsyncioTestCase):
+    async def test_render_on_process_pool(self):
+        dates, spends = make_series(100)
+        executor = make_chart_executor(1)
+        try:
+            png = await render_chart_async(executor, CHART_KINDS[0], dates, spends)
+        finally:
+            executor.shutdown()
+        self.assertTrue(png.startswith(PNG_SIGNATURE))
+
+
+class TestChartCache(unittest.TestCase):
+    def test_key_depends_on_data_and_kind(self):
+        dates, spends = make_series(30)
+        key = chart_key(CHART_KINDS[0], dates, spends)
+        self.assertEqual(key, chart_key(CHART_KINDS[0], dates.copy(), spends.copy()))
+        self.assertNotEqual(key, chart_key(CHART_KINDS[1], dates, spends))
+        changed = spends.copy()
+        changed[-1] += 1
+        self.assertNotEqual(key, chart_key(CHART_KINDS[0], dates, changed))
+
+    def test_file_id(self):
+        cache = ChartCache()
+        cache.set_png("key", b"png")
+        cache.set_file_id("key", "file id")
+        self.assertEqual(cache.get("key"), (b"png", "file id"))
+        self.assertEqual(cache.get("missing"), (None, None))
+
+    def test_evicts_by_size(self):
+        cache = ChartCache(max_bytes=10)
+        cache.set_png("a", b"12345")
+        cache.set_png("b", b"12345")
+        cache.get("a")
+        cache.set_png("c", b"12345")
+        self.assertEqual(cache.get("a")[0], b"12345")
+        self.assertIsNone(cache.get("b")[0])
+        cache.set_png("too big", b"12345678901")
+        self.assertIsNone(cache.get("too big")[0])
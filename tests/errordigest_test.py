@@ -0,0 +1,181 @@
+import unittest
+from unittest.mock import MagicMock, AsyncMock
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from budgeter.errordigest import (
+    ErrorDigest,
+    fingerprint,
+    send_error_digest,
+    MAX_MESSAGE_LENGTH,
+)
+from budgeter.bothandlers.errorHandler import error_handler
+
+
+def raise_value_error(message: str):
+    raise ValueError(message)
+
+
+def raise_key_error():
+    raise KeyError("spreadsheet_url")
+
+
+def caught(function, *args):
+    try:
+        function(*args)
+    except Exception as error:
+        return error
+
+
+class FakeContext:
+    def __init__(self, bot_data, error=None):
+        self.bot_data = bot_data
+        self.error = error
+        self.bot = MagicMock()
+        self.bot.send_message = AsyncMock()
+
+
+class TestFingerprint(unittest.TestCase):
+    def test_same_place_same_fingerprint(self):
+        # act
+        first = fingerprint(caught(raise_value_error, "one"))
+        second = fingerprint(caught(raise_value_error, "two"))
+
+        # assert
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith("ValueError at tests/errordigest_test.py:"))
+        self.assertTrue(first.endswith("(raise_value_error)"))
+
+    def test_different_place_different_fingerprint(self):
+        self.assertNotEqual(
+            fingerprint(caught(raise_value_error, "one")),
+            fingerprint(caught(raise_key_error)),
+        )
+
+    def test_not_raised(self):
+        self.assertEqual(fingerprint(ValueError("never raised")), "ValueError")
+
+
+class TestErrorDigest(unittest.TestCase):
+    def test_alerts_only_new_errors(self):
+        # arrange
+        digest = ErrorDigest(admin_id=1)
+
+        # act
+        first = digest.record(caught(raise_value_error, "one"))
+        again = digest.record(caught(raise_value_error, "two"))
+        other = digest.record(caught(raise_key_error))
+
+        # assert
+        self.assertIn("ValueError: one", first)
+        self.assertIsNone(again)
+        self.assertIn("KeyError", other)
+
+    def test_alerts_are_limited(self):
+        # arrange
+        digest = ErrorDigest(admin_id=1, max_alerts_per_interval=1)
+
+        # act
+        first = digest.record(caught(raise_value_error, "one"))
+        second = digest.record(caught(raise_key_error))
+
+        # assert
+        self.assertIsNotNone(first)
+        self.assertIsNone(second)
+        self.assertIn("KeyError", digest.take_digest())
+
+    def test_digest(self):
+        # arrange
+        digest = ErrorDigest(admin_id=1)
+        for i in range(3):
+            digest.record(caught(raise_value_error, f"number {i}"))
+        digest.record(caught(raise_key_error))
+
+        # act
+        text = digest.take_digest()
+
+        # assert
+        value_error = text.index("3× ValueError")
+        key_error = text.index("1× KeyError")
+        self.assertLess(value_error, key_error)
+        # one example of each
+        self.assertIn("e.g., ValueError: number 0", text)
+        self.assertNotIn("number 1", text)
+        self.assertIsNone(digest.take_digest())
+        # already known, so not alerted again after the digest
+        self.assertIsNone(digest.record(caught(raise_value_error, "again")))
+
+    def test_digest_is_cut_short(self):
+        # arrange
+        digest = ErrorDigest(admin_id=1)
+        for i in range(100):
+            # a different fingerprint for each
+            digest.record(type(f"Error{i}", (Exception,), {})("x" * 1000))
+
+        # act
+        text = digest.take_digest()
+
+        # assert
+        self.assertLessEqual(len(text), MAX_MESSAGE_LENGTH)
+
+
+class TestErrorHandler(unittest.IsolatedAsyncioTestCase):
+    async def test_sends_new_errors_once(self):
+        # arrange
+        context = FakeContext(
+            {"error_digest": ErrorDigest(admin_id=1)},
+            caught(raise_value_error, "one"),
+        )
+
+        # act
+        with self.assertLogs("budgeter.bothandlers.errorHandler", level="ERROR"):
+            await error_handler(None, context)
+            await error_handler(None, context)
+
+        # assert
+        context.bot.send_message.assert_awaited_once()
+        self.assertEqual(context.bot.send_message.call_args.kwargs["chat_id"], 1)
+
+    async def test_no_admin(self):
+        # arrange
+        context = FakeContext(
+            {"error_digest": ErrorDigest()}, caught(raise_value_error, "one")
+        )
+
+        # act
+        with self.assertLogs("budgeter.bothandlers.errorHandler", level="ERROR"):
+            await error_handler(None, context)
+
+        # assert
+        context.bot.send_message.assert_not_awaited()
+
+    async def test_failing_to_send_is_not_an_error(self):
+        # arrange
+        context = FakeContext(
+            {"error_digest": ErrorDigest(admin_id=1)}, caught(raise_value_error, "one")
+        )
+        context.bot.send_message.side_effect = RuntimeError("Telegram is down")
+
+        # act
+        with self.assertLogs("budgeter.errordigest", level="WARNING"):
+            with self.assertLogs("budgeter.bothandlers.errorHandler", level="ERROR"):
+                await error_handler(None, context)
+
+    async def test_send_error_digest(self):
+        # arrange
+        digest = ErrorDigest(admin_id=1)
+        context = FakeContext({"error_digest": digest})
+
+        # act
+        await send_error_digest(context)
+        digest.record(caught(raise_key_error))
+        await send_error_digest(context)
+
+        # assert
+        context.bot.send_message.assert_awaited_once()
+        self.assertIn("1× KeyError", context.bot.send_message.call_args.kwargs["text"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+import unittest
+import os
+import sys
+import time
+import datetime
+from gspread.exceptions import APIError
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from budgeter.fakesheets import FakeClient, parse_range
+from budgeter.quota import QuotaManager
+from budgeter.spreadsheet import Spreadsheet
+
+URL = "https://docs.google.com/spreadsheets/d/abc123/edit"
+
+
+class TestParseRange(unittest.TestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_range("A:B"), (1, 1, None, 2))
+        self.assertEqual(parse_range("A5:B"), (5, 1, None, 2))
+        self.assertEqual(parse_range("Sheet1!B2:C10"), (2, 2, 10, 3))
+        self.assertEqual(parse_range("B2"), (2, 2, 2, 2))
+
+    def test_unsupported_range(self):
+        with self.assertRaises(ValueError):
+            parse_range("not a range")
+
+
+class TestFakeWorksheet(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.worksheet = self.client.create(
+            "abc123",
+            [["Date", "Spend", "Notes"], ["01/01/2021", 1.0, "x"], ["02/01/2021", 2.0]],
+        ).sheet1
+
+    def test_get_values(self):
+        self.assertEqual(
+            self.worksheet.get_values("A:B"),
+            [["Date", "Spend"], ["01/01/2021", 1.0], ["02/01/2021", 2.0]],
+        )
+        self.assertEqual(self.worksheet.get_values("A3:B"), [["02/01/2021", 2.0]])
+        self.assertEqual(self.worksheet.get_values("A4:B"), [])
+        self.assertEqual(
+            self.worksheet.get_values("C:C"), [["Notes"], ["x"]]
+        )  # trailing empty rows dropped
+
+    def test_append_rows_after_table(self):
+        # act
+        self.worksheet.append_rows([["03/01/2021", 3.0]], table_range="A:B")
+
+        # assert
+        self.assertEqual(self.worksheet.get_values("A4:C"), [["03/01/2021", 3.0]])
+
+    def test_insert_row_and_updates(self):
+        # act
+        self.worksheet.insert_row(["31/12/2020", 0.5], index=2)
+        self.worksheet.update("B2", [[0.25]])
+        self.worksheet.batch_update([{"range": "C5", "values": [["y"]]}])
+
+        # assert
+        self.assertEqual(
+            self.worksheet.get_values(),
+            [
+                ["Date", "Spend", "Notes"],
+                ["31/12/2020", 0.25, ""],
+                ["01/01/2021", 1.0, "x"],
+                ["02/01/2021", 2.0, ""],
+                ["", "", "y"],
+            ],
+        )
+
+
+class TestFakeClient(unittest.TestCase):
+    def test_creates_missing_spreadsheets(self):
+        # act
+        first = FakeClient().open_by_url(URL)
+        client = FakeClient()
+        second = client.open_by_url(URL)
+
+        # assert
+        self.assertEqual(second.sheet1.get_values(), [["Date", "Spend"]])
+        self.assertIs(client.open_by_url(URL), second)
+        self.assertIsNot(first, second)
+
+    def test_counts_requests(self):
+        # arrange
+        client = FakeClient()
+
+        # act
+        client.open_by_url(URL).sheet1.get_values("A:A")
+
+        # assert
+        self.assertEqual(client.requests, {"open": 1, "sheet1": 1, "get_values": 1})
+
+    def test_latency(self):
+        # arrange
+        client = FakeClient(latency=0.05, jitter=0.05, seed=1)
+
+        # act
+        start = time.monotonic()
+        client.open_by_url(URL)
+        elapsed = time.monotonic() - start
+
+        # assert
+        self.assertGreaterEqual(elapsed, 0.05)
+        self.assertLess(elapsed, 0.5)
+
+    def test_errors(self):
+        # arrange
+        quota_errors = FakeClient(quota_error_rate=1)
+        server_errors = FakeClient(server_error_rate=1)
+
+        # act
+        with self.assertRaises(APIError) as quota_error:
+            quota_errors.open_by_url(URL)
+        with self.assertRaises(APIError) as server_error:
+            server_errors.open_by_url(URL)
+
+        # assert
+        self.assertEqual(quota_error.exception.response.status_code, 429)
+        self.assertIn(server_error.exception.response.status_code, (500, 503))
+
+
+class TestSpreadsheetWithFakeClient(unittest.TestCase):
+    def test_add_and_read_back(self):
+        # arrange
+        client = FakeClient()
+        spreadsheet = Spreadsheet(client, URL)
+
+        # act
+        data_added, why_not = spreadsheet.add_data_batch(
+            [(datetime.datetime(2021, 1, 1), 1.5), (datetime.datetime(2021, 1, 2), 2)]
+        )
+        spreadsheet.invalidate_cache()
+        dframe = spreadsheet.get_spending_dataframe()
+
+        # assert
+        self.assertTrue(data_added, why_not)
+        self.assertEqual(dframe["Spend"].tolist(), [1.5, 2.0])
+        self.assertEqual(dframe["Date"].iloc[-1], datetime.datetime(2021, 1, 2))
+
+    def test_retries_errors(self):
+        # arrange
+        client = FakeClient(quota_error_rate=0.2, server_error_rate=0.2, seed=3)
+        quota = QuotaManager(
+            reads_per_minute=6000,
+            writes_per_minute=6000,
+            base_backoff=0.001,
+            max_retries=20,
+        )
+        spreadsheet = Spreadsheet(client, URL, quota=quota)
+
+        # act
+        data_added, why_not = spreadsheet.add_data(datetime.datetime(2021, 1, 1), 3)
+        dframe = spreadsheet.get_spending_dataframe()
+
+        # assert
+        self.assertTrue(data_added, why_not)
+        self.assertEqual(dframe["Spend"].tolist(), [3.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import unittest
+from unittest.mock import MagicMock
+import os
+import sys
+import asyncio
+import urllib.error
+import urllib.request
+from gspread.exceptions import APIError
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from budgeter.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    Registry,
+    timed_handler,
+    start_metrics_server,
+    HANDLER_SECONDS,
+    SHEETS_REQUESTS,
+)
+from budgeter.fakesheets import FakeResponse
+from budgeter.spreadsheet import measure_request
+
+
+class TestMetrics(unittest.TestCase):
+    def test_counter(self):
+        # arrange
+        counter = Counter("requests", "Requests.", ("method", "outcome"))
+
+        # act
+        counter.inc(method="get", outcome="ok")
+        counter.inc(2, method="get", outcome="ok")
+        counter.inc(method="get", outcome="429")
+
+        # assert
+        self.assertEqual(
+            counter.render(),
+            "# HELP requests Requests.\n"
+            "# TYPE requests counter\n"
+            'requests_total{method="get",outcome="429"} 1.0\n'
+            'requests_total{method="get",outcome="ok"} 3.0\n',
+        )
+
+    def test_wrong_labels(self):
+        counter = Counter("requests", "Requests.", ("method",))
+        with self.assertRaises(ValueError):
+            counter.inc(outcome="ok")
+
+    def test_gauge_function(self):
+        # arrange
+        gauge = Gauge("queue", "Queue length.")
+        queue = [1, 2, 3]
+
+        # act
+        gauge.set_function(lambda: len(queue))
+        queue.append(4)
+
+        # assert
+        self.assertIn("queue 4.0\n", gauge.render())
+
+    def test_histogram(self):
+        # arrange
+        histogram = Histogram("seconds", "Seconds.", buckets=(0.1, 1))
+
+        # act
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        # assert
+        self.assertEqual(
+            histogram.render(),
+            "# HELP seconds Seconds.\n"
+            "# TYPE seconds histogram\n"
+            'seconds_bucket{le="0.1"} 1.0\n'
+            'seconds_bucket{le="1.0"} 2.0\n'
+            'seconds_bucket{le="+Inf"} 3.0\n'
+            "seconds_count 3.0\n"
+            "seconds_sum 5.55\n",
+        )
+
+    def test_histogram_time_records_errors(self):
+        # arrange
+        histogram = Histogram("seconds", "Seconds.", ("step",))
+
+        # act
+        with self.assertRaises(ZeroDivisionError):
+            with histogram.time(step="divide"):
+                1 / 0
+
+        # assert
+        self.assertEqual(histogram.count(step="divide"), 1)
+
+    def test_registry_rejects_duplicates(self):
+        registry = Registry()
+        registry.register(Counter("requests", "Requests."))
+        with self.assertRaises(ValueError):
+            registry.register(Counter("requests", "Requests."))
+
+    def test_timed_handler(self):
+        # arrange
+        @timed_handler
+        async def metrics_test_handler(update, context):
+            return 3
+
+        # act
+        result = asyncio.run(metrics_test_handler(None, None))
+
+        # assert
+        self.assertEqual(result, 3)
+        self.assertEqual(HANDLER_SECONDS.count(handler="metrics_test_handler"), 1)
+
+    def test_measure_request(self):
+        # arrange
+        before_ok = SHEETS_REQUESTS.get(operation="metrics_test", outcome="ok")
+        before_429 = SHEETS_REQUESTS.get(operation="metrics_test", outcome="429")
+        failing = MagicMock(side_effect=APIError(FakeResponse(429, "Quota exceeded")))
+
+        # act
+        result = measure_request(lambda: 5, "metrics_test")
+        with self.assertRaises(APIError):
+            measure_request(failing, "metrics_test")
+
+        # assert
+        self.assertEqual(result, 5)
+        self.assertEqual(
+            SHEETS_REQUESTS.get(operation="metrics_test", outcome="ok"), before_ok + 1
+        )
+        self.assertEqual(
+            SHEETS_REQUESTS.get(operation="metrics_test", outcome="429"),
+            before_429 + 1,
+        )
+
+    def test_server(self):
+        # arrange
+        registry = Registry()
+        registry.register(Counter("requests", "Requests.")).inc()
+        server = start_metrics_server(0, registry=registry)
+        url = "http://%s:%d" % server.server_address
+
+        # act
+        try:
+            with urllib.request.urlopen(url + "/metrics") as response:
+                body = response.read().decode()
+            with self.assertRaises(urllib.error.HTTPError) as not_found:
+                urllib.request.urlopen(url + "/other")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # assert
+        self.assertIn("requests_total 1.0\n", body)
+        self.assertEqual(not_found.exception.code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
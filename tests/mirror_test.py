@@ -0,0 +1,253 @@
+import unittest
+from unittest.mock import MagicMock
+import os
+import sys
+import numpy
+import pandas
+import datetime
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from budgeter.mirror import SpendingMirror, sync_mirrors, sync_batch_size
+from budgeter.spreadsheet import Spreadsheet, open_spreadsheet
+from budgeter.cache import SpreadsheetCache
+from budgeter.fakesheets import FakeClient
+
+URL = "https://docs.google.com/spreadsheets/d/abc123/edit"
+
+
+def make_dataframe(days: int):
+    dframe = pandas.DataFrame(
+        {
+            "Date": pandas.date_range("2021-01-01", periods=days, freq="D"),
+            "Spend": numpy.arange(days, dtype=float),
+        }
+    )
+    return dframe
+
+
+def make_client(data):
+    mock_worksheet = MagicMock()
+    mock_worksheet.get_values = MagicMock(return_value=data)
+    mock_spreadsheet = MagicMock()
+    mock_spreadsheet.sheet1 = mock_worksheet
+    mock_client = MagicMock()
+    mock_client.open_by_url = MagicMock(return_value=mock_spreadsheet)
+    return mock_client, mock_worksheet
+
+
+class FakeContext:
+    def __init__(self, bot_data):
+        self.bot_data = bot_data
+
+
+class TestSpendingMirror(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.directory.name, "spending_mirror.sqlite3")
+        self.mirror = SpendingMirror(self.filepath)
+
+    def tearDown(self):
+        self.mirror.close()
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        # arrange
+        dframe = make_dataframe(10)
+        dframe.loc[3, "Spend"] = numpy.nan
+
+        # act
+        self.mirror.set_dataframe("id", "url", dframe)
+        self.mirror.close()
+        actual = SpendingMirror(self.filepath).get_dataframe("id")
+
+        # assert
+        pandas.testing.assert_frame_equal(actual, dframe)
+        self.assertIsNone(self.mirror.get_dataframe("other id"))
+
+    def test_incremental(self):
+        # arrange
+        self.mirror.set_dataframe("id", "url", make_dataframe(10))
+        full_synced_at = self.mirror.get_full_synced_at("id")
+
+        # act
+        self.mirror.set_dataframe("id", "url", make_dataframe(15), full_read=False)
+        self.mirror.append_rows("id", [(datetime.datetime(2021, 1, 16), 1.5)])
+
+        # assert
+        actual = self.mirror.get_dataframe("id")
+        self.assertEqual(len(actual), 16)
+        self.assertEqual(actual["Spend"].iloc[-1], 1.5)
+        self.assertEqual(self.mirror.get_full_synced_at("id"), full_synced_at)
+
+    def test_get_stale(self):
+        self.mirror.set_dataframe("id1", "url1", make_dataframe(1))
+        self.mirror.set_dataframe("id2", "url2", make_dataframe(1))
+        self.mirror.mark_synced("id1")
+        self.assertEqual(self.mirror.get_stale(-60), ["url2", "url1"])
+        self.assertEqual(self.mirror.get_stale(60), [])
+
+    def test_sync_batch_size(self):
+        # every spreadsheet every 15 minutes
+        self.assertEqual(sync_batch_size(0), 0)
+        self.assertEqual(sync_batch_size(100), 7)
+        self.assertEqual(sync_batch_size(10000), 667)
+        # but at most half the read quota
+        self.assertEqual(sync_batch_size(100, reads_per_minute=50), 7)
+        self.assertEqual(sync_batch_size(10000, reads_per_minute=50), 8)
+        self.assertEqual(sync_batch_size(10000, reads_per_minute=1), 1)
+
+    def test_len(self):
+        self.mirror.set_dataframe("id1", "url1", make_dataframe(1))
+        self.mirror.set_dataframe("id2", "url2", make_dataframe(1))
+        self.assertEqual(len(self.mirror), 2)
+
+    def test_invalidate(self):
+        self.mirror.set_dataframe("id", "url", make_dataframe(5))
+        self.mirror.invalidate("id")
+        self.assertIsNone(self.mirror.get_dataframe("id"))
+
+
+class TestSpreadsheetMirror(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.mirror = SpendingMirror(
+            os.path.join(self.directory.name, "spending_mirror.sqlite3")
+        )
+        self.data = [
+            ["Date", "Spend"],
+            ["01/01/2021", 10.0],
+            ["02/01/2021", 20.0],
+        ]
+
+    def tearDown(self):
+        self.mirror.close()
+        self.directory.cleanup()
+
+    def test_serves_from_mirror(self):
+        # arrange
+        mock_client, mock_worksheet = make_client(self.data)
+        Spreadsheet(mock_client, "url", mirror=self.mirror).get_spending_dataframe()
+
+        # act: Google Sheets is down
+        mock_worksheet.get_values = MagicMock(side_effect=Exception("API error"))
+        dframe = Spreadsheet(
+            mock_client, "url", mirror=self.mirror
+        ).get_spending_dataframe()
+
+        # assert
+        self.assertEqual(list(dframe["Spend"]), [10.0, 20.0])
+
+    def test_reads_new_rows_of_old_copy(self):
+        # arrange: the copy has not been synced for a while
+        mock_client, mock_worksheet = make_client(self.data)
+        Spreadsheet(mock_client, "url", mirror=self.mirror).get_spending_dataframe()
+        with self.mirror._lock:
+            self.mirror.connection.execute("UPDATE spreadsheets SET synced_at = 0")
+        mock_worksheet.get_values = MagicMock(return_value=[["03/01/2021", 30.0]])
+
+        # act
+        dframe = Spreadsheet(
+            mock_client, "url", mirror=self.mirror
+        ).get_spending_dataframe()
+
+        # assert
+        self.assertEqual(mock_worksheet.get_values.call_args[0][0], "A4:B")
+        self.assertEqual(list(dframe["Spend"]), [10.0, 20.0, 30.0])
+
+    def test_serves_old_copy_when_sheets_is_down(self):
+        # arrange
+        mock_client, mock_worksheet = make_client(self.data)
+        Spreadsheet(mock_client, "url", mirror=self.mirror).get_spending_dataframe()
+        with self.mirror._lock:
+            self.mirror.connection.execute("UPDATE spreadsheets SET synced_at = 0")
+        mock_worksheet.get_values = MagicMock(side_effect=Exception("API error"))
+
+        # act
+        dframe = Spreadsheet(
+            mock_client, "url", mirror=self.mirror
+        ).get_spending_dataframe()
+
+        # assert
+        self.assertEqual(list(dframe["Spend"]), [10.0, 20.0])
+
+    def test_sync_reads_only_new_rows(self):
+        # arrange
+        mock_client, mock_worksheet = make_client(self.data)
+        spreadsheet = Spreadsheet(mock_client, "url", mirror=self.mirror)
+        spreadsheet.get_spending_dataframe()
+        mock_worksheet.get_values = MagicMock(return_value=[["03/01/2021", 30.0]])
+
+        # act
+        spreadsheet.sync()
+
+        # assert
+        mock_worksheet.get_values.assert_called_once()
+        self.assertEqual(mock_worksheet.get_values.call_args[0][0], "A4:B")
+        dframe = spreadsheet.get_spending_dataframe()
+        self.assertEqual(list(dframe["Spend"]), [10.0, 20.0, 30.0])
+
+    def test_add_data_checks_sheet_not_mirror(self):
+        # arrange: copied to the mirror, then the 3rd added by hand
+        client = FakeClient()
+        sheet = client.create("abc123", self.data)._sheet1
+        Spreadsheet(client, URL, mirror=self.mirror).get_spending_dataframe()
+        sheet.append_rows([["03/01/2021", 30.0]], table_range="A:B")
+        spreadsheet = Spreadsheet(client, URL, SpreadsheetCache(), mirror=self.mirror)
+
+        # act
+        spreadsheet.get_spending_dataframe()
+        data_added, why_not = spreadsheet.add_data(datetime.datetime(2021, 1, 3), 5.0)
+
+        # assert
+        self.assertFalse(data_added)
+        self.assertIn("duplicate", why_not)
+        valid, _ = Spreadsheet.verify_format(sheet.get_all_values())
+        self.assertTrue(valid)
+
+    def test_add_data_after_rows_added_by_hand(self):
+        # arrange: copied to the mirror, then the 3rd added by hand
+        client = FakeClient()
+        sheet = client.create("abc123", self.data)._sheet1
+        Spreadsheet(client, URL, mirror=self.mirror).get_spending_dataframe()
+        sheet.append_rows([["03/01/2021", 30.0]], table_range="A:B")
+        spreadsheet = Spreadsheet(client, URL, SpreadsheetCache(), mirror=self.mirror)
+        spreadsheet.get_spending_dataframe()
+
+        # act
+        data_added, why_not = spreadsheet.add_data(datetime.datetime(2021, 1, 4), 40.0)
+
+        # assert: the copies are not appended to out of step, and the mirror is synced first
+        self.assertTrue(data_added, why_not)
+        self.assertEqual(self.mirror.get_stale(0), [URL])
+        self.assertIsNone(spreadsheet.get_cached_dataframe())
+        dframe = spreadsheet.sync()
+        self.assertEqual(list(dframe["Spend"]), [10.0, 20.0, 30.0, 40.0])
+        self.assertEqual(
+            list(self.mirror.get_dataframe("abc123")["Spend"]), [10.0, 20.0, 30.0, 40.0]
+        )
+
+    async def test_sync_mirrors(self):
+        # arrange
+        mock_client, mock_worksheet = make_client(self.data)
+        bot_data = {"spreadsheet_client": mock_client, "spending_mirror": self.mirror}
+        await open_spreadsheet(bot_data, "url").get_spending_dataframe()
+        mock_worksheet.get_values = MagicMock(return_value=[["03/01/2021", 30.0]])
+
+        # act: nothing is due yet
+        await sync_mirrors(FakeContext(bot_data))
+
+        # assert
+        mock_worksheet.get_values.assert_not_called()
+
+        # act
+        with self.mirror._lock:
+            self.mirror.connection.execute("UPDATE spreadsheets SET synced_at = 0")
+        await sync_mirrors(FakeContext(bot_data))
+
+        # assert
+        self.assertEqual(len(self.mirror.get_dataframe("url")), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
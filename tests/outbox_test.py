@@ -0,0 +1,198 @@
+import unittest
+from unittest.mock import MagicMock, AsyncMock
+import os
+import sys
+import datetime
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from budgeter.outbox import SpendOutbox, flush_outbox, MAX_ATTEMPTS
+from budgeter.cache import SpreadsheetCache
+
+JAN = [datetime.datetime(2021, 1, day) for day in range(1, 32)]
+
+
+def make_client(rows):
+    mock_worksheet = MagicMock()
+    mock_worksheet.get_values = MagicMock(
+        side_effect=lambda range, **kwargs: (
+            [row[:1] for row in rows] if range == "A:A" else rows
+        )
+    )
+    mock_spreadsheet = MagicMock()
+    mock_spreadsheet.sheet1 = mock_worksheet
+    mock_client = MagicMock()
+    mock_client.open_by_url = MagicMock(return_value=mock_spreadsheet)
+    return mock_client, mock_worksheet
+
+
+class FakeContext:
+    def __init__(self, bot_data):
+        self.bot_data = bot_data
+        self.bot = MagicMock()
+        self.bot.send_message = AsyncMock()
+
+
+class TestSpendOutbox(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.directory.name, "spend_outbox.sqlite3")
+        self.outbox = SpendOutbox(self.filepath)
+
+    def tearDown(self):
+        self.outbox.close()
+        self.directory.cleanup()
+
+    def test_survives_restart(self):
+        # act
+        self.outbox.add(1, "url", [(JAN[0], 10.0), (JAN[1], 20.5)])
+        self.outbox.close()
+        pending = SpendOutbox(self.filepath).pending("url")
+
+        # assert
+        self.assertEqual(
+            [(date, spend) for _, date, spend in pending],
+            [(JAN[0], 10.0), (JAN[1], 20.5)],
+        )
+        self.assertEqual(SpendOutbox(self.filepath).pending("other url"), [])
+
+    def test_remove(self):
+        self.outbox.add(1, "url", [(JAN[0], 10.0), (JAN[1], 20.5)])
+        ids = [id for id, _, _ in self.outbox.pending("url")]
+        self.outbox.remove(ids[:1])
+        self.assertEqual(len(self.outbox), 1)
+        self.assertEqual(self.outbox.pending_spreadsheets(), [("url", 1)])
+
+    def test_record_failure_of_nothing(self):
+        self.assertFalse(self.outbox.record_failure([]))
+
+    def test_flush_again_if_spends_are_added(self):
+        # act
+        started = self.outbox.begin_flush()
+        self.outbox.add(1, "url", [(JAN[0], 10.0)])
+
+        # assert
+        self.assertTrue(started)
+        self.assertFalse(self.outbox.begin_flush())
+        self.assertTrue(self.outbox.flush_again())
+        self.assertFalse(self.outbox.flush_again())
+        self.outbox.end_flush()
+        self.assertTrue(self.outbox.begin_flush())
+
+    async def test_flush_writes_one_batch_per_spreadsheet(self):
+        # arrange
+        client, worksheet = make_client([["Date", "Spend"], ["01/01/2021", 5.0]])
+        self.outbox.add(1, "url", [(JAN[1], 10.0)])
+        self.outbox.add(1, "url", [(JAN[2], 20.0), (JAN[3], 30.0)])
+        context = FakeContext(
+            {"spreadsheet_client": client, "spend_outbox": self.outbox}
+        )
+
+        # act
+        await flush_outbox(context)
+
+        # assert
+        worksheet.append_rows.assert_called_once()
+        written = worksheet.append_rows.call_args[0][0]
+        self.assertEqual(
+            written, [["02/01/2021", 10.0], ["03/01/2021", 20.0], ["04/01/2021", 30.0]]
+        )
+        self.assertEqual(len(self.outbox), 0)
+
+    async def test_flush_does_not_write_twice(self):
+        # arrange: the first spend was written, but the bot stopped before forgetting it
+        client, worksheet = make_client(
+            [["Date", "Spend"], ["01/01/2021", 5.0], ["02/01/2021", 10.0]]
+        )
+        self.outbox.add(1, "url", [(JAN[1], 10.0), (JAN[2], 20.0)])
+        context = FakeContext(
+            {"spreadsheet_client": client, "spend_outbox": self.outbox}
+        )
+
+        # act
+        await flush_outbox(context)
+
+        # assert
+        self.assertEqual(worksheet.append_rows.call_args[0][0], [["03/01/2021", 20.0]])
+        self.assertEqual(len(self.outbox), 0)
+        context.bot.send_message.assert_not_called()
+
+    async def test_flush_tells_user_about_spends_it_cannot_add(self):
+        # arrange: a later day was added by hand, and the 2nd has a different spend
+        client, worksheet = make_client(
+            [
+                ["Date", "Spend"],
+                ["01/01/2021", 5.0],
+                ["02/01/2021", 7.0],
+                ["04/01/2021", 8.0],
+            ]
+        )
+        self.outbox.add(1, "url", [(JAN[1], 10.0), (JAN[2], 20.0), (JAN[4], 30.0)])
+        context = FakeContext(
+            {"spreadsheet_client": client, "spend_outbox": self.outbox}
+        )
+
+        # act
+        await flush_outbox(context)
+
+        # assert
+        self.assertEqual(worksheet.append_rows.call_args[0][0], [["05/01/2021", 30.0]])
+        self.assertEqual(len(self.outbox), 0)
+        context.bot.send_message.assert_called_once()
+        self.assertIn(
+            "02/01/2021, 03/01/2021", context.bot.send_message.call_args.kwargs["text"]
+        )
+
+    async def test_flush_does_not_trust_cached_tail(self):
+        # arrange: the 2nd was added by hand after the spreadsheet was cached
+        rows = [["Date", "Spend"], ["01/01/2021", 5.0]]
+        client, worksheet = make_client(rows)
+        cache = SpreadsheetCache()
+        cache.set_tail("url", JAN[0], 2)
+        rows.append(["02/01/2021", 7.0])
+        self.outbox.add(1, "url", [(JAN[1], 10.0), (JAN[2], 20.0)])
+        context = FakeContext(
+            {
+                "spreadsheet_client": client,
+                "spend_outbox": self.outbox,
+                "spreadsheet_cache": cache,
+            }
+        )
+
+        # act
+        await flush_outbox(context)
+
+        # assert
+        self.assertEqual(worksheet.append_rows.call_args[0][0], [["03/01/2021", 20.0]])
+        context.bot.send_message.assert_called_once()
+
+    async def test_flush_keeps_spends_that_fail(self):
+        # arrange
+        client, worksheet = make_client([["Date", "Spend"], ["01/01/2021", 5.0]])
+        worksheet.append_rows = MagicMock(
+            side_effect=Exception("Google Sheets is down")
+        )
+        self.outbox.add(1, "url", [(JAN[1], 10.0)])
+        context = FakeContext(
+            {"spreadsheet_client": client, "spend_outbox": self.outbox}
+        )
+
+        # act
+        await flush_outbox(context)
+
+        # assert
+        self.assertEqual(len(self.outbox), 1)
+        context.bot.send_message.assert_not_called()
+
+        # act: it keeps failing
+        for _ in range(MAX_ATTEMPTS - 1):
+            await flush_outbox(context)
+
+        # assert: the user is told
+        self.assertEqual(len(self.outbox), 0)
+        context.bot.send_message.assert_called_once()
+        self.assertEqual(context.bot.send_message.call_args.kwargs["chat_id"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import os
+import sys
+import datetime
+import tempfile
+from telegram.ext import PicklePersistence, PersistenceInput
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from budgeter.persistence import SQLitePersistence
+
+
+class TestSQLitePersistence(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.directory.name, "bot_data.sqlite3")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def test_user_data_round_trip(self):
+        # arrange
+        persistence = SQLitePersistence(self.filepath)
+
+        # act
+        await persistence.update_user_data(
+            1, {"spreadsheet_url": "url", "reminders": True}
+        )
+        await persistence.flush()
+        user_data = await SQLitePersistence(self.filepath).get_user_data()
+
+        # assert
+        self.assertEqual(user_data, {1: {"spreadsheet_url": "url", "reminders": True}})
+
+    async def test_transient_keys_not_saved(self):
+        # arrange
+        persistence = SQLitePersistence(self.filepath)
+
+        # act
+        await persistence.update_user_data(
+            1, {"spreadsheet_url": "url", "date": datetime.datetime(2021, 1, 1)}
+        )
+        user_data = await persistence.get_user_data()
+
+        # assert
+        self.assertEqual(user_data, {1: {"spreadsheet_url": "url"}})
+
+    async def test_unchanged_user_not_written(self):
+        # arrange
+        persistence = SQLitePersistence(self.filepath)
+        await persistence.update_user_data(1, {"spreadsheet_url": "url"})
+        changes = persistence.connection.total_changes
+
+        # act
+        await persistence.update_user_data(1, {"spreadsheet_url": "url"})
+        await persistence.update_user_data(2, {"spreadsheet_url": "other url"})
+
+        # assert
+        self.assertEqual(persistence.connection.total_changes, changes + 1)
+
+    async def test_drop_user_data(self):
+        # arrange
+        persistence = SQLitePersistence(self.filepath)
+        await persistence.update_user_data(1, {"spreadsheet_url": "url"})
+
+        # act
+        await persistence.drop_user_data(1)
+
+        # assert
+        self.assertEqual(await persistence.get_user_data(), {})
+
+    async def test_migrate_from_pickle(self):
+        # arrange
+        pickle_path = os.path.join(self.directory.name, "bot_data.pickle")
+        pickle_persistence = PicklePersistence(
+            filepath=pickle_path,
+            store_data=PersistenceInput(bot_data=False),
+            on_flush=True,
+        )
+        await pickle_persistence.update_user_data(
+            1, {"spreadsheet_url": "url", "reminders": True}
+        )
+        await pickle_persistence.flush()
+
+        # act
+        persistence = SQLitePersistence(self.filepath, migrate_from=pickle_path)
+        user_data = await persistence.get_user_data()
+        # the migration only happens once
+        await persistence.drop_user_data(1)
+        await persistence.flush()
+        user_data_after = await SQLitePersistence(
+            self.filepath, migrate_from=pickle_path
+        ).get_user_data()
+
+        # assert
+        self.assertEqual(user_data, {1: {"spreadsheet_url": "url", "reminders": True}})
+        self.assertEqual(user_data_after, {})
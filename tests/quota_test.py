@@ -0,0 +1,195 @@
+import unittest
+from unittest.mock import MagicMock
+import os
+import sys
+import time
+import asyncio
+import datetime
+import threading
+import concurrent.futures
+from gspread.exceptions import APIError
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from budgeter.quota import QuotaManager, QuotaTimeout, READ, WRITE
+from budgeter.tracing import run_in_context
+from budgeter.spreadsheet import Spreadsheet
+
+
+def api_error(status_code: int):
+    response = MagicMock()
+    response.status_code = status_code
+    response.json = MagicMock(
+        return_value={"error": {"code": status_code, "message": "Error"}}
+    )
+    return APIError(response)
+
+
+class TestQuotaManager(unittest.TestCase):
+    def test_burst_then_rate(self):
+        quota = QuotaManager(reads_per_minute=600, burst=5)
+        start = time.monotonic()
+        for _ in range(5):
+            quota.acquire(READ)
+        self.assertLess(time.monotonic() - start, 0.05)
+        # 10 per second after the burst
+        for _ in range(3):
+            quota.acquire(READ)
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+    def test_reads_and_writes_are_separate(self):
+        quota = QuotaManager(reads_per_minute=60, writes_per_minute=60, burst=1)
+        quota.acquire(READ)
+        start = time.monotonic()
+        quota.acquire(WRITE)
+        self.assertLess(time.monotonic() - start, 0.05)
+
+    def test_reads_are_not_held_up_by_writes(self):
+        quota = QuotaManager(
+            reads_per_minute=60, writes_per_minute=6, burst=1, timeout=0.5
+        )
+        quota.acquire(WRITE)
+
+        def write():
+            # waits for write quota, which there is none of for 10s
+            with self.assertRaises(QuotaTimeout):
+                quota.acquire(WRITE)
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        time.sleep(0.05)
+        start = time.monotonic()
+        quota.acquire(READ)
+        self.assertLess(time.monotonic() - start, 0.05)
+        thread.join()
+
+    def test_timeout(self):
+        quota = QuotaManager(reads_per_minute=1, burst=1, timeout=0.1)
+        quota.acquire(READ)
+        with self.assertRaises(QuotaTimeout):
+            quota.acquire(READ)
+
+    def test_retries_after_quota_exceeded(self):
+        quota = QuotaManager(base_backoff=0.01)
+        operation = MagicMock(side_effect=[api_error(429), api_error(503), "result"])
+        self.assertEqual(quota.call(operation), "result")
+        self.assertEqual(operation.call_count, 3)
+
+    def test_gives_up_after_max_retries(self):
+        quota = QuotaManager(base_backoff=0.01, max_retries=2)
+        operation = MagicMock(side_effect=api_error(429))
+        with self.assertRaises(APIError):
+            quota.call(operation)
+        self.assertEqual(operation.call_count, 3)
+
+    def test_does_not_retry_other_errors(self):
+        quota = QuotaManager(base_backoff=0.01)
+        operation = MagicMock(side_effect=api_error(403))
+        with self.assertRaises(APIError):
+            quota.call(operation)
+        operation.assert_called_once()
+
+    def test_pressure(self):
+        quota = QuotaManager(reads_per_minute=60, burst=4)
+        self.assertEqual(quota.pressure(), 0)
+        quota.acquire(READ)
+        quota.acquire(READ)
+        self.assertAlmostEqual(quota.pressure(), 0.5, places=2)
+        # backing off
+        quota._paused_until = time.monotonic() + 10
+        self.assertEqual(quota.pressure(), 1)
+
+
+class TestRunDeferring(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.executor.shutdown)
+
+    def run_on_thread(self, function):
+        loop = asyncio.get_running_loop()
+        return lambda: loop.run_in_executor(self.executor, run_in_context(function))
+
+    async def test_waits_off_the_thread(self):
+        # arrange
+        quota = QuotaManager(reads_per_minute=60, burst=1)
+        quota.acquire(READ)
+        operation = MagicMock(return_value="result")
+
+        # act
+        waiting = asyncio.create_task(
+            quota.run_deferring(self.run_on_thread(lambda: quota.call(operation)))
+        )
+        await asyncio.sleep(0.05)
+        start = time.monotonic()
+        # the only thread is free while the read waits for quota
+        await self.run_on_thread(lambda: None)()
+        free_after = time.monotonic() - start
+        result = await waiting
+
+        # assert
+        self.assertLess(free_after, 0.1)
+        self.assertEqual(result, "result")
+        operation.assert_called_once()
+
+    async def test_unused_quota_is_given_back(self):
+        # arrange
+        quota = QuotaManager(reads_per_minute=600, burst=1)
+        quota.acquire(READ)
+        cached = []
+
+        def get_data_cached_later():
+            if not cached:
+                # e.g., another user's call reads the data while this one waits for quota
+                cached.append("data")
+                quota.call(lambda: "data")
+            return cached[0]
+
+        # act
+        result = await quota.run_deferring(self.run_on_thread(get_data_cached_later))
+
+        # assert
+        self.assertEqual(result, "data")
+        self.assertGreaterEqual(quota._buckets[READ].available(), 0.99)
+
+    async def test_writes_are_not_made_again(self):
+        # arrange
+        quota = QuotaManager(reads_per_minute=600, burst=1)
+        quota.acquire(READ)
+        write = MagicMock()
+
+        def write_then_read():
+            quota.call(write, WRITE)
+            return quota.call(lambda: "read")
+
+        # act
+        result = await quota.run_deferring(self.run_on_thread(write_then_read))
+
+        # assert
+        self.assertEqual(result, "read")
+        write.assert_called_once()
+
+
+class TestSpreadsheetQuota(unittest.TestCase):
+    def test_add_data_retries_after_quota_exceeded(self):
+        # arrange
+        mock_worksheet = MagicMock()
+        mock_worksheet.get_values = MagicMock(
+            side_effect=[api_error(429), [["Date"], ["01/01/2021"]]]
+        )
+        mock_worksheet.append_rows = MagicMock(side_effect=[api_error(429), None])
+        mock_spreadsheet = MagicMock()
+        mock_spreadsheet.sheet1 = mock_worksheet
+        mock_client = MagicMock()
+        mock_client.open_by_url = MagicMock(return_value=mock_spreadsheet)
+        quota = QuotaManager(base_backoff=0.01)
+        spreadsheet = Spreadsheet(mock_client, "bogus url", quota=quota)
+
+        # act
+        success, message = spreadsheet.add_data(datetime.datetime(2021, 1, 2), 10)
+
+        # assert
+        self.assertTrue(success, message)
+        self.assertEqual(mock_worksheet.append_rows.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
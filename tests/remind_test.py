@@ -0,0 +1,345 @@
+import unittest
+import asyncio
+import os
+import sys
+import time
+import datetime
+import tempfile
+import pandas
+from unittest.mock import MagicMock
+from telegram.error import RetryAfter, Forbidden
+from telegram.ext import PersistenceInput
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from budgeter.ratelimit import TokenBucket
+from budgeter.mirror import SpendingMirror
+from budgeter.remind import (
+    ReminderSchedule,
+    is_up_to_date,
+    jobname,
+    parse_time,
+    send_reminders,
+    utc_bucket,
+)
+
+
+class FakeBot:
+    def __init__(self, fail=None):
+        # user id -> exceptions to raise, in order, before sending succeeds
+        self.fail = fail or {}
+        self.sent = []
+        self.sent_at = []
+
+    async def send_message(self, chat_id, text):
+        errors = self.fail.get(chat_id)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append(chat_id)
+        self.sent_at.append(time.monotonic())
+
+
+class FakeJob:
+    def __init__(self, callback, time, name, data):
+        self.callback = callback
+        self.time = time
+        self.name = name
+        self.data = data
+        self.removed = False
+
+    def schedule_removal(self):
+        self.removed = True
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_daily(self, callback, time, name, data):
+        job = FakeJob(callback, time, name, data)
+        self.jobs.append(job)
+        return job
+
+    def get_jobs_by_name(self, name):
+        return [job for job in self.jobs if job.name == name and not job.removed]
+
+    def active(self):
+        return sorted(job.name for job in self.jobs if not job.removed)
+
+
+class FakePersistence:
+    def __init__(self):
+        self.store_data = PersistenceInput()
+        self.saved = {}
+
+    async def update_user_data(self, user_id, data):
+        self.saved[user_id] = dict(data)
+
+
+class FakeApplication:
+    def __init__(self, user_data):
+        self.user_data = user_data
+        self.persistence = FakePersistence()
+
+
+class FakeContext:
+    def __init__(self, bot, job, user_data, bot_data=None):
+        self.bot = bot
+        self.job = job
+        self.bot_data = bot_data or {}
+        self.application = FakeApplication(user_data)
+
+
+def make_client(column_a):
+    """A gspread client whose spreadsheets all have `column_a` in column A."""
+    mock_worksheet = MagicMock()
+    mock_worksheet.get_values = MagicMock(return_value=column_a)
+    mock_spreadsheet = MagicMock()
+    mock_spreadsheet.sheet1 = mock_worksheet
+    mock_client = MagicMock()
+    mock_client.open_by_url = MagicMock(return_value=mock_spreadsheet)
+    return mock_client, mock_worksheet
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertGreater(bucket.try_acquire(), 0)
+
+    def test_acquire_rate(self):
+        bucket = TokenBucket(rate=100, capacity=1)
+
+        async def acquire_all():
+            for _ in range(21):
+                await bucket.acquire()
+
+        start = time.monotonic()
+        asyncio.run(acquire_all())
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_pause(self):
+        bucket = TokenBucket(rate=1000)
+        bucket.pause(0.05)
+        self.assertGreater(bucket.try_acquire(), 0)
+        time.sleep(0.06)
+        self.assertEqual(bucket.try_acquire(), 0)
+
+
+class TestSendReminders(unittest.TestCase):
+    def test_sends_to_everyone(self):
+        bot = FakeBot()
+        users = list(range(100))
+        results = asyncio.run(
+            send_reminders(bot, users, window=0, messages_per_second=10000)
+        )
+        self.assertEqual(sorted(bot.sent), users)
+        self.assertEqual(sorted(results["sent"]), users)
+
+    def test_rate_limit(self):
+        bot = FakeBot()
+        # a burst of 10, then 10 per second
+        asyncio.run(send_reminders(bot, range(30), window=0, messages_per_second=10))
+        self.assertGreaterEqual(bot.sent_at[-1] - bot.sent_at[0], 1.9)
+
+    def test_spread_over_window(self):
+        bot = FakeBot()
+        asyncio.run(
+            send_reminders(bot, range(10), window=0.5, messages_per_second=10000)
+        )
+        self.assertGreaterEqual(bot.sent_at[-1] - bot.sent_at[0], 0.4)
+
+    def test_check_before_each_reminder(self):
+        # arrange: checking user 0 takes a while
+        bot = FakeBot()
+        checked = []
+
+        async def check(user):
+            if user == 0:
+                await asyncio.sleep(0.2)
+            checked.append(user)
+            return user % 2 == 0
+
+        # act
+        results = asyncio.run(
+            send_reminders(
+                bot, range(6), window=0, messages_per_second=10000, check=check
+            )
+        )
+
+        # assert: the others are reminded without waiting for it
+        self.assertEqual(sorted(results["sent"]), [0, 2, 4])
+        self.assertEqual(sorted(results["up_to_date"]), [1, 3, 5])
+        self.assertEqual(bot.sent[-1], 0)
+
+    def test_retry_after(self):
+        bot = FakeBot(fail={1: [RetryAfter(0)], 2: [Forbidden("blocked")]})
+        results = asyncio.run(
+            send_reminders(bot, [1, 2, 3], window=0, messages_per_second=10000)
+        )
+        self.assertEqual(sorted(results["sent"]), [1, 3])
+        self.assertEqual(results["blocked"], [2])
+
+
+class TestReminderTimes(unittest.TestCase):
+    def test_parse_time(self):
+        self.assertEqual(parse_time("9"), "09:00")
+        self.assertEqual(parse_time("9am"), "09:00")
+        self.assertEqual(parse_time("9:30 PM"), "21:30")
+        self.assertEqual(parse_time("12am"), "00:00")
+        self.assertEqual(parse_time("12pm"), "12:00")
+        self.assertEqual(parse_time("21:30"), "21:30")
+        self.assertEqual(parse_time("7.05"), "07:05")
+        self.assertIsNone(parse_time("25:00"))
+        self.assertIsNone(parse_time("13pm"))
+        self.assertIsNone(parse_time("soon"))
+
+    def test_utc_bucket_follows_clock_changes(self):
+        winter = datetime.date(2023, 1, 10)
+        summer = datetime.date(2023, 7, 10)
+        self.assertEqual(utc_bucket("09:00", "Europe/London", winter), "09:00")
+        self.assertEqual(utc_bucket("09:00", "Europe/London", summer), "08:00")
+        self.assertEqual(utc_bucket("21:30", "Asia/Kolkata", summer), "16:00")
+
+
+class TestReminderSchedule(unittest.TestCase):
+    def setUp(self):
+        self.job_queue = FakeJobQueue()
+        self.schedule = ReminderSchedule(self.job_queue, window=0)
+        self.winter = datetime.date(2023, 1, 10)
+
+    def test_one_job_per_time(self):
+        for user in range(100):
+            self.schedule.add(user, "09:00", "Europe/London", self.winter)
+        for user in range(100, 150):
+            self.schedule.add(user, "10:00", "Europe/Paris", self.winter)
+        self.assertEqual(self.schedule.buckets, ["09:00"])
+        self.assertEqual(self.job_queue.active(), [jobname("09:00")])
+        self.assertEqual(len(self.schedule.users_at("09:00")), 150)
+        self.schedule.add(0, "07:15", "UTC", self.winter)
+        self.assertEqual(self.schedule.buckets, ["07:15", "09:00"])
+        self.assertEqual(len(self.job_queue.active()), 2)
+
+    def test_remove(self):
+        self.schedule.add(1, "09:00", "UTC", self.winter)
+        self.schedule.add(2, "09:00", "UTC", self.winter)
+        self.schedule.remove(1)
+        self.assertEqual(self.job_queue.active(), [jobname("09:00")])
+        self.schedule.remove(2)
+        self.schedule.remove(3)
+        self.assertEqual(self.job_queue.active(), [])
+        self.assertEqual(len(self.schedule), 0)
+
+    def test_restore(self):
+        self.schedule.restore(
+            {
+                1: {"spreadsheet_url": "url", "reminders": True},
+                2: {"spreadsheet_url": "url", "reminders": False},
+                3: {"reminders": True},
+                4: {
+                    "spreadsheet_url": "url",
+                    "reminders": True,
+                    "reminder_time": "20:00",
+                    "timezone": "UTC",
+                },
+            }
+        )
+        self.assertEqual(self.schedule.users_at("09:00"), {1})
+        self.assertEqual(self.schedule.users_at("20:00"), {4})
+
+    def test_remind_bucket(self):
+        self.schedule.add(1, "09:00", "UTC", self.winter)
+        self.schedule.add(2, "09:00", "UTC", self.winter)
+        bot = FakeBot(fail={2: [Forbidden("blocked")]})
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        user_data = {
+            1: {"reminders": True, "last_logged_date": yesterday},
+            2: {"reminders": True, "last_logged_date": yesterday},
+        }
+        # everyone is up to date, so no one is reminded
+        job = self.job_queue.get_jobs_by_name(jobname("09:00"))[0]
+        asyncio.run(job.callback(FakeContext(FakeBot(), job, user_data)))
+        self.schedule._reminded_at.clear()
+        for data in user_data.values():
+            data["last_logged_date"] -= datetime.timedelta(days=1)
+        job = self.job_queue.get_jobs_by_name(jobname("09:00"))[0]
+        context = FakeContext(bot, job, user_data)
+        asyncio.run(job.callback(context))
+        self.assertEqual(bot.sent, [1])
+        self.assertFalse(user_data[2]["reminders"])
+        # saved now, as the user may never use the bot again
+        self.assertFalse(context.application.persistence.saved[2]["reminders"])
+        self.assertEqual(self.schedule.users_at("09:00"), {1})
+        # not reminded twice in a row, e.g., when the clocks change
+        asyncio.run(job.callback(context))
+        self.assertEqual(bot.sent, [1])
+
+    def test_remind_bucket_reads_stale_spreadsheets(self):
+        today = datetime.date.today()
+        for user in [1, 2, 3]:
+            self.schedule.add(user, "09:00", "UTC", self.winter)
+        user_data = {
+            # the bot thinks they are up to date
+            1: {"last_logged_date": today - datetime.timedelta(days=1)},
+            # the bot does not know
+            2: {},
+            # the bot thinks they have missed a day
+            3: {"last_logged_date": today - datetime.timedelta(days=3)},
+        }
+        for data in user_data.values():
+            data.update({"reminders": True, "spreadsheet_url": "url"})
+        # but they have all filled in yesterday by hand
+        yesterday = (today - datetime.timedelta(days=1)).strftime("%d/%m/%Y")
+        client, worksheet = make_client([["Date"], [yesterday]])
+        bot = FakeBot()
+        job = self.job_queue.get_jobs_by_name(jobname("09:00"))[0]
+        context = FakeContext(bot, job, user_data, {"spreadsheet_client": client})
+        asyncio.run(job.callback(context))
+        self.assertEqual(bot.sent, [])
+        # only the spreadsheets the bot was unsure about were read
+        self.assertEqual(worksheet.get_values.call_count, 2)
+        self.assertTrue(is_up_to_date(user_data[3]))
+        self.assertEqual(set(context.application.persistence.saved), {2, 3})
+
+    def test_remind_bucket_uses_recent_copy(self):
+        # arrange: the local copy was synced just now, and is missing yesterday
+        today = datetime.date.today()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        mirror = SpendingMirror(os.path.join(directory.name, "mirror.sqlite3"))
+        self.addCleanup(mirror.close)
+        mirror.set_dataframe(
+            "url",
+            "url",
+            pandas.DataFrame(
+                {
+                    "Date": [pandas.Timestamp(today - datetime.timedelta(days=3))],
+                    "Spend": [1.0],
+                }
+            ),
+        )
+        self.schedule.add(1, "09:00", "UTC", self.winter)
+        user_data = {1: {"reminders": True, "spreadsheet_url": "url"}}
+        client, worksheet = make_client([["Date"]])
+        bot = FakeBot()
+        job = self.job_queue.get_jobs_by_name(jobname("09:00"))[0]
+        context = FakeContext(
+            bot,
+            job,
+            user_data,
+            {"spreadsheet_client": client, "spending_mirror": mirror},
+        )
+
+        # act
+        asyncio.run(job.callback(context))
+
+        # assert: reminded without reading Google Sheets
+        self.assertEqual(bot.sent, [1])
+        worksheet.get_values.assert_not_called()
+        self.assertEqual(
+            user_data[1]["last_logged_date"], today - datetime.timedelta(days=3)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,7 +7,7 @@ import datetime
 import numpy
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from budgeter.bothandlers.spend import get_first_day_without_data
+from budgeter.bothandlers.spend import get_first_day_without_data, with_pending_spends
 
 
 class TestGetFirstDayWithoutData(unittest.TestCase):
@@ -53,3 +53,28 @@ class TestGetFirstDayWithoutData(unittest.TestCase):
 
         # Assert
         self.assertEqual(expected, actual)
+
+
+class TestWithPendingSpends(unittest.TestCase):
+    def test_adds_queued_spends(self):
+        # Arrange
+        df = pandas.DataFrame(
+            {
+                "Date": pandas.to_datetime(["2021-01-01", "2021-01-02"]),
+                "Spend": [20.0, 15.0],
+            }
+        )
+        pending = [
+            # already written and cached
+            (1, datetime.datetime(2021, 1, 2), 15.0),
+            (2, datetime.datetime(2021, 1, 3), 5.0),
+        ]
+
+        # Act
+        actual = with_pending_spends(df, pending)
+
+        # Assert
+        self.assertEqual(list(actual["Spend"]), [20.0, 15.0, 5.0])
+        self.assertEqual(
+            get_first_day_without_data(actual), datetime.datetime(2021, 1, 4)
+        )
@@ -6,10 +6,14 @@ import sys
 import pandas
 import numpy
 import datetime
+import threading
+import concurrent.futures
 from gspread.client import Client
+from gspread.exceptions import APIError
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from budgeter.spreadsheet import Spreadsheet
+from budgeter.spreadsheet import Spreadsheet, AsyncSpreadsheet
+from budgeter.cache import SpreadsheetCache
 
 
 class TestSpreadsheet(unittest.TestCase):
@@ -149,3 +153,296 @@ class TestSpreadsheet(unittest.TestCase):
         ]
         valid, message = Spreadsheet.verify_format(data)
         self.assertTrue(valid, message)
+
+    def test_find_format_errors_reports_every_row(self):
+        data = [
+            ["Date", "Spend"],
+            ["01/01/2021", 10.00],
+            ["not a date", 20.00],
+            ["03/01/2021", "not a number"],
+            ["04/01/2021", 40.00],
+            ["04/01/2021", 40.00],
+            ["02/01/2021", 20.00],
+            ["not a date either", 20.00],
+        ]
+        errors = Spreadsheet.find_format_errors(data)
+        self.assertEqual(
+            sorted(row for row, _ in errors),
+            [3, 4, 6, 7, 8],
+        )
+
+    def test_verify_format_message_lists_rows(self):
+        data = [
+            ["Date", "Spend"],
+            ["01/01/2021", 10.00],
+            ["02/01/2021", "a"],
+            ["03/01/2021", "b"],
+        ]
+        valid, message = Spreadsheet.verify_format(data)
+        self.assertFalse(valid, message)
+        self.assertIn("rows 3, 4", message)
+
+
+class TestSpreadsheetCache(unittest.TestCase):
+    def make_client(self, data):
+        mock_worksheet = MagicMock()
+        mock_worksheet.get_values = MagicMock(return_value=data)
+        mock_spreadsheet = MagicMock()
+        mock_spreadsheet.sheet1 = mock_worksheet
+        mock_client = MagicMock()
+        mock_client.open_by_url = MagicMock(return_value=mock_spreadsheet)
+        return mock_client, mock_worksheet
+
+    def test_get_spending_dataframe_reads_once(self):
+        # arrange
+        data = [
+            ["Date", "Spend"],
+            ["01/01/2021", 10.00],
+            ["02/01/2021", 20.00],
+        ]
+        mock_client, mock_worksheet = self.make_client(data)
+        cache = SpreadsheetCache()
+        spreadsheet = Spreadsheet(mock_client, "bogus url", cache)
+
+        # act
+        first = spreadsheet.get_spending_dataframe()
+        second = spreadsheet.get_spending_dataframe()
+
+        # assert
+        self.assertEqual(mock_worksheet.get_values.call_count, 1)
+        pandas.testing.assert_frame_equal(first, second)
+
+    def test_add_data_updates_cache(self):
+        # arrange
+        data = [
+            ["Date", "Spend"],
+            ["01/01/2021", 10.00],
+            ["02/01/2021", 20.00],
+        ]
+        mock_client, mock_worksheet = self.make_client(data)
+        cache = SpreadsheetCache()
+        spreadsheet = Spreadsheet(mock_client, "bogus url", cache)
+
+        # act
+        spreadsheet.get_spending_dataframe()
+        added, _ = spreadsheet.add_data(datetime.datetime(2021, 1, 3), 30.00)
+        dframe = spreadsheet.get_spending_dataframe()
+
+        # assert
+        self.assertTrue(added)
+        self.assertEqual(mock_worksheet.get_values.call_count, 1)
+        self.assertEqual(len(dframe), 3)
+        self.assertEqual(dframe["Date"].max(), datetime.datetime(2021, 1, 3))
+        self.assertEqual(dframe["Spend"].sum(), 60.00)
+
+    def test_failed_add_data_invalidates_cache(self):
+        # arrange
+        data = [
+            ["Date", "Spend"],
+            ["01/01/2021", 10.00],
+        ]
+        mock_client, mock_worksheet = self.make_client(data)
+        mock_worksheet.append_rows = MagicMock(side_effect=Exception("API error"))
+        cache = SpreadsheetCache()
+        spreadsheet = Spreadsheet(mock_client, "bogus url", cache)
+
+        # act
+        added, _ = spreadsheet.add_data(datetime.datetime(2021, 1, 2), 20.00)
+        spreadsheet.get_spending_dataframe()
+
+        # assert
+        self.assertFalse(added)
+        self.assertEqual(mock_worksheet.get_values.call_count, 2)
+
+    def test_add_data_reads_only_column_a(self):
+        # arrange
+        column_a = [["Date"], ["01/01/2021"], ["02/01/2021"]]
+        mock_client, mock_worksheet = self.make_client(column_a)
+        cache = SpreadsheetCache()
+        spreadsheet = Spreadsheet(mock_client, "bogus url", cache)
+
+        # act
+        added, _ = spreadsheet.add_data(datetime.datetime(2021, 1, 3), 30.00)
+        duplicate, _ = spreadsheet.add_data(datetime.datetime(2021, 1, 3), 30.00)
+
+        # assert
+        self.assertTrue(added)
+        self.assertFalse(duplicate)
+        mock_worksheet.get_values.assert_called_once()
+        self.assertEqual(mock_worksheet.get_values.call_args.args, ("A:A",))
+        mock_worksheet.append_rows.assert_called_once()
+        self.assertEqual(
+            cache.get_tail(spreadsheet.spreadsheet_id),
+            (datetime.datetime(2021, 1, 3), 4),
+        )
+
+    def test_add_data_batch_single_request(self):
+        # arrange
+        column_a = [["Date"], ["01/01/2021"]]
+        mock_client, mock_worksheet = self.make_client(column_a)
+        cache = SpreadsheetCache()
+        spreadsheet = Spreadsheet(mock_client, "bogus url", cache)
+        rows = [
+            (datetime.datetime(2021, 1, 2), 20.00),
+            (datetime.datetime(2021, 1, 3), 30.00),
+            (datetime.datetime(2021, 1, 4), 40.00),
+        ]
+
+        # act
+        added, message = spreadsheet.add_data_batch(rows)
+
+        # assert
+        self.assertTrue(added, message)
+        mock_worksheet.append_rows.assert_called_once()
+        self.assertEqual(
+            mock_worksheet.append_rows.call_args.args[0],
+            [["02/01/2021", 20.00], ["03/01/2021", 30.00], ["04/01/2021", 40.00]],
+        )
+        self.assertEqual(
+            cache.get_tail(spreadsheet.spreadsheet_id),
+            (datetime.datetime(2021, 1, 4), 5),
+        )
+
+    def test_add_data_batch_not_ascending(self):
+        # arrange
+        column_a = [["Date"], ["01/01/2021"]]
+        mock_client, mock_worksheet = self.make_client(column_a)
+        spreadsheet = Spreadsheet(mock_client, "bogus url", SpreadsheetCache())
+        rows = [
+            (datetime.datetime(2021, 1, 3), 30.00),
+            (datetime.datetime(2021, 1, 2), 20.00),
+        ]
+
+        # act
+        added, message = spreadsheet.add_data_batch(rows)
+
+        # assert
+        self.assertFalse(added, message)
+        mock_worksheet.append_rows.assert_not_called()
+
+    def test_add_data_before_last_date(self):
+        # arrange
+        column_a = [["Date"], ["01/01/2021"], ["02/01/2021"]]
+        mock_client, mock_worksheet = self.make_client(column_a)
+        spreadsheet = Spreadsheet(mock_client, "bogus url", SpreadsheetCache())
+
+        # act
+        added, message = spreadsheet.add_data(datetime.datetime(2020, 12, 31), 30.00)
+
+        # assert
+        self.assertFalse(added, message)
+        mock_worksheet.append_rows.assert_not_called()
+
+    def test_expired_dataframe_reads_only_new_rows(self):
+        # arrange
+        data = [
+            ["Date", "Spend"],
+            ["01/01/2021", 10.00],
+            ["02/01/2021", 20.00],
+        ]
+        new_rows = [["03/01/2021", 30.00]]
+        mock_client, mock_worksheet = self.make_client(data)
+        mock_worksheet.get_values = MagicMock(side_effect=[data, new_rows])
+        cache = SpreadsheetCache(ttl=0)
+        spreadsheet = Spreadsheet(mock_client, "bogus url", cache)
+
+        # act
+        spreadsheet.get_spending_dataframe()
+        dframe = spreadsheet.get_spending_dataframe()
+
+        # assert
+        self.assertEqual(mock_worksheet.get_values.call_args_list[0].args, ("A:B",))
+        self.assertEqual(mock_worksheet.get_values.call_args_list[1].args, ("A4:B",))
+        self.assertEqual(len(dframe), 3)
+        self.assertEqual(dframe["Spend"].sum(), 60.00)
+
+    def test_badly_ordered_new_rows_read_everything(self):
+        # arrange
+        data = [
+            ["Date", "Spend"],
+            ["01/01/2021", 10.00],
+            ["02/01/2021", 20.00],
+        ]
+        new_rows = [["01/01/2021", 30.00]]
+        mock_client, mock_worksheet = self.make_client(data)
+        mock_worksheet.get_values = MagicMock(side_effect=[data, new_rows, data])
+        cache = SpreadsheetCache(ttl=0)
+        spreadsheet = Spreadsheet(mock_client, "bogus url", cache)
+
+        # act
+        spreadsheet.get_spending_dataframe()
+        dframe = spreadsheet.get_spending_dataframe()
+
+        # assert
+        self.assertEqual(mock_worksheet.get_values.call_count, 3)
+        self.assertEqual(len(dframe), 2)
+
+    def test_opens_sheet_once(self):
+        # arrange
+        data = [["Date", "Spend"], ["01/01/2021", 10.00]]
+        mock_client, mock_worksheet = self.make_client(data)
+        cache = SpreadsheetCache()
+
+        # act
+        Spreadsheet(mock_client, "bogus url", cache).get_sheet1()
+        Spreadsheet(mock_client, "bogus url", cache).get_sheet1()
+
+        # assert
+        mock_client.open_by_url.assert_called_once()
+        self.assertEqual(mock_worksheet.get_values.call_count, 2)
+
+    def test_reopens_sheet_when_not_found(self):
+        # arrange
+        data = [["Date", "Spend"], ["01/01/2021", 10.00]]
+        mock_client, mock_worksheet = self.make_client(data)
+        cache = SpreadsheetCache()
+        stale_worksheet = MagicMock()
+        response = MagicMock()
+        response.status_code = 404
+        response.json = MagicMock(
+            return_value={"error": {"code": 404, "message": "Not found"}}
+        )
+        stale_worksheet.get_values = MagicMock(side_effect=APIError(response))
+        spreadsheet = Spreadsheet(mock_client, "bogus url", cache)
+        cache.set_worksheet(spreadsheet.spreadsheet_id, stale_worksheet)
+
+        # act
+        actual = spreadsheet.get_sheet1()
+
+        # assert
+        self.assertEqual(actual, data)
+        mock_client.open_by_url.assert_called_once()
+        self.assertIs(cache.get_worksheet(spreadsheet.spreadsheet_id), mock_worksheet)
+
+
+class TestAsyncSpreadsheet(unittest.IsolatedAsyncioTestCase):
+    async def test_runs_on_executor(self):
+        # arrange
+        data = [
+            ["Date", "Spend"],
+            ["01/01/2021", 10.00],
+        ]
+        threads = []
+        mock_worksheet = MagicMock()
+
+        def get_values(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return data
+
+        mock_worksheet.get_values = get_values
+        mock_spreadsheet = MagicMock()
+        mock_spreadsheet.sheet1 = mock_worksheet
+        mock_client = MagicMock()
+        mock_client.open_by_url = MagicMock(return_value=mock_spreadsheet)
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="spreadsheet"
+        )
+        spreadsheet = AsyncSpreadsheet(Spreadsheet(mock_client, "bogus url"), executor)
+
+        # act
+        dframe = await spreadsheet.get_spending_dataframe()
+        executor.shutdown()
+
+        # assert
+        self.assertEqual(len(dframe), 1)
+        self.assertTrue(threads[0].startswith("spreadsheet"))
@@ -0,0 +1,121 @@
+import unittest
+from unittest.mock import MagicMock, AsyncMock, patch
+import os
+import sys
+import pandas
+import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from budgeter.aggregates import SpendingAggregates
+from budgeter.charts import ChartCache, DAILY
+from budgeter.bothandlers.stats import stats, reply_with_graphs
+
+
+class FakeContext:
+    def __init__(self, user_data, bot_data):
+        self.user_data = user_data
+        self.bot_data = bot_data
+
+
+def make_update():
+    update = MagicMock()
+    update.effective_chat.send_action = AsyncMock()
+    update.message.reply_text = AsyncMock()
+    update.message.reply_html = AsyncMock()
+    update.message.reply_photo = AsyncMock(
+        return_value=MagicMock(photo=[MagicMock(file_id="photo")])
+    )
+    update.message.reply_media_group = AsyncMock(
+        side_effect=lambda media: [
+            MagicMock(photo=[MagicMock(file_id=f"photo{i}")]) for i in range(len(media))
+        ]
+    )
+    return update
+
+
+class TestReplyWithGraphs(unittest.IsolatedAsyncioTestCase):
+    async def test_one_graph_is_a_photo(self):
+        # arrange
+        update = make_update()
+        chart_cache = ChartCache()
+        chart_cache.set_png("key", b"png")
+        context = FakeContext({}, {"chart_cache": chart_cache})
+
+        # act
+        await reply_with_graphs(update, context, "statistics", [("key", b"png")])
+
+        # assert
+        # an album of one photo is rejected by Telegram
+        update.message.reply_media_group.assert_not_awaited()
+        update.message.reply_photo.assert_awaited_once_with(
+            b"png", caption="statistics", parse_mode="HTML"
+        )
+        self.assertEqual(chart_cache.get("key"), (b"png", "photo"))
+
+    async def test_several_graphs_are_an_album(self):
+        # arrange
+        update = make_update()
+        context = FakeContext({}, {})
+
+        # act
+        await reply_with_graphs(
+            update, context, "statistics", [("a", b"png"), ("b", "file_id")]
+        )
+
+        # assert
+        media = update.message.reply_media_group.call_args.args[0]
+        self.assertEqual(len(media), 2)
+        self.assertEqual(media[0].caption, "statistics")
+        update.message.reply_photo.assert_not_awaited()
+
+    async def test_no_graphs(self):
+        # arrange
+        update = make_update()
+
+        # act
+        await reply_with_graphs(update, FakeContext({}, {}), "statistics", [])
+
+        # assert
+        update.message.reply_html.assert_awaited_once_with("statistics")
+        update.message.reply_photo.assert_not_awaited()
+        update.message.reply_media_group.assert_not_awaited()
+
+
+class TestStats(unittest.IsolatedAsyncioTestCase):
+    async def test_only_one_graph_drawn(self):
+        # arrange
+        df = pandas.DataFrame(
+            {
+                "Date": pandas.date_range(datetime.datetime(2021, 1, 1), periods=50),
+                "Spend": [10.0] * 50,
+            }
+        )
+        spreadsheet = MagicMock()
+        spreadsheet.get_spending_dataframe = AsyncMock(return_value=df)
+        spreadsheet.get_spending_summary = AsyncMock(
+            return_value=SpendingAggregates.from_dataframe(df).summary()
+        )
+
+        async def get_graph(context, kind, dates, spends):
+            if kind != DAILY:
+                raise RuntimeError("could not draw")
+            return "daily", b"png"
+
+        update = make_update()
+        context = FakeContext({"spreadsheet_url": "url"}, {})
+
+        # act
+        with patch(
+            "budgeter.bothandlers.stats.open_spreadsheet", return_value=spreadsheet
+        ), patch("budgeter.bothandlers.stats.get_graph", get_graph):
+            await stats(update, context)
+
+        # assert
+        update.message.reply_photo.assert_awaited_once()
+        caption = update.message.reply_photo.call_args.kwargs["caption"]
+        self.assertIn("Error generating zoomed graph: could not draw", caption)
+        update.message.reply_media_group.assert_not_awaited()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+import unittest
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import concurrent.futures
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from budgeter.tracing import (
+    Tracer,
+    span,
+    traced,
+    traced_job,
+    run_in_context,
+    MAX_SPANS,
+    CLIENT,
+    STATUS_ERROR,
+)
+
+
+@traced("test.add")
+def add(a, b):
+    with span("test.inner"):
+        return a + b
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        # only slow traces are logged, so nothing by default
+        self.tracer = Tracer(slow_threshold=60)
+
+    def test_span_without_trace_does_nothing(self):
+        with span("test.outside") as outside:
+            self.assertIsNone(outside)
+        self.assertEqual(add(1, 2), 3)
+
+    def test_nested_spans(self):
+        # act
+        with self.tracer.trace("update", user_id=1) as root:
+            with span("sheets.get_values", CLIENT, rows=2) as child:
+                add(1, 2)
+
+        # assert
+        names = [(s.name, s.parent_id) for s in root.trace.spans]
+        spans = {s.name: s for s in root.trace.spans}
+        self.assertEqual(
+            names,
+            [
+                ("update", None),
+                ("sheets.get_values", root.span_id),
+                ("test.add", child.span_id),
+                ("test.inner", spans["test.add"].span_id),
+            ],
+        )
+        self.assertTrue(all(s.duration is not None for s in root.trace.spans))
+        self.assertEqual(child.attributes, {"rows": 2})
+
+    def test_error_is_recorded(self):
+        # act
+        with self.assertRaises(ZeroDivisionError):
+            with self.tracer.trace("update") as root:
+                with span("test.divide"):
+                    1 / 0
+
+        # assert
+        self.assertIn("ZeroDivisionError", root.trace.spans[1].error)
+        self.assertIn("ZeroDivisionError", root.error)
+
+    def test_run_in_context_on_thread(self):
+        # arrange
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+        async def on_thread():
+            loop = asyncio.get_running_loop()
+            with self.tracer.trace("update") as root:
+                await loop.run_in_executor(executor, run_in_context(add, 1, 2))
+            return root
+
+        # act
+        root = asyncio.run(on_thread())
+        executor.shutdown()
+
+        # assert
+        self.assertEqual(
+            [s.name for s in root.trace.spans], ["update", "test.add", "test.inner"]
+        )
+
+    def test_no_spans_after_finish(self):
+        # arrange
+        with self.tracer.trace("update") as root:
+            pass
+
+        # act
+        # e.g., a task started while handling the update, which finishes after it
+        late = root.trace.start_span("test.late", root)
+
+        # assert
+        self.assertIsNone(late)
+        self.assertEqual(len(root.trace.spans), 1)
+
+    def test_max_spans(self):
+        # act
+        with self.tracer.trace("job") as root:
+            for _ in range(MAX_SPANS + 10):
+                with span("telegram.sendMessage"):
+                    pass
+
+        # assert
+        self.assertEqual(len(root.trace.spans), MAX_SPANS)
+        self.assertEqual(root.trace.dropped_spans, 11)
+        self.assertEqual(root.trace.to_log()["dropped_spans"], 11)
+
+    def test_traced_job_starts_its_own_trace(self):
+        # arrange
+        @traced_job
+        async def job(context):
+            with span("test.in_job") as in_job:
+                return in_job
+
+        async def run():
+            with self.tracer.trace("update") as root:
+                in_job = await job(None)
+            return root, in_job
+
+        # act
+        root, in_job = asyncio.run(run())
+
+        # assert
+        self.assertIsNot(in_job.trace, root.trace)
+        self.assertEqual(in_job.trace.root.name, "job.job")
+
+    def test_slow_traces_are_logged(self):
+        # arrange
+        tracer = Tracer(slow_threshold=0)
+
+        # act
+        with self.assertLogs("budgeter.tracing", level="WARNING") as logs:
+            with tracer.trace("update", command="/stats"):
+                add(1, 2)
+
+        # assert
+        logged = json.loads(logs.records[0].getMessage().split(": ", 1)[1])
+        self.assertEqual(logged["attributes"], {"command": "/stats"})
+        self.assertEqual(
+            [s["name"] for s in logged["spans"]], ["test.add", "test.inner"]
+        )
+
+    def test_otlp_export(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "traces.jsonl")
+            tracer = Tracer(slow_threshold=60, export_path=path)
+
+            # act
+            with tracer.trace("update", user_id=1):
+                with span("sheets.open", CLIENT):
+                    pass
+            with self.assertRaises(ValueError):
+                with tracer.trace("update"):
+                    raise ValueError("bad")
+            with open(path) as file:
+                lines = [json.loads(line) for line in file]
+
+        # assert
+        self.assertEqual(len(lines), 2)
+        resource_spans = lines[0]["resourceSpans"][0]
+        self.assertEqual(
+            resource_spans["resource"]["attributes"][0]["value"]["stringValue"],
+            "telegram-budgeter",
+        )
+        root, child = resource_spans["scopeSpans"][0]["spans"]
+        self.assertEqual(root["parentSpanId"], "")
+        self.assertEqual(child["parentSpanId"], root["spanId"])
+        self.assertEqual(child["traceId"], root["traceId"])
+        self.assertEqual(len(root["traceId"]), 32)
+        self.assertEqual(child["kind"], CLIENT)
+        self.assertEqual(
+            root["attributes"], [{"key": "user_id", "value": {"intValue": "1"}}]
+        )
+        self.assertLessEqual(
+            int(root["startTimeUnixNano"]), int(child["startTimeUnixNano"])
+        )
+        failed = lines[1]["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+        self.assertEqual(failed["status"]["code"], STATUS_ERROR)
+
+
+if __name__ == "__main__":
+    unittest.main()